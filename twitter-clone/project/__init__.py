@@ -1 +1 @@
-from . import client, server, tests
+from . import benchmarks, client, server, tests
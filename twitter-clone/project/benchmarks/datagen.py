@@ -0,0 +1,484 @@
+"""
+Synthetic data for benchmarks: users, tweets, likes, follows and media with
+power-law distributions (a few celebrity accounts have most of followers and
+tweets, a few viral tweets have most of likes). Rows are generated in worker
+processes and streamed with COPY over parallel connections; foreign keys and
+secondary indexes are dropped for the load and rebuilt afterwards.
+
+    python -m project.benchmarks.datagen --users 1000000 --tweets 10000000 \\
+        --likes 50000000 --follows 20000000 --media 1000000 --workers 8
+
+The most popular account is user 1, api keys are "user<id>".
+Drops and recreates all tables of DATABASE_URL.
+"""
+
+import argparse
+import asyncio
+import datetime
+import hashlib
+import logging
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Set, Tuple
+
+import asyncpg  # type: ignore
+from sqlalchemy import update
+
+from project.server.main import database
+from project.server.main.config import Settings, get_settings
+
+# Initialize logging
+logger_datagen = logging.getLogger("logger_datagen")
+
+# setting environment
+settings: Settings = get_settings()
+
+# any prime spreads popular ranks over ids (viral tweets are not the oldest ones)
+SCATTER_PRIME = 1_000_003
+
+WORDS = (
+    "the of and to in is you that it he was for on are as with his they at be "
+    "this have from or one had by word but not what all were we when your can "
+    "said there use an each which she do how their if will up other about out "
+    "many then them these so some her would make like him into time has look "
+    "two more write go see number no way could people my than first water been"
+).split()
+
+COLUMNS = {
+    "users": ("id", "name", "api_key", "date_of_registration"),
+    "tweets": ("id", "content", "attachments", "author", "date_tweet"),
+    "likes": ("tweet_id", "follower_id", "date_like"),
+    "follow_relations": ("follower_id", "following_id", "date_follow"),
+    "media_blobs": ("sha256", "file_name", "content_type", "size", "ref_count"),
+    "media_attachments": (
+        "id",
+        "tweet_id",
+        "file_name",
+        "local_path",
+        "host_path",
+        "blob_sha256",
+        "created_at",
+    ),
+}
+
+Records = Dict[str, List[tuple]]
+
+# home timelines of users $1..$2: own tweets and, like after a follow (see
+# HomeTimeline.backfill), recent tweets of followed accounts fanned out on write
+TIMELINE_SQL = (
+    "INSERT INTO home_timeline (user_id, tweet_id, score) "
+    "SELECT author, id, id FROM tweets WHERE author BETWEEN $1 AND $2 "
+    "UNION ALL "
+    "SELECT f.follower_id, t.id, t.id FROM follow_relations f "
+    "JOIN users u ON u.id = f.following_id AND NOT u.fanout_on_read "
+    "CROSS JOIN LATERAL ("
+    "  SELECT id FROM tweets WHERE author = f.following_id ORDER BY id DESC LIMIT $3"
+    ") t "
+    "WHERE f.follower_id BETWEEN $1 AND $2"
+)
+
+
+@dataclass(frozen=True)
+class DataSizes:
+    users: int = 10000
+    tweets: int = 100000
+    likes: int = 500000
+    follows: int = 200000
+    media: int = 10000
+    # exponent of power laws: 0 is uniform, 1 is Zipf
+    skew: float = 1.0
+    # tweets are spread over the last days
+    days: int = 365
+    seed: int = 0
+
+
+def power_law_rank(rng: random.Random, n: int, skew: float) -> int:
+    """
+    Rank 1..n drawn from a bounded power law, rank 1 is the most popular
+    """
+    if skew == 1.0:
+        rank = (n + 1) ** rng.random()
+    else:
+        exponent = 1.0 - skew
+        rank = (((n + 1) ** exponent - 1) * rng.random() + 1) ** (1 / exponent)
+    return min(int(rank), n)
+
+
+def scatter(rank: int, n: int) -> int:
+    """
+    Id 1..n for a rank, a bijection which spreads neighbouring ranks
+    """
+    if math.gcd(SCATTER_PRIME, n) != 1:
+        return rank
+    return 1 + (rank - 1) * SCATTER_PRIME % n
+
+
+def activity(rng: random.Random, mean: float, limit: int) -> int:
+    """
+    Heavy-tailed number of actions of one user with the given mean
+    """
+    # mean of Pareto distribution with alpha 1.5 is 3
+    return min(round(mean * rng.paretovariate(1.5) / 3), limit)
+
+
+def distinct_targets(
+    rng: random.Random, count: int, n: int, skew: float, spread: bool
+) -> Set[int]:
+    """
+    count distinct ids 1..n drawn from a power law
+    """
+    if count * 2 > n:
+        return set(rng.sample(range(1, n + 1), count))
+    targets: Set[int] = set()
+    attempts = count * 10
+    while len(targets) < count and attempts:
+        rank = power_law_rank(rng, n, skew)
+        targets.add(scatter(rank, n) if spread else rank)
+        attempts -= 1
+    # popular ids are exhausted: the rest is uniform
+    while len(targets) < count:
+        targets.add(rng.randint(1, n))
+    return targets
+
+
+def batch_rng(sizes: DataSizes, table: str, first: int) -> random.Random:
+    return random.Random(f"{sizes.seed}-{table}-{first}")
+
+
+def tweet_date(sizes: DataSizes, tweet_id: int) -> datetime.date:
+    days_ago = sizes.days - sizes.days * tweet_id // max(sizes.tweets, 1)
+    return datetime.date.today() - datetime.timedelta(days=days_ago)
+
+
+def media_step(sizes: DataSizes) -> int:
+    """
+    Every media_step-th tweet has an attachment: media n belongs to tweet n * step
+    """
+    return max(sizes.tweets // max(sizes.media, 1), 1)
+
+
+def generate_users(sizes: DataSizes, first: int, last: int) -> Records:
+    rng = batch_rng(sizes, "users", first)
+    today = datetime.date.today()
+    return {
+        "users": [
+            (
+                i_id,
+                f"User {i_id}",
+                f"user{i_id}",
+                today
+                - datetime.timedelta(days=rng.randint(sizes.days, 2 * sizes.days)),
+            )
+            for i_id in range(first, last + 1)
+        ]
+    }
+
+
+def generate_tweets(sizes: DataSizes, first: int, last: int) -> Records:
+    rng = batch_rng(sizes, "tweets", first)
+    step = media_step(sizes)
+    rows: List[tuple] = []
+    for i_id in range(first, last + 1):
+        i_media_id = i_id // step
+        i_attachments = (
+            [i_media_id] if i_id % step == 0 and i_media_id <= sizes.media else []
+        )
+        rows.append(
+            (
+                i_id,
+                " ".join(rng.choices(WORDS, k=rng.randint(3, 30))),
+                i_attachments,
+                power_law_rank(rng, sizes.users, sizes.skew),
+                tweet_date(sizes, i_id),
+            )
+        )
+    return {"tweets": rows}
+
+
+def generate_media(sizes: DataSizes, first: int, last: int) -> Records:
+    rng = batch_rng(sizes, "media", first)
+    step = media_step(sizes)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    blobs, media = [], []
+    for i_id in range(first, last + 1):
+        i_sha256 = hashlib.sha256(f"media{i_id}".encode()).hexdigest()
+        i_file_name = str(database.MediaBlob.relative_path(i_sha256, "png"))
+        blobs.append((i_sha256, i_file_name, "image/png", rng.randint(10**4, 10**6), 1))
+        media.append(
+            (
+                i_id,
+                i_id * step,
+                i_file_name,
+                str(settings.media_dir_local / i_file_name),
+                str(settings.media_dir_host / i_file_name),
+                i_sha256,
+                now,
+            )
+        )
+    return {"media_blobs": blobs, "media_attachments": media}
+
+
+def generate_likes(sizes: DataSizes, first: int, last: int) -> Records:
+    """
+    Likes of users first..last: each user likes distinct tweets, so pairs are
+    unique without checks across batches
+    """
+    rng = batch_rng(sizes, "likes", first)
+    today = datetime.date.today()
+    mean = sizes.likes / sizes.users
+    rows: List[tuple] = []
+    for i_user_id in range(first, last + 1):
+        i_count = activity(rng, mean, sizes.tweets)
+        for i_tweet_id in distinct_targets(
+            rng, i_count, sizes.tweets, sizes.skew, spread=True
+        ):
+            rows.append((i_tweet_id, i_user_id, today))
+    return {"likes": rows}
+
+
+def generate_follows(sizes: DataSizes, first: int, last: int) -> Records:
+    """
+    Follows of users first..last, popular accounts have the lowest ids
+    """
+    rng = batch_rng(sizes, "follows", first)
+    today = datetime.date.today()
+    mean = sizes.follows / sizes.users
+    rows: List[tuple] = []
+    for i_user_id in range(first, last + 1):
+        i_count = activity(rng, mean, sizes.users - 1)
+        i_following = distinct_targets(
+            rng, i_count, sizes.users, sizes.skew, spread=False
+        )
+        i_following.discard(i_user_id)
+        rows.extend(
+            (i_user_id, i_following_id, today) for i_following_id in i_following
+        )
+    return {"follow_relations": rows}
+
+
+async def drop_constraints(
+    conn: asyncpg.Connection, tables: Tuple[str, ...], primary_keys: bool = False
+) -> Tuple[List[str], List[str]]:
+    """
+    Drop foreign keys, secondary indexes (which do not back constraints) and
+    optionally primary keys of tables, return statements restoring indexes
+    (with primary keys) and foreign keys
+    """
+    constraints = await conn.fetch(
+        "SELECT conrelid::regclass::text AS table_name, conname, contype::text, "
+        "pg_get_constraintdef(oid) AS definition FROM pg_constraint "
+        "WHERE conrelid::regclass::text = ANY($1::text[]) AND contype::text = ANY($2::text[])",
+        list(tables),
+        ["f", "p"] if primary_keys else ["f"],
+    )
+    indexes = await conn.fetch(
+        "SELECT indexname, indexdef FROM pg_indexes i "
+        "WHERE schemaname = 'public' AND tablename = ANY($1::text[]) "
+        "AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conname = i.indexname)",
+        list(tables),
+    )
+    for i_key in constraints:
+        await conn.execute(
+            f'ALTER TABLE {i_key["table_name"]} DROP CONSTRAINT "{i_key["conname"]}"'
+        )
+    for i_index in indexes:
+        await conn.execute(f'DROP INDEX "{i_index["indexname"]}"')
+
+    def add_constraint(contype: str) -> List[str]:
+        return [
+            f'ALTER TABLE {i_key["table_name"]} ADD CONSTRAINT "{i_key["conname"]}" '
+            f'{i_key["definition"]}'
+            for i_key in constraints
+            if i_key["contype"] == contype
+        ]
+
+    return (
+        add_constraint("p") + [i_index["indexdef"] for i_index in indexes],
+        add_constraint("f"),
+    )
+
+
+async def restore_constraints(
+    pool: asyncpg.Pool, indexes: List[str], foreign_keys: List[str]
+) -> None:
+    """
+    Build indexes in parallel, then validate foreign keys
+    """
+    await asyncio.gather(*(pool.execute(i_index) for i_index in indexes))
+    for i_foreign_key in foreign_keys:
+        await pool.execute(i_foreign_key)
+
+
+async def copy_batches(
+    pool: asyncpg.Pool,
+    executor: ProcessPoolExecutor,
+    generate: Callable[[DataSizes, int, int], Records],
+    sizes: DataSizes,
+    total: int,
+    batch_size: int,
+    limit: asyncio.Semaphore,
+) -> int:
+    """
+    Generate rows 1..total in batches in worker processes, COPY them on
+    parallel connections. Return the number of copied rows
+    """
+    loop = asyncio.get_running_loop()
+
+    async def copy_batch(first: int) -> int:
+        # bounded: generated batches do not pile up in memory
+        async with limit:
+            last = min(first + batch_size - 1, total)
+            records = await loop.run_in_executor(executor, generate, sizes, first, last)
+            async with pool.acquire() as conn:
+                for i_table, i_rows in records.items():
+                    await conn.copy_records_to_table(
+                        i_table, records=i_rows, columns=COLUMNS[i_table]
+                    )
+            return sum(len(i_rows) for i_rows in records.values())
+
+    copied = await asyncio.gather(
+        *(copy_batch(i_first) for i_first in range(1, total + 1, batch_size))
+    )
+    return sum(copied)
+
+
+async def populate(sizes: DataSizes, workers: int, batch_size: int) -> Dict[str, int]:
+    """
+    Recreate tables and fill them with synthetic data,
+    return the number of rows by table
+    """
+    started = time.perf_counter()
+    async with database.engine.begin() as conn:
+        await conn.run_sync(database.Base.metadata.drop_all)
+        await conn.run_sync(database.Base.metadata.create_all)
+
+    dsn = database.engine.url.set(drivername="postgresql").render_as_string(
+        hide_password=False
+    )
+    pool = await asyncpg.create_pool(dsn, min_size=workers, max_size=workers)
+    try:
+        async with pool.acquire() as conn:
+            indexes, foreign_keys = await drop_constraints(conn, tuple(COLUMNS))
+            timeline_indexes, timeline_foreign_keys = await drop_constraints(
+                conn, ("home_timeline",), primary_keys=True
+            )
+
+        # likes and follows are generated by users: batches of fewer users
+        per_user = {
+            "likes": max(batch_size * sizes.users // max(sizes.likes, 1), 1),
+            "follows": max(batch_size * sizes.users // max(sizes.follows, 1), 1),
+        }
+        generators: List[Tuple[str, Callable[[DataSizes, int, int], Records], int]] = [
+            ("users", generate_users, sizes.users),
+            ("tweets", generate_tweets, sizes.tweets),
+            ("media", generate_media, min(sizes.media, sizes.tweets)),
+            ("likes", generate_likes, sizes.users if sizes.likes else 0),
+            ("follows", generate_follows, sizes.users if sizes.follows else 0),
+        ]
+        limit = asyncio.Semaphore(workers * 2)
+        rows: Dict[str, int] = dict()
+        with ProcessPoolExecutor(workers) as executor:
+            for i_name, i_generate, i_total in generators:
+                i_started = time.perf_counter()
+                rows[i_name] = await copy_batches(
+                    pool,
+                    executor,
+                    i_generate,
+                    sizes,
+                    i_total,
+                    per_user.get(i_name, batch_size),
+                    limit,
+                )
+                logger_datagen.info(
+                    "!!! %s %s rows copied in %.1fs",
+                    rows[i_name],
+                    i_name,
+                    time.perf_counter() - i_started,
+                )
+
+        index_started = time.perf_counter()
+        await restore_constraints(pool, indexes, foreign_keys)
+        for i_table in ("users", "tweets", "media_attachments"):
+            await pool.execute(
+                f"SELECT setval(pg_get_serial_sequence('{i_table}', 'id'), "
+                f"(SELECT coalesce(max(id), 0) + 1 FROM {i_table}), false)"
+            )
+        await pool.execute("ANALYZE")
+        logger_datagen.info(
+            "!!! Indexes and sequences rebuilt in %.1fs",
+            time.perf_counter() - index_started,
+        )
+
+        timeline_started = time.perf_counter()
+        async with database.async_session() as _session:
+            await database.repair_counters(_session)
+            await _session.execute(
+                update(database.User)
+                .where(database.User.followers_count > settings.fanout_followers_max)
+                .values(fanout_on_read=True)
+            )
+            await _session.commit()
+        step = max(sizes.users // (workers * 4), 1)
+        await asyncio.gather(
+            *(
+                pool.execute(
+                    TIMELINE_SQL,
+                    i_first,
+                    i_first + step - 1,
+                    settings.timeline_backfill_size,
+                )
+                for i_first in range(1, sizes.users + 1, step)
+            )
+        )
+        # home timelines are filled without indexes, like the loaded tables
+        await restore_constraints(pool, timeline_indexes, timeline_foreign_keys)
+        await pool.execute("ANALYZE home_timeline")
+        logger_datagen.info(
+            "!!! Counters and home timelines built in %.1fs, total %.1fs",
+            time.perf_counter() - timeline_started,
+            time.perf_counter() - started,
+        )
+    finally:
+        await pool.close()
+    return rows
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    defaults = DataSizes()
+    parser.add_argument("--users", type=int, default=defaults.users)
+    parser.add_argument("--tweets", type=int, default=defaults.tweets)
+    parser.add_argument("--likes", type=int, default=defaults.likes)
+    parser.add_argument("--follows", type=int, default=defaults.follows)
+    parser.add_argument("--media", type=int, default=defaults.media)
+    parser.add_argument("--skew", type=float, default=defaults.skew)
+    parser.add_argument("--days", type=int, default=defaults.days)
+    parser.add_argument("--random-seed", type=int, default=defaults.seed)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--batch-size", type=int, default=50000)
+    return parser.parse_args()
+
+
+async def main() -> None:
+    args = parse_args()
+    sizes = DataSizes(
+        users=args.users,
+        tweets=args.tweets,
+        likes=args.likes,
+        follows=args.follows,
+        media=args.media,
+        skew=args.skew,
+        days=args.days,
+        seed=args.random_seed,
+    )
+    rows = await populate(sizes, args.workers, args.batch_size)
+    await database.engine.dispose()
+    print(rows)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
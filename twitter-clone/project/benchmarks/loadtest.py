@@ -0,0 +1,353 @@
+"""
+Load test of the service: concurrent virtual users with a mix of feed reads,
+likes, follows, tweets and media uploads. Runs in-process (httpx ASGITransport
+over create_app) or against a running server, prints a JSON report with
+throughput and p50/p95/p99 latency per endpoint.
+
+    python -m project.benchmarks.loadtest --seed --seed-users 100000 \\
+        --seed-likes 10000000 --concurrency 50 --duration 60 --output report.json
+    python -m project.benchmarks.loadtest --url http://localhost:8080 --duration 60
+
+Seeding (see datagen) drops and recreates all tables of DATABASE_URL.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import logging
+import random
+import subprocess
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List
+
+import orjson
+from httpx import ASGITransport, AsyncClient, HTTPError
+from PIL import Image
+
+from project.benchmarks.datagen import DataSizes, populate
+from project.server.main.config import Settings, get_settings
+
+# Initialize logging
+logger_bench = logging.getLogger("logger_bench")
+
+# setting environment
+settings: Settings = get_settings()
+
+ACTIONS = ("feed", "like", "unlike", "follow", "unfollow", "tweet", "media")
+DEFAULT_MIX = "feed=60,like=12,unlike=3,follow=8,unfollow=2,tweet=10,media=5"
+
+
+@dataclass
+class BenchConfig:
+    url: str | None = None
+    concurrency: int = 20
+    duration: float = 30.0
+    mix: Dict[str, float] = field(default_factory=dict)
+    users: int = 1000
+    tweets: int = 10000
+    seed: int = 0
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    """
+    Weights of actions: "feed=60,like=15,..."
+    """
+    weights = dict()
+    for i_item in mix.split(","):
+        i_name, _, i_weight = i_item.partition("=")
+        if i_name.strip() not in ACTIONS:
+            raise ValueError(f"Unknown action: {i_name}")
+        weights[i_name.strip()] = float(i_weight)
+    return weights
+
+
+def percentile(values: List[float], share: float) -> float:
+    """
+    Nearest-rank percentile of sorted values
+    """
+    if not values:
+        return 0.0
+    rank = max(int(round(share * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+class Recorder:
+    """
+    Latencies and errors per endpoint
+    """
+
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.statuses: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def record(self, endpoint: str, latency: float, status_code: int | None) -> None:
+        self.latencies[endpoint].append(latency)
+        if status_code is None or status_code >= 500:
+            self.errors[endpoint] += 1
+        self.statuses[endpoint][str(status_code or "failed")] += 1
+
+    def report(self, elapsed: float) -> Dict[str, Any]:
+        endpoints: Dict[str, Dict[str, Any]] = dict()
+        for i_endpoint, i_latencies in sorted(self.latencies.items()):
+            i_latencies.sort()
+            endpoints[i_endpoint] = {
+                "requests": len(i_latencies),
+                "errors": self.errors[i_endpoint],
+                "statuses": dict(self.statuses[i_endpoint]),
+                "throughput": round(len(i_latencies) / elapsed, 2),
+                "mean_ms": round(1000 * sum(i_latencies) / len(i_latencies), 2),
+                "p50_ms": round(1000 * percentile(i_latencies, 0.50), 2),
+                "p95_ms": round(1000 * percentile(i_latencies, 0.95), 2),
+                "p99_ms": round(1000 * percentile(i_latencies, 0.99), 2),
+                "max_ms": round(1000 * i_latencies[-1], 2),
+            }
+        total = sum(i_endpoint["requests"] for i_endpoint in endpoints.values())
+        return {
+            "elapsed_s": round(elapsed, 2),
+            "requests": total,
+            "errors": sum(self.errors.values()),
+            "throughput": round(total / elapsed, 2),
+            "endpoints": endpoints,
+        }
+
+
+class VirtualUser:
+    """
+    A client acting as one random seeded user per request
+    """
+
+    def __init__(
+        self,
+        client: AsyncClient,
+        recorder: Recorder,
+        config: BenchConfig,
+        images: List[bytes],
+        rng: random.Random,
+    ) -> None:
+        self.client = client
+        self.recorder = recorder
+        self.config = config
+        self.images = images
+        self.rng = rng
+        self.cursors: Dict[str, int] = dict()
+
+    def api_key(self) -> str:
+        return f"user{self.rng.randint(1, self.config.users)}"
+
+    async def request(self, endpoint: str, method: str, url: str, **kwargs) -> Any:
+        started = time.perf_counter()
+        status_code = None
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            status_code = response.status_code
+            return response
+        except HTTPError as exc:
+            logger_bench.error("!!! %s %s failed: %s", method, url, exc)
+            return None
+        finally:
+            self.recorder.record(endpoint, time.perf_counter() - started, status_code)
+
+    async def feed(self) -> None:
+        api_key = self.api_key()
+        params = dict()
+        # a part of users scroll to the next page
+        if api_key in self.cursors and self.rng.random() < 0.3:
+            params["before"] = self.cursors.pop(api_key)
+        response = await self.request(
+            "GET /api/tweets",
+            "GET",
+            "/api/tweets",
+            headers={"api-key": api_key},
+            params=params,
+        )
+        if response is not None and response.status_code == 200:
+            next_cursor = response.json().get("next_cursor")
+            if next_cursor is not None:
+                self.cursors[api_key] = next_cursor
+
+    async def like(self) -> None:
+        await self.request(
+            "POST /api/tweets/{tweet_id}/likes",
+            "POST",
+            f"/api/tweets/{self.rng.randint(1, self.config.tweets)}/likes",
+            headers={"api-key": self.api_key()},
+        )
+
+    async def unlike(self) -> None:
+        await self.request(
+            "DELETE /api/tweets/{tweet_id}/likes",
+            "DELETE",
+            f"/api/tweets/{self.rng.randint(1, self.config.tweets)}/likes",
+            headers={"api-key": self.api_key()},
+        )
+
+    async def follow(self) -> None:
+        await self.request(
+            "POST /api/users/{user_id}/follow",
+            "POST",
+            f"/api/users/{self.rng.randint(1, self.config.users)}/follow",
+            headers={"api-key": self.api_key()},
+        )
+
+    async def unfollow(self) -> None:
+        await self.request(
+            "DELETE /api/users/{user_id}/follow",
+            "DELETE",
+            f"/api/users/{self.rng.randint(1, self.config.users)}/follow",
+            headers={"api-key": self.api_key()},
+        )
+
+    async def tweet(self) -> None:
+        await self.request(
+            "POST /api/tweets",
+            "POST",
+            "/api/tweets",
+            headers={"api-key": self.api_key()},
+            json={"tweet_data": "Benchmark tweet", "tweet_media_ids": None},
+        )
+
+    async def media(self) -> None:
+        await self.request(
+            "POST /api/medias",
+            "POST",
+            "/api/medias",
+            headers={"api-key": self.api_key()},
+            files={"file": ("bench.png", self.rng.choice(self.images), "image/png")},
+        )
+
+    async def run(self, deadline: float) -> None:
+        actions: List[Callable[[], Awaitable[None]]] = [
+            getattr(self, i_name) for i_name in self.config.mix
+        ]
+        weights = list(self.config.mix.values())
+        while time.perf_counter() < deadline:
+            await self.rng.choices(actions, weights)[0]()
+
+
+def make_images(count: int, rng: random.Random) -> List[bytes]:
+    """
+    Small PNG images with random colors (a few of them are shared by uploads)
+    """
+    images = []
+    for _ in range(count):
+        image = io.BytesIO()
+        color = tuple(rng.randrange(256) for _ in range(3))
+        Image.new("RGB", (320, 240), color=color).save(image, format="PNG")
+        images.append(image.getvalue())
+    return images
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmark(config: BenchConfig) -> Dict[str, Any]:
+    rng = random.Random(config.seed)
+    recorder = Recorder()
+    images = make_images(10, rng)
+
+    async with contextlib.AsyncExitStack() as stack:
+        if config.url:
+            client = AsyncClient(base_url=config.url, timeout=30.0)
+        else:
+            from project.server.main.app import create_app
+
+            app = create_app()
+            # the lifespan of the app is not run by the transport
+            await stack.enter_async_context(app.router.lifespan_context(app))
+            client = AsyncClient(
+                transport=ASGITransport(app=app),
+                base_url=settings.base_url or "http://bench",
+                timeout=30.0,
+            )
+
+        async with client:
+            virtual_users = [
+                VirtualUser(
+                    client, recorder, config, images, random.Random(rng.random())
+                )
+                for _ in range(config.concurrency)
+            ]
+            started = time.perf_counter()
+            deadline = started + config.duration
+            await asyncio.gather(*(i_user.run(deadline) for i_user in virtual_users))
+            elapsed = time.perf_counter() - started
+
+    return {
+        "commit": git_commit(),
+        "target": config.url or "in-process",
+        "concurrency": config.concurrency,
+        "duration_s": config.duration,
+        "mix": config.mix,
+        "data": {"users": config.users, "tweets": config.tweets},
+        **recorder.report(elapsed),
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", help="running server, in-process app if omitted")
+    parser.add_argument("--concurrency", type=int, default=20, help="virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="weights of actions")
+    parser.add_argument("--random-seed", type=int, default=0)
+    parser.add_argument("--output", help="write JSON report to file")
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+
+    seeding = parser.add_argument_group("data (users/tweets are also request ranges)")
+    seeding.add_argument("--seed", action="store_true", help="recreate and fill DB")
+    seeding.add_argument("--seed-users", type=int, default=1000)
+    seeding.add_argument("--seed-tweets", type=int, default=10000)
+    seeding.add_argument("--seed-likes", type=int, default=50000)
+    seeding.add_argument("--seed-follows", type=int, default=20000)
+    seeding.add_argument("--seed-media", type=int, default=1000)
+    seeding.add_argument("--seed-workers", type=int, default=4)
+    return parser.parse_args()
+
+
+async def main() -> None:
+    args = parse_args()
+    if not args.verbose:
+        logging.disable(logging.INFO)
+    config = BenchConfig(
+        url=args.url,
+        concurrency=args.concurrency,
+        duration=args.duration,
+        mix=parse_mix(args.mix),
+        users=args.seed_users,
+        tweets=args.seed_tweets,
+        seed=args.random_seed,
+    )
+    if args.seed:
+        sizes = DataSizes(
+            users=args.seed_users,
+            tweets=args.seed_tweets,
+            likes=args.seed_likes,
+            follows=args.seed_follows,
+            media=args.seed_media,
+            seed=args.random_seed,
+        )
+        await populate(sizes, args.seed_workers, batch_size=50000)
+
+    report = await run_benchmark(config)
+    output = orjson.dumps(report, option=orjson.OPT_INDENT_2)
+    if args.output:
+        with open(args.output, "wb") as file:
+            file.write(output)
+    print(output.decode())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1 +1,14 @@
-from . import app, config, database, endpoints, error_handler, schemas
+from . import (
+    app,
+    cache,
+    config,
+    database,
+    delivery,
+    endpoints,
+    error_handler,
+    images,
+    media_gc,
+    metrics,
+    schemas,
+    uploads,
+)
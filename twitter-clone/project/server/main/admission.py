@@ -0,0 +1,289 @@
+import asyncio
+import logging
+import math
+import time
+from typing import Callable, Dict
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from .cache import LRUCache, identity_cache
+from .config import Settings, get_settings
+from .metrics import (
+    Counter,
+    Gauge,
+    Histogram,
+    LabelValues,
+    engines,
+    pool_wait,
+    registry,
+)
+
+# Initialize logging
+logger_admission = logging.getLogger("logger_admission")
+
+# setting environment
+settings: Settings = get_settings()
+
+admission_rejected = registry.register(
+    Counter(
+        "admission_rejected_total",
+        "Requests rejected by admission control by endpoint class and reason",
+        ("endpoint_class", "reason"),
+    )
+)
+admission_queue_wait = registry.register(
+    Histogram(
+        "admission_queue_wait_seconds",
+        "Time waiting for a concurrency slot by endpoint class",
+        ("endpoint_class",),
+    )
+)
+
+# methods which do not change data
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class TokenBucket:
+    """
+    Token bucket: rate tokens per second up to burst, one token per request
+    """
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        """
+        Take a token: 0 if taken, otherwise seconds until a token is available
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+
+class ConcurrencyLimiter:
+    """
+    Concurrent requests of an endpoint class: requests over the limit wait for
+    a slot no longer than queue timeout
+    """
+
+    def __init__(self, limit: int, queue_timeout: float) -> None:
+        self.limit = limit
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore: asyncio.Semaphore | None = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.limit)
+        return self._semaphore
+
+    async def acquire(self) -> bool:
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self.semaphore.release()
+
+
+def endpoint_class(scope: Scope) -> str | None:
+    """
+    Endpoint class of the request: "read", "write", "upload" or "stream", None for
+    requests which are not admitted (health, metrics, docs, static and media files)
+    """
+    path = scope["path"]
+    if not path.startswith("/api/"):
+        return None
+    if path == "/api/events":
+        return "stream"
+    if scope["method"] in READ_METHODS:
+        return "read"
+    if path == "/api/medias":
+        return "upload"
+    return "write"
+
+
+def client_key(scope: Scope) -> str:
+    """
+    Known user of the api key (header or query for event streams), otherwise
+    client address set by the proxy: unknown api keys do not get own buckets
+    """
+    headers = dict(scope["headers"])
+    api_key = headers.get(b"api-key")
+    if api_key is None:
+        for i_pair in scope.get("query_string", b"").split(b"&"):
+            i_name, _, i_value = i_pair.partition(b"=")
+            if i_name == b"api_key" and i_value:
+                api_key = i_value
+    if api_key is not None:
+        user = identity_cache.get_user(api_key.decode("latin-1"))
+        if user is not None:
+            return f"user:{user.id}"
+
+    # the proxy sets the address (behind a unix socket the client is unknown),
+    # the last forwarded address is the one appended by the proxy
+    address = headers.get(b"x-real-ip")
+    if address is None and b"x-forwarded-for" in headers:
+        address = headers[b"x-forwarded-for"].split(b",")[-1].strip()
+    if address:
+        return f"address:{address.decode('latin-1')}"
+    client = scope.get("client")
+    return f"address:{client[0] if client else 'unknown'}"
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware protecting the database under overload: token bucket per api
+    key (429), concurrency limit per endpoint class and shedding while connections
+    of the pool are waited for too long (503). Limits are per process, buckets
+    are dropped when full again (idle for burst / rate seconds).
+    Event streams are rate limited only: they hold no connection while open
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self.buckets: LRUCache[str, TokenBucket] = LRUCache(
+            settings.admission_keys_max,
+            (
+                settings.admission_burst / settings.admission_rate
+                if settings.admission_rate > 0
+                else None
+            ),
+        )
+        self.limiters = {
+            i_class: ConcurrencyLimiter(i_limit, settings.admission_queue_timeout)
+            for i_class, i_limit in settings.admission_limits.items()
+        }
+        admission_middlewares.append(self)
+
+    def rate_limited(self, scope: Scope) -> float:
+        """
+        Seconds until the client may retry, 0 if the request is within its rate
+        """
+        if settings.admission_rate <= 0:
+            return 0.0
+        key = client_key(scope)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = TokenBucket(settings.admission_rate, settings.admission_burst)
+            self.buckets.set(key, bucket)
+        return bucket.take()
+
+    @staticmethod
+    def pool_overloaded() -> bool:
+        return any(
+            pool_wait(i_engine) > settings.admission_pool_wait_max
+            for i_engine in engines.values()
+        )
+
+    async def reject(
+        self,
+        scope: Scope,
+        receive: Receive,
+        send: Send,
+        endpoint: str,
+        reason: str,
+        retry_after: float,
+    ) -> None:
+        admission_rejected.inc(endpoint, reason)
+        logger_admission.info(
+            "!!! Request rejected (%s): %s %s", reason, scope["method"], scope["path"]
+        )
+        rate_limit = reason == "rate_limit"
+        response = JSONResponse(
+            status_code=429 if rate_limit else 503,
+            content={
+                "result": False,
+                "error_type": "Too Many Requests" if rate_limit else "Overloaded",
+                "error_message": f"Request rejected: {reason.replace('_', ' ')}",
+            },
+            headers={"Retry-After": str(max(math.ceil(retry_after), 1))},
+        )
+        await response(scope, receive, send)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        endpoint = endpoint_class(scope) if scope["type"] == "http" else None
+        if endpoint is None:
+            await self.app(scope, receive, send)
+            return
+
+        retry_after = self.rate_limited(scope)
+        if retry_after:
+            await self.reject(scope, receive, send, endpoint, "rate_limit", retry_after)
+            return
+
+        limiter = self.limiters.get(endpoint)
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        if self.pool_overloaded():
+            await self.reject(scope, receive, send, endpoint, "pool_wait", 1.0)
+            return
+
+        started = time.perf_counter()
+        admitted = await limiter.acquire()
+        admission_queue_wait.observe(time.perf_counter() - started, endpoint)
+        if not admitted:
+            await self.reject(scope, receive, send, endpoint, "concurrency", 1.0)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+
+
+# middlewares of created apps: their limiters are exposed in metrics
+admission_middlewares: list[AdmissionMiddleware] = []
+
+
+def _limiter_gauge(key: str) -> Callable[[], Dict[LabelValues, float]]:
+    def values() -> Dict[LabelValues, float]:
+        result: Dict[LabelValues, float] = dict()
+        for i_middleware in admission_middlewares:
+            for i_class, i_limiter in i_middleware.limiters.items():
+                result[(i_class,)] = result.get((i_class,), 0) + getattr(i_limiter, key)
+        return result
+
+    return values
+
+
+def _bucket_keys() -> Dict[LabelValues, float]:
+    return {
+        (): sum(len(i_middleware.buckets) for i_middleware in admission_middlewares)
+    }
+
+
+for _key, _documentation in (
+    ("in_flight", "Requests being handled by endpoint class"),
+    ("waiting", "Requests waiting for a concurrency slot by endpoint class"),
+    ("limit", "Concurrency limit by endpoint class"),
+):
+    registry.register(
+        Gauge(
+            f"admission_{_key}",
+            _documentation,
+            _limiter_gauge(_key),
+            ("endpoint_class",),
+        )
+    )
+registry.register(
+    Gauge("admission_rate_limited_keys", "Api keys with a token bucket", _bucket_keys)
+)
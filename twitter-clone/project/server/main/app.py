@@ -3,6 +3,7 @@ import os
 from contextlib import asynccontextmanager
 
 from fastapi import APIRouter, FastAPI, Request
+from fastapi.responses import ORJSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from sqlalchemy import inspect
@@ -10,9 +11,21 @@ from starlette.middleware.cors import CORSMiddleware
 from starlette.responses import JSONResponse
 
 from . import database
+from .admission import AdmissionMiddleware
 from .config import Settings, get_settings
-from .database import async_session, engine, insert_data, session
+from .database import (
+    async_session,
+    collect_media_garbage,
+    engine,
+    insert_data,
+    replicas,
+    session,
+)
 from .error_handler import ObjectNotFoundException, ServerException, SQLAlchemyException
+from .events import event_bus
+from .images import derivative_pool
+from .media_gc import media_collector
+from .metrics import MetricsMiddleware
 
 # setting environment
 os.environ["ENVIRONMENT"] = "dev"
@@ -56,13 +69,25 @@ def create_app() -> FastAPI:
             await insert_data(async_session)
             logger.info("!!! Database has been created successfully. ")
 
+        async def collect_media_garbage_job() -> dict[str, int]:
+            async with async_session() as _session:
+                return await collect_media_garbage(_session)
+
+        media_collector.start(collect_media_garbage_job, settings.media_gc_interval)
+
         yield
         # On shutdown: clean up and release the resources
+        await media_collector.stop()
+        await event_bus.close()
+        await derivative_pool.close()
         await session.close()
         await engine.dispose()
+        for i_replica in replicas:
+            await i_replica.engine.dispose()
 
     _app = FastAPI(
         lifespan=lifespan,
+        default_response_class=ORJSONResponse,
         title="Tweet-Clone",
         version="1.0.0",
         description=settings.base_url,
@@ -70,6 +95,9 @@ def create_app() -> FastAPI:
         openapi_url="/openapi.json",  #
         redoc_url=None,  # Disable redoc documents
     )
+    # admission inside metrics: rejected requests are counted too
+    _app.add_middleware(AdmissionMiddleware)
+    _app.add_middleware(MetricsMiddleware)
     _app.add_middleware(
         CORSMiddleware,  # type: ignore
         allow_origins=["*"],
@@ -0,0 +1,429 @@
+import logging
+import secrets
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Hashable,
+    Iterable,
+    List,
+    NamedTuple,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+import orjson
+
+from .config import Settings, get_settings
+
+try:
+    from redis import asyncio as redis_asyncio  # type: ignore
+    from redis.exceptions import RedisError  # type: ignore
+except ImportError:  # redis is optional: only needed for out-of-process cache
+    redis_asyncio = None
+    RedisError = OSError
+
+# Initialize logging
+logger_cache = logging.getLogger("logger_cache")
+
+# setting environment
+settings: Settings = get_settings()
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """
+    In-process LRU cache with a size cap and optional time to live of entries.
+    Counts hits, misses and evictions
+    """
+
+    def __init__(self, maxsize: int, ttl: float | None = None) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[K, Tuple[float, V]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: K) -> bool:
+        return self._alive(key)
+
+    def _alive(self, key: K) -> bool:
+        entry = self._data.get(key)
+        if entry is None:
+            return False
+        if self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+            del self._data[key]
+            return False
+        return True
+
+    def get(self, key: K, default: Any = None) -> Any:
+        if not self._alive(key):
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data.move_to_end(key)
+        return self._data[key][1]
+
+    def set(self, key: K, value: V) -> list[K]:
+        """
+        Store the value and return keys evicted to keep the size cap
+        """
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        evicted = []
+        while len(self._data) > self.maxsize:
+            evicted_key, _ = self._data.popitem(last=False)
+            evicted.append(evicted_key)
+            self.evictions += 1
+        return evicted
+
+    def pop(self, key: K, default: Any = None) -> Any:
+        entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._data),
+        }
+
+
+# redis hash field of the version token of a viewer (page keys are "size:before:after")
+VERSION_KEY = "version"
+# store a page field only if the version field is unchanged, then refresh ttl
+SET_IF_VERSION_SCRIPT = """
+if redis.call("HGET", KEYS[1], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+redis.call("HSET", KEYS[1], ARGV[3], ARGV[4])
+if tonumber(ARGV[5]) > 0 then
+    redis.call("EXPIRE", KEYS[1], ARGV[5])
+end
+return 1
+"""
+
+
+class FeedCacheBackend(ABC):
+    """
+    Storage of serialized feed pages keyed by viewer id and page key, and version
+    tokens of viewers' data dropped together with their pages
+    """
+
+    @abstractmethod
+    async def get(self, viewer_id: int, page_key: str) -> bytes | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set(
+        self, viewer_id: int, page_key: str, value: bytes, version: str
+    ) -> bool:
+        """
+        Store the page if the version token of the viewer is still version
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    async def get_version(self, viewer_id: int) -> str | None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def set_version(self, viewer_id: int, version: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def invalidate(self, viewer_ids: Iterable[int]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def clear(self) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def stats(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+
+class InProcessFeedCacheBackend(FeedCacheBackend):
+    """
+    Feed pages in LRU cache of the process with index of pages per viewer
+    """
+
+    def __init__(self, maxsize: int, ttl: float | None = None) -> None:
+        self._pages: LRUCache[Tuple[int, str], bytes] = LRUCache(maxsize, ttl)
+        self._viewer_pages: Dict[int, Set[str]] = dict()
+        self._versions: LRUCache[int, str] = LRUCache(maxsize, ttl)
+
+    async def get(self, viewer_id: int, page_key: str) -> bytes | None:
+        return self._pages.get((viewer_id, page_key))
+
+    async def set(
+        self, viewer_id: int, page_key: str, value: bytes, version: str
+    ) -> bool:
+        if self._versions.get(viewer_id) != version:
+            return False
+        for i_viewer_id, i_page_key in self._pages.set((viewer_id, page_key), value):
+            self._forget(i_viewer_id, i_page_key)
+        self._viewer_pages.setdefault(viewer_id, set()).add(page_key)
+        return True
+
+    def _forget(self, viewer_id: int, page_key: str) -> None:
+        pages = self._viewer_pages.get(viewer_id)
+        if pages is not None:
+            pages.discard(page_key)
+            if not pages:
+                del self._viewer_pages[viewer_id]
+
+    async def get_version(self, viewer_id: int) -> str | None:
+        return self._versions.get(viewer_id)
+
+    async def set_version(self, viewer_id: int, version: str) -> None:
+        self._versions.set(viewer_id, version)
+
+    async def invalidate(self, viewer_ids: Iterable[int]) -> None:
+        for i_viewer_id in viewer_ids:
+            self._versions.pop(i_viewer_id)
+            for i_page_key in self._viewer_pages.pop(i_viewer_id, ()):
+                self._pages.pop((i_viewer_id, i_page_key))
+
+    async def clear(self) -> None:
+        self._pages.clear()
+        self._viewer_pages.clear()
+        self._versions.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return self._pages.stats()
+
+
+class RedisFeedCacheBackend(FeedCacheBackend):
+    """
+    Feed pages shared by all workers: a redis hash per viewer with page keys as fields.
+    Evictions are done by redis itself (maxmemory policy) and not counted here
+    """
+
+    def __init__(
+        self, url: str, ttl: float | None = None, namespace: str = "feed"
+    ) -> None:
+        if redis_asyncio is None:
+            raise RuntimeError("Package 'redis' is required for feed cache at %s" % url)
+        self._redis = redis_asyncio.from_url(url)
+        self._set_if_version = self._redis.register_script(SET_IF_VERSION_SCRIPT)
+        self.ttl = ttl
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, viewer_id: int) -> str:
+        return f"{self.namespace}:{viewer_id}"
+
+    async def get(self, viewer_id: int, page_key: str) -> bytes | None:
+        value = await self._redis.hget(self._key(viewer_id), page_key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(
+        self, viewer_id: int, page_key: str, value: bytes, version: str
+    ) -> bool:
+        stored = await self._set_if_version(
+            keys=[self._key(viewer_id)],
+            args=[VERSION_KEY, version, page_key, value, int(self.ttl or 0)],
+        )
+        return bool(stored)
+
+    async def get_version(self, viewer_id: int) -> str | None:
+        value = await self._redis.hget(self._key(viewer_id), VERSION_KEY)
+        return None if value is None else value.decode()
+
+    async def set_version(self, viewer_id: int, version: str) -> None:
+        async with self._redis.pipeline(transaction=False) as pipe:
+            pipe.hset(self._key(viewer_id), VERSION_KEY, version)
+            if self.ttl is not None:
+                pipe.expire(self._key(viewer_id), int(self.ttl))
+            await pipe.execute()
+
+    async def invalidate(self, viewer_ids: Iterable[int]) -> None:
+        keys = [self._key(i_viewer_id) for i_viewer_id in viewer_ids]
+        if keys:
+            await self._redis.delete(*keys)
+
+    async def clear(self) -> None:
+        async for i_key in self._redis.scan_iter(match=f"{self.namespace}:*"):
+            await self._redis.delete(i_key)
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "evictions": 0, "size": -1}
+
+
+class FeedCache:
+    """
+    Per viewer cache of feed pages. Entries are invalidated by write paths
+    (tweets, likes, follows) for all viewers whose feed has been changed,
+    listeners are told about those viewers (e.g. to read them from the primary).
+    Backend errors are logged and treated as cache misses
+    """
+
+    def __init__(self, backend: FeedCacheBackend) -> None:
+        self.backend = backend
+        self.listeners: List[Callable[[Set[int]], None]] = []
+
+    async def get_page(self, viewer_id: int, page_key: str) -> Dict[str, Any] | None:
+        try:
+            value = await self.backend.get(viewer_id, page_key)
+        except (RedisError, OSError) as exc:
+            logger_cache.error("!!! Feed cache is not available: %s", exc)
+            return None
+        return None if value is None else orjson.loads(value)
+
+    async def set_page(
+        self, viewer_id: int, page_key: str, page: Dict[str, Any], version: str
+    ) -> bool:
+        """
+        Store the page built after the version token of the viewer was read:
+        the page is dropped if the viewer was invalidated meanwhile (it may miss
+        the change)
+        """
+        try:
+            return await self.backend.set(
+                viewer_id, page_key, orjson.dumps(page), version
+            )
+        except (RedisError, OSError) as exc:
+            logger_cache.error("!!! Feed cache is not available: %s", exc)
+            return False
+
+    async def get_version(self, viewer_id: int) -> str:
+        """
+        Version token of the viewer's data for conditional requests: issued on
+        the first request and dropped with the pages on invalidation, so the next
+        request gets a new one. A fresh token per request if backend is not available
+        """
+        try:
+            version = await self.backend.get_version(viewer_id)
+            if version is None:
+                version = secrets.token_hex(8)
+                await self.backend.set_version(viewer_id, version)
+            return version
+        except (RedisError, OSError) as exc:
+            logger_cache.error("!!! Feed cache is not available: %s", exc)
+            return secrets.token_hex(8)
+
+    async def invalidate(self, viewer_ids: Iterable[int]) -> None:
+        viewer_ids = set(viewer_ids)
+        for i_listener in self.listeners:
+            i_listener(viewer_ids)
+        try:
+            await self.backend.invalidate(viewer_ids)
+        except (RedisError, OSError) as exc:
+            logger_cache.error("!!! Feed cache is not invalidated: %s", exc)
+
+    async def clear(self) -> None:
+        await self.backend.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return self.backend.stats()
+
+
+class CurrentUser(NamedTuple):
+    """
+    Identity of authenticated user
+    """
+
+    id: int
+    name: str
+
+
+class IdentityCache:
+    """
+    Bounded TTL cache of user identities: api_key -> (id, name) for authentication
+    and id -> name for authors, likers and followers
+    """
+
+    def __init__(self, maxsize: int, ttl: float | None = None) -> None:
+        self.users_by_api_key: LRUCache[str, CurrentUser] = LRUCache(maxsize, ttl)
+        self.names_by_id: LRUCache[int, str] = LRUCache(maxsize, ttl)
+
+    def get_user(self, api_key: str) -> CurrentUser | None:
+        return self.users_by_api_key.get(api_key)
+
+    def set_user(self, api_key: str, user: CurrentUser) -> None:
+        self.users_by_api_key.set(api_key, user)
+        self.names_by_id.set(user.id, user.name)
+
+    def get_names(self, user_ids: Iterable[int]) -> Tuple[Dict[int, str], Set[int]]:
+        """
+        Return names found in cache and ids of users missed
+        """
+        names, missed = dict(), set()
+        for i_user_id in user_ids:
+            i_name = self.names_by_id.get(i_user_id)
+            if i_name is None:
+                missed.add(i_user_id)
+            else:
+                names[i_user_id] = i_name
+        return names, missed
+
+    def set_names(self, names: Dict[int, str]) -> None:
+        for i_user_id, i_name in names.items():
+            self.names_by_id.set(i_user_id, i_name)
+
+    def invalidate_api_key(self, api_key: str) -> None:
+        user = self.users_by_api_key.pop(api_key)
+        if user is not None:
+            self.names_by_id.pop(user.id)
+
+    def invalidate_user(self, user_id: int) -> None:
+        """
+        Drop the user from both maps (e.g. when name or api key changes)
+        """
+        self.names_by_id.pop(user_id)
+        for i_api_key, (_, i_user) in list(self.users_by_api_key._data.items()):
+            if i_user.id == user_id:
+                self.users_by_api_key.pop(i_api_key)
+
+    def clear(self) -> None:
+        self.users_by_api_key.clear()
+        self.names_by_id.clear()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            "users_by_api_key": self.users_by_api_key.stats(),
+            "names_by_id": self.names_by_id.stats(),
+        }
+
+
+def create_feed_cache(_settings: Settings, namespace: str = "feed") -> FeedCache:
+    if _settings.feed_cache_url:
+        logger_cache.info("!!! %s cache at %s", namespace, _settings.feed_cache_url)
+        return FeedCache(
+            RedisFeedCacheBackend(
+                _settings.feed_cache_url, _settings.feed_cache_ttl, namespace
+            )
+        )
+    return FeedCache(
+        InProcessFeedCacheBackend(_settings.feed_cache_size, _settings.feed_cache_ttl)
+    )
+
+
+feed_cache = create_feed_cache(settings)
+# versions of user profiles only: invalidated by follows and tweets of the user
+profile_cache = create_feed_cache(settings, "profile")
+identity_cache = IdentityCache(
+    settings.identity_cache_size, settings.identity_cache_ttl
+)
@@ -4,6 +4,7 @@ import pathlib
 from functools import lru_cache
 
 from dotenv import load_dotenv
+from pydantic import model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 logger = logging.getLogger("uvicorn")
@@ -21,8 +22,84 @@ class Settings(BaseSettings):
 
     database_url: str | None = os.getenv("DATABASE_URL")
     base_url: str | None = os.getenv("BASE_URL")
+    # database: log of SQL statements, connection pool size and overflow
+    database_echo: bool = False
+    database_pool_size: int = 5
+    database_max_overflow: int = 10
+    # database: relationships raise on lazy loads instead of loading
+    # (unset: on when TESTING is true)
+    database_lazy_load_guard: bool | None = None
+    # database read replicas (optional, json list in env): read-only endpoints
+    # use replicas with lag up to max seconds (checked once per interval), users
+    # who wrote or whose data changed read from the primary for sticky seconds
+    database_replica_urls: list[str] = []
+    database_replica_lag_max: float = 1.0
+    database_replica_lag_interval: float = 1.0
+    database_sticky_seconds: float = 5.0
+    database_sticky_max: int = 100000
 
     media_dir_host: pathlib.Path = pathlib.Path("/media")
+    # media uploads: maximal file size and size of chunks written to disk, bytes
+    media_max_size: int = 2 * 1024 * 1024
+    upload_chunk_size: int = 64 * 1024
+    # media derivatives: longest side in pixels per size name, output format,
+    # number of worker processes generating them
+    media_derivative_sizes: dict[str, int] = {"thumb": 320, "display": 1280}
+    media_derivative_format: str = "webp"
+    media_derivative_workers: int = 2
+    # media delivery: browser cache lifetime of stored files in seconds,
+    # nginx internal location to hand file transfer to (optional)
+    media_cache_max_age: int = 365 * 24 * 3600
+    media_accel_redirect: str | None = None
+    # media garbage collection: period in seconds, age of unattached uploads and
+    # unknown files to be removed, files removed per batch
+    media_gc_interval: float = 3600.0
+    media_gc_grace: float = 24 * 3600.0
+    media_gc_batch_size: int = 100
+
+    # feed pagination: default and maximal number of tweets per page
+    feed_page_size: int = 20
+    feed_page_size_max: int = 100
+    # user profiles: number of the latest followers and followings in a profile,
+    # default and maximal number of users per page of followers and followings
+    profile_follows_size: int = 10
+    follows_page_size: int = 50
+    follows_page_size_max: int = 200
+    # full-text search: text search configuration of tweets (applied to the
+    # search column on table creation)
+    search_config: str = "english"
+    # home timeline: followers limit for fan-out on write (fan-out on read above),
+    # number of tweets put to the timeline of a new follower
+    fanout_followers_max: int = 10000
+    timeline_backfill_size: int = 200
+    # batch endpoints: maximal number of ids per request
+    batch_size_max: int = 100
+    # feed cache: pages per process (LRU) and their time to live in seconds,
+    # redis url to share the cache between workers instead (optional)
+    feed_cache_size: int = 10000
+    feed_cache_ttl: float = 60.0
+    feed_cache_url: str | None = None
+    # identity cache: users per map (api_key -> user, id -> name), time to live
+    identity_cache_size: int = 100000
+    identity_cache_ttl: float = 300.0
+    # admission control (per process): requests per second per user or client
+    # address (0 disables rate limiting)
+    admission_rate: float = 50.0
+    # admission control: burst of requests per user or client address
+    admission_burst: int = 100
+    # admission control: token buckets of users and client addresses kept
+    admission_keys_max: int = 100000
+    # admission control: concurrent requests per endpoint class
+    admission_limits: dict[str, int] = {"read": 64, "write": 32, "upload": 8}
+    # admission control: seconds to wait for a free slot of the endpoint class
+    admission_queue_timeout: float = 0.5
+    # admission control: database pool wait in seconds to shed requests at
+    admission_pool_wait_max: float = 1.0
+    # push events: queued events per connection, seconds between keep-alive
+    # comments, redis url to share events between workers (optional)
+    events_queue_size: int = 100
+    events_keepalive: float = 15.0
+    events_url: str | None = None
 
     if environment == "dev":
         # NOTE: dev environment uses paths in containers
@@ -36,6 +113,13 @@ class Settings(BaseSettings):
         static_dir: pathlib.Path = base_dir / "client/static"
         media_dir_local: pathlib.Path = base_dir / "tests/media/test_result"
 
+    @model_validator(mode="after")
+    def _lazy_load_guard_default(self) -> "Settings":
+        if self.database_lazy_load_guard is None:
+            testing = (self.testing or "").lower()
+            self.database_lazy_load_guard = testing in ("1", "true")
+        return self
+
 
 @lru_cache
 def get_settings() -> Settings:
@@ -1,35 +1,70 @@
+import asyncio
+import datetime
 import logging
-import os
 import pathlib
 import random
-from typing import Any, Dict
+import re
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Hashable,
+    Iterable,
+    List,
+    Literal,
+    Set,
+)
 
 import aiofiles
+import aiofiles.os
 from faker import Faker
-from fastapi import HTTPException, UploadFile
 from sqlalchemy import (
     ARRAY,
+    JSON,
+    BigInteger,
+    Boolean,
     Column,
+    Computed,
     Date,
+    DateTime,
     ForeignKey,
+    Index,
     Integer,
-    Row,
     Sequence,
     String,
+    UniqueConstraint,
     and_,
+    case,
     delete,
-    desc,
+    false,
     func,
+    literal,
+    literal_column,
+    or_,
     select,
+    true,
+    tuple_,
+    union,
     update,
 )
+from sqlalchemy.dialects.postgresql import TSVECTOR, aggregate_order_by, insert
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
-from sqlalchemy.orm import DeclarativeBase, relationship
+from sqlalchemy.orm import DeclarativeBase, aliased, relationship
+from starlette.requests import Request
 
+from .cache import CurrentUser, feed_cache, identity_cache, profile_cache
 from .config import Settings, get_settings
 from .error_handler import AppException, ObjectNotFoundException, SQLAlchemyException
-
+from .events import event_bus
+from .media_gc import media_collector, scan_files
+from .metrics import InstrumentedPool, instrument_engine
+from .replicas import Replica, create_read_router, database_reads
+from .uploads import StreamedUpload
 
 # Initialize logging
 logger_db = logging.getLogger("logger_db")
@@ -38,18 +73,50 @@ logging.basicConfig(level=logging.DEBUG)
 # setting environment
 settings: Settings = get_settings()
 
-engine = create_async_engine(settings.database_url, echo=True)
+engine = create_async_engine(
+    settings.database_url,
+    echo=settings.database_echo,
+    poolclass=InstrumentedPool,
+    pool_size=settings.database_pool_size,
+    max_overflow=settings.database_max_overflow,
+)
+instrument_engine(engine)
 # expire_on_commit=False will prevent attributes from being expired after commit
 async_session = async_sessionmaker(bind=engine, expire_on_commit=False)
 session = async_session()
 
+# read replicas: read-only endpoints are routed to them by get_read_session
+replicas: List[Replica] = []
+for i_number, i_url in enumerate(settings.database_replica_urls, 1):
+    i_engine = create_async_engine(
+        i_url,
+        echo=settings.database_echo,
+        poolclass=InstrumentedPool,
+        pool_size=settings.database_pool_size,
+        max_overflow=settings.database_max_overflow,
+    )
+    instrument_engine(i_engine, f"replica{i_number}")
+    replicas.append(Replica(f"replica{i_number}", i_engine))
+read_router = create_read_router(settings, replicas)
+if replicas:
+    # users whose feed or profile changed read from the primary for a while
+    feed_cache.listeners.append(read_router.stick)
+    profile_cache.listeners.append(read_router.stick)
+
 
 class Base(DeclarativeBase):
     pass
 
 
+# relationships are never loaded implicitly: queries select columns or opt in to
+# eager loading (selectinload options), in guard mode (tests) lazy loads raise
+RELATIONSHIP_LAZY: Literal["select", "raise_on_sql"] = (
+    "raise_on_sql" if settings.database_lazy_load_guard else "select"
+)
+
+
 # Dependency to create future sessions for us on demand
-async def get_session() -> AsyncSession:  # type: ignore
+async def get_session(request: Request) -> AsyncSession:  # type: ignore
     async with async_session() as _session:
         try:
             yield _session
@@ -58,6 +125,89 @@ async def get_session() -> AsyncSession:  # type: ignore
             raise exc
         finally:
             await _session.close()
+            # users read their own writes from the primary for a while
+            api_key = request.headers.get("api-key")
+            if read_router.replicas and api_key and request.method != "GET":
+                read_router.stick([api_key])
+
+
+def read_keys(request: Request) -> List[Hashable]:
+    """
+    Sticky keys of a read request: api key and id of the user, id of the user
+    in the path
+    """
+    keys: List[Hashable] = []
+    api_key = request.headers.get("api-key")
+    if api_key:
+        keys.append(api_key)
+        user = identity_cache.get_user(api_key)
+        if user is not None:
+            keys.append(user.id)
+    user_id = request.path_params.get("user_id")
+    if user_id is not None and str(user_id).isdigit():
+        keys.append(int(user_id))
+    return keys
+
+
+# Dependency of read-only endpoints: a session of a replica, of the primary
+# for sticky users or when replicas lag
+async def get_read_session(request: Request) -> AsyncSession:  # type: ignore
+    replica = None
+    if read_router.replicas and not read_router.is_sticky(read_keys(request)):
+        replica = await read_router.choose()
+    database_reads.inc("primary" if replica is None else "replica")
+    session_maker = async_session if replica is None else replica.session_maker
+    async with session_maker() as _session:
+        try:
+            yield _session
+        except Exception as exc:
+            await _session.rollback()
+            raise exc
+        finally:
+            await _session.close()
+
+
+def row_mapper(*columns: Any) -> Callable[[Iterable[Any]], Dict[str, Any]]:
+    """
+    Compile mapping of result rows (column tuples) to dicts keyed by column names
+    """
+    keys = tuple(i_column.key for i_column in columns)
+    return lambda row: dict(zip(keys, row))
+
+
+# statuses of batch items which are in the requested state
+BATCH_DONE = ("created", "exists", "deleted")
+
+
+def batch_results(ids: Iterable[int], statuses: Dict[int, str]) -> Dict[str, Any]:
+    """
+    Per-item results of a batch in the order of ids. Status is one of "created",
+    "exists", "deleted", "not_found", "not_allowed"; result is True when the item
+    is in the requested state
+    """
+    return {
+        "result": True,
+        "items": [
+            {
+                "id": i_id,
+                "result": statuses[i_id] in BATCH_DONE,
+                "status": statuses[i_id],
+            }
+            for i_id in ids
+        ],
+    }
+
+
+def like_counts(counts: Dict[int, int]) -> Dict[str, Any]:
+    """
+    Data of "like" event: new like counters of tweets
+    """
+    return {
+        "tweets": [
+            {"id": i_id, "like_count": i_like_count}
+            for i_id, i_like_count in counts.items()
+        ]
+    }
 
 
 async def insert_data(
@@ -94,20 +244,14 @@ async def insert_data(
             ]
         )
 
+        # a user likes a tweet once only
         users[i].likes_of_user.extend(
             [
                 Like(
                     follower_id=i + 1,
-                    tweet_id=random.randint(1, tweets_total - 1),
-                ),
-                Like(
-                    follower_id=i + 1,
-                    tweet_id=random.randint(1, tweets_total - 1),
-                ),
-                Like(
-                    follower_id=i + 1,
-                    tweet_id=random.randint(1, tweets_total - 1),
-                ),
+                    tweet_id=i_tweet_id,
+                )
+                for i_tweet_id in random.sample(range(1, tweets_total), 3)
             ]
         )
 
@@ -147,23 +291,213 @@ async def insert_data(
         async with _async_session() as _session:
             async with _session.begin():
                 _session.add_all(users)
+                await _session.flush()
+                await repair_counters(_session)
+                await HomeTimeline.rebuild(_session)
     except SQLAlchemyError as exc:
         logger_db.error("Database not created.. SQLAlchemy Error!")
         raise SQLAlchemyException(error_type=str(type(exc)), error_message=str(exc))
 
 
-async def files_clean_up(_path: str) -> None:
+async def repair_counters(_session: AsyncSession) -> Dict[str, int]:
+    """
+    Recompute denormalized counters of users and tweets in bulk
+    (for data created bypassing write paths or after counters drift).
+    Only rows with drifted counters are written, return numbers of them.
+    To repair a live database run "python -m project.server.main.maintenance"
+    """
+    followers_count = (
+        select(func.count(FollowRelation.id))
+        .filter(FollowRelation.following_id == User.id)
+        .scalar_subquery()
+    )
+    following_count = (
+        select(func.count(FollowRelation.id))
+        .filter(FollowRelation.follower_id == User.id)
+        .scalar_subquery()
+    )
+    tweets_count = (
+        select(func.count(Tweet.id)).filter(Tweet.author == User.id).scalar_subquery()
+    )
+    users_query = await _session.execute(
+        update(User)
+        .values(
+            followers_count=followers_count,
+            following_count=following_count,
+            tweets_count=tweets_count,
+        )
+        .where(
+            or_(
+                User.followers_count.is_distinct_from(followers_count),
+                User.following_count.is_distinct_from(following_count),
+                User.tweets_count.is_distinct_from(tweets_count),
+            )
+        )
+        .execution_options(synchronize_session=False)
+    )
+    like_count = (
+        select(func.count(Like.id)).filter(Like.tweet_id == Tweet.id).scalar_subquery()
+    )
+    tweets_query = await _session.execute(
+        update(Tweet)
+        .values(like_count=like_count)
+        .where(Tweet.like_count.is_distinct_from(like_count))
+        .execution_options(synchronize_session=False)
+    )
+    repaired = {
+        "users": users_query.rowcount,  # type: ignore
+        "tweets": tweets_query.rowcount,  # type: ignore
+    }
+    logger_db.info("!!! Counters repaired: %s", repaired)
+    return repaired
+
+
+async def ping(_session: AsyncSession) -> bool:
+    """
+    Check that the database answers
+    """
+    try:
+        await _session.execute(select(literal(1)))
+        return True
+    except (SQLAlchemyError, OSError) as exc:
+        logger_db.error("!!! Database is not available: %s", exc)
+        return False
+
+
+def files_clean_up(_paths: Iterable[str]) -> None:
+    """
+    Remove files from server related to user/tweets which has been deleted.
+    Files are removed in background, the request does not wait for disk
+    """
+    media_collector.discard(_paths)
+    logger_db.info("!!! Related media clean up is queued")
+
+
+def blob_lock(sha256: Any) -> Any:
+    """
+    Transaction lock of a blob hash: uploads of the content and removal of its
+    files do not interleave
+    """
+    return func.pg_advisory_xact_lock(func.hashtext(sha256))
+
+
+@asynccontextmanager
+async def blobs_locked(_paths: List[str]) -> AsyncIterator[Set[str]]:
+    """
+    Lock blobs of files to remove until they are removed, yield paths of files
+    to keep: referenced by a blob again (the content was uploaded anew) or not
+    checked because the database is not available
+    """
+    paths_by_sha: Dict[str, List[str]] = defaultdict(list)
+    for i_path in _paths:
+        i_sha256 = pathlib.PurePath(i_path).stem[:64]
+        if re.fullmatch(r"[0-9a-f]{64}", i_sha256):
+            paths_by_sha[i_sha256].append(i_path)
+    if not paths_by_sha:
+        yield set()
+        return
+
+    async with async_session() as _session:
+        try:
+            # locks in order: concurrent removals do not deadlock
+            await _session.execute(
+                select(
+                    blob_lock(func.unnest(literal(sorted(paths_by_sha), ARRAY(String))))
+                )
+            )
+            referenced_query = await _session.execute(
+                select(MediaBlob.sha256).filter(MediaBlob.sha256.in_(paths_by_sha))
+            )
+            kept = {
+                i_path
+                for i_sha256 in referenced_query.scalars().all()
+                for i_path in paths_by_sha[i_sha256]
+            }
+        except (SQLAlchemyError, OSError) as exc:
+            logger_db.error("!!! Media files are kept, blobs not checked: %s", exc)
+            yield set(_paths)
+            return
+        if kept:
+            logger_db.info("!!! Media files referenced again are kept: %s", kept)
+        # removal is done while locks are held, they are released on close
+        yield kept
+
+
+media_collector.guard = blobs_locked
+
+
+async def collect_media_garbage(
+    _session: AsyncSession, grace: float | None = None
+) -> Dict[str, int]:
     """
-    Remove files from server related to user/tweets which has been deleted
+    Remove uploads never attached to a tweet and files of media directory
+    not referenced by the database, both older than grace period (seconds).
+    Return counts of removed rows and files and reclaimed bytes
     """
+    grace = settings.media_gc_grace if grace is None else grace
+    media_dir = settings.media_dir_local
     try:
-        os.remove(_path)
-        logger_db.info("!!! Related media clean up complete!")
-    except FileNotFoundError as exc:
-        logger_db.error("!!! File not found when deleting!", exc)
-        raise ObjectNotFoundException(error_message="File not found when deleting")
-    except OSError as exc:
-        logger_db.error(f"!!! Error when deleting a file: {exc.strerror}")
+        # unattached uploads
+        unattached_query = await _session.execute(
+            delete(Media)
+            .where(
+                Media.tweet_id.is_(None),
+                Media.created_at < func.now() - datetime.timedelta(seconds=grace),
+            )
+            .returning(Media.local_path, Media.blob_sha256)
+        )
+        unattached = unattached_query.all()
+        blobs_unused = await MediaBlob.release(
+            _session,
+            [
+                i_media.blob_sha256
+                for i_media in unattached
+                if i_media.blob_sha256 is not None
+            ],
+        )
+        await _session.commit()
+        files_to_delete = [
+            str(media_dir / i_file_name) for i_file_name in blobs_unused
+        ] + [
+            i_media.local_path
+            for i_media in unattached
+            if i_media.blob_sha256 is None and i_media.local_path
+        ]
+        removed_unattached, reclaimed_unattached = await media_collector.remove(
+            files_to_delete
+        )
+
+        # files without rows: lost on failures, stale temporary uploads
+        files_on_disk = await asyncio.to_thread(
+            scan_files, media_dir, time.time() - grace
+        )
+        blobs_query = await _session.execute(
+            select(MediaBlob.file_name, MediaBlob.derivatives)
+        )
+        referenced = set()
+        for i_file_name, i_derivatives in blobs_query.all():
+            referenced.add(i_file_name)
+            referenced.update((i_derivatives or dict()).values())
+        legacy_query = await _session.execute(
+            select(Media.file_name).filter(Media.blob_sha256.is_(None))
+        )
+        referenced.update(legacy_query.scalars().all())
+    except SQLAlchemyError as exc:
+        logger_db.error("SQLAlchemy Error!..")
+        raise SQLAlchemyException(error_type=type(exc), error_message=str(exc))
+
+    removed_orphans, reclaimed_orphans = await media_collector.remove(
+        str(media_dir / i_file_name)
+        for i_file_name in files_on_disk
+        if i_file_name not in referenced
+    )
+
+    media_collector.media_removed += len(unattached)
+    return {
+        "media_removed": len(unattached),
+        "files_removed": removed_unattached + removed_orphans,
+        "bytes_reclaimed": reclaimed_unattached + reclaimed_orphans,
+    }
 
 
 class User(Base):
@@ -173,13 +507,22 @@ class User(Base):
     name = Column(String(50), nullable=True, index=True)
     api_key = Column(String(50), unique=True, nullable=False)
     date_of_registration = Column(Date(), server_default=func.now())
+    # tweets of accounts with too many followers are not fanned out on write
+    # but merged into followers' feeds on read
+    fanout_on_read = Column(
+        Boolean, nullable=False, default=False, server_default=false()
+    )
+    # denormalized counters maintained by write paths (see repair_counters)
+    followers_count = Column(Integer, nullable=False, default=0, server_default="0")
+    following_count = Column(Integer, nullable=False, default=0, server_default="0")
+    tweets_count = Column(Integer, nullable=False, default=0, server_default="0")
 
     tweets_of_user = relationship(
         "Tweet",
         back_populates="user_of_tweet",
         cascade="all, delete-orphan",
         passive_deletes=True,
-        lazy="selectin",
+        lazy=RELATIONSHIP_LAZY,
     )
 
     likes_of_user = relationship(
@@ -187,7 +530,7 @@ class User(Base):
         back_populates="user_of_like",
         cascade="all, delete-orphan",
         passive_deletes=True,
-        lazy="selectin",
+        lazy=RELATIONSHIP_LAZY,
     )
 
     # (User Column 2) relationship for user, who follows to somebody
@@ -197,7 +540,7 @@ class User(Base):
         foreign_keys="FollowRelation.follower_id",
         cascade="all, delete-orphan",
         passive_deletes=True,
-        lazy="selectin",
+        lazy=RELATIONSHIP_LAZY,
     )
 
     # (User Column 3) relationship for user, whom somebody follows by
@@ -207,20 +550,118 @@ class User(Base):
         foreign_keys="FollowRelation.following_id",
         cascade="all, delete-orphan",
         passive_deletes=True,
-        lazy="selectin",
+        lazy=RELATIONSHIP_LAZY,
     )
 
     @classmethod
     async def get_current_user(
         cls, _session: AsyncSession, api_key: str | None
-    ) -> Row[tuple[int, str]]:
-        user_query = await _session.execute(
-            select(User.id, User.name).filter(User.api_key == api_key)
+    ) -> CurrentUser:
+        """
+        Authenticate user by api key: memoized within the session (request)
+        and cached in identity cache
+        """
+        current_users = _session.info.setdefault("current_users", dict())
+        user = current_users.get(api_key)
+        if user is None and api_key is not None:
+            user = identity_cache.get_user(api_key)
+        if user is None:
+            user_query = await _session.execute(
+                select(User.id, User.name).filter(User.api_key == api_key)
+            )
+            user_row = user_query.fetchone()
+            if user_row is None:
+                raise ObjectNotFoundException(error_message="User not found.")
+            user = CurrentUser(*user_row)
+            identity_cache.set_user(api_key, user)  # type:ignore
+        current_users[api_key] = user
+        return user
+
+    @classmethod
+    async def get_names(
+        cls, _session: AsyncSession, user_ids: Iterable[int]
+    ) -> dict[int, str]:
+        """
+        Resolve user names by ids through identity cache, missed names in one query
+        """
+        names, missed = identity_cache.get_names(user_ids)
+        if missed:
+            names_query = await _session.execute(
+                select(User.id, User.name).filter(User.id.in_(missed))
+            )
+            missed_names = {i_id: i_name for i_id, i_name in names_query.all()}
+            identity_cache.set_names(missed_names)
+            names.update(missed_names)
+        return names
+
+    @classmethod
+    def _follows_column(cls, side: str) -> Any:
+        """
+        JSON list of the latest followers or followings of the user (ids and names,
+        the newest follows first), limited by profile_follows_size
+        """
+        follow_user = aliased(User)
+        own_id, other_id = (
+            (FollowRelation.following_id, FollowRelation.follower_id)
+            if side == "followers"
+            else (FollowRelation.follower_id, FollowRelation.following_id)
+        )
+        follows_subq = (
+            select(
+                FollowRelation.id.label("follow_id"),
+                follow_user.id,
+                follow_user.name,
+            )
+            .join(follow_user, follow_user.id == other_id)
+            .filter(own_id == User.id)
+            .order_by(FollowRelation.id.desc())
+            .limit(settings.profile_follows_size)
+            .correlate(User)
+            .subquery()
+        )
+        follows_list = func.json_agg(
+            aggregate_order_by(
+                func.json_build_object(
+                    "id", follows_subq.c.id, "name", follows_subq.c.name
+                ),
+                follows_subq.c.follow_id.desc(),
+            )
+        )
+        return (
+            select(
+                func.coalesce(follows_list, literal_column("'[]'::json"), type_=JSON)
+            )
+            .correlate(User)
+            .scalar_subquery()
+            .label(side)
+        )
+
+    @classmethod
+    def _profile_stmt(cls) -> Any:
+        """
+        Profiles in one query: id, name, counters and the latest followers and
+        followings (totals are in the counters)
+        """
+        return select(
+            User.id,
+            User.name,
+            User.followers_count,
+            User.following_count,
+            User.tweets_count,
+            cls._follows_column("followers"),
+            cls._follows_column("following"),
         )
+
+    @classmethod
+    async def _get_profile(cls, _session: AsyncSession, uid: int) -> dict[str, Any]:
+        """
+        User id, name, counters, the latest followers and followings
+        """
+        user_query = await _session.execute(cls._profile_stmt().filter(User.id == uid))
         user = user_query.fetchone()
         if user is None:
             raise ObjectNotFoundException(error_message="User not found.")
-        return user
+        return user._asdict()
 
     @classmethod
     async def get_user_by_apikey(
@@ -228,30 +669,7 @@ class User(Base):
     ) -> dict[str, Any]:
         user = await cls.get_current_user(_session, api_key)
         try:
-            user_follows_to_query = await _session.execute(
-                select(FollowRelation.following_id.label("id"), User.name)
-                .join(User.following_by)
-                .filter(FollowRelation.follower_id == user.id)
-            )
-
-            user_follows_to = user_follows_to_query.all()
-
-            user_following_by_query = await _session.execute(
-                select(FollowRelation.follower_id.label("id"), User.name)
-                .join(User.following_to)
-                .filter(FollowRelation.following_id == user.id)
-            )
-
-            user_following_by = user_following_by_query.all()
-
-            user_data = user._asdict()
-            user_data["followers"] = [
-                i_user_following_by._asdict()
-                for i_user_following_by in user_following_by
-            ]
-            user_data["following"] = [
-                i_user_follows_to._asdict() for i_user_follows_to in user_follows_to
-            ]
+            user_data = await cls._get_profile(_session, user.id)
 
             return {"result": True, "user": user_data}
         except SQLAlchemyError as exc:
@@ -260,39 +678,92 @@ class User(Base):
 
     @classmethod
     async def get_user_by_id(cls, _session: AsyncSession, uid: int) -> dict[str, Any]:
-        user = await _session.get(User, uid)
-        if user is None:
-            raise ObjectNotFoundException(error_message="User not found.")
-        # Method 1 with requests:
         try:
-            user_follows_to_query = await _session.execute(
-                select(FollowRelation.following_id.label("id"), User.name)
-                .distinct()
-                .join(User.following_by)
-                .filter(FollowRelation.follower_id == user.id)
-            )
+            user_data = await cls._get_profile(_session, uid)
+
+            return {"result": True, "user": user_data}
 
-            user_follows_to = user_follows_to_query.all()
+        except SQLAlchemyError as exc:
+            logger_db.error("SQLAlchemy Error!..")
+            raise SQLAlchemyException(error_type=type(exc), error_message=str(exc))
 
-            user_following_by_query = await _session.execute(
-                select(FollowRelation.follower_id.label("id"), User.name)
-                .distinct()
-                .join(User.following_to)
-                .filter(FollowRelation.following_id == user.id)
+    @classmethod
+    async def get_users_by_ids(
+        cls, _session: AsyncSession, user_ids: Iterable[int]
+    ) -> dict[str, Any]:
+        """
+        Profiles of many users in one query (the same as single profiles).
+        Unknown ids are listed in "not_found"
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        try:
+            users_query = await _session.execute(
+                cls._profile_stmt().filter(User.id.in_(user_ids))
             )
+            users = {i_user.id: i_user._asdict() for i_user in users_query.all()}
 
-            user_following_by = user_following_by_query.all()
+            return {
+                "result": True,
+                "users": [users[i_id] for i_id in user_ids if i_id in users],
+                "not_found": [i_id for i_id in user_ids if i_id not in users],
+            }
 
-            user_data = user.to_json()
-            user_data["followers"] = [
-                i_user_following_by._asdict()
-                for i_user_following_by in user_following_by
-            ]
-            user_data["following"] = [
-                i_user_follows_to._asdict() for i_user_follows_to in user_follows_to
-            ]
+        except SQLAlchemyError as exc:
+            logger_db.error("SQLAlchemy Error!..")
+            raise SQLAlchemyException(error_type=type(exc), error_message=str(exc))
 
-            return {"result": True, "user": user_data}
+    @classmethod
+    async def get_follows_page(
+        cls,
+        _session: AsyncSession,
+        uid: int,
+        side: str,
+        limit: int | None = None,
+        before: int | None = None,
+    ) -> dict[str, Any]:
+        """
+        Followers or followings of the user page by page, the newest follows first.
+        Pagination is a keyset over follow id: "next_cursor" is passed as "before"
+        to get the next page, None if nothing left
+        """
+        page_size = min(
+            limit or settings.follows_page_size, settings.follows_page_size_max
+        )
+        own_id, other_id = (
+            (FollowRelation.following_id, FollowRelation.follower_id)
+            if side == "followers"
+            else (FollowRelation.follower_id, FollowRelation.following_id)
+        )
+        try:
+            follows_stmt = (
+                select(FollowRelation.id.label("follow_id"), User.id, User.name)
+                .join(User, User.id == other_id)
+                .filter(own_id == uid)
+            )
+            if before is not None:
+                follows_stmt = follows_stmt.filter(FollowRelation.id < before)
+            follows_query = await _session.execute(
+                follows_stmt.order_by(FollowRelation.id.desc()).limit(page_size + 1)
+            )
+            follows = follows_query.all()
+
+            if not follows:
+                # empty page of unknown user is an error
+                user_query = await _session.execute(
+                    select(User.id).filter(User.id == uid)
+                )
+                if user_query.scalar() is None:
+                    raise ObjectNotFoundException(error_message="User not found.")
+
+            has_more = len(follows) > page_size
+            follows = follows[:page_size]
+            return {
+                "result": True,
+                "users": [
+                    {"id": i_follow.id, "name": i_follow.name} for i_follow in follows
+                ],
+                "next_cursor": follows[-1].follow_id if has_more else None,
+            }
 
         except SQLAlchemyError as exc:
             logger_db.error("SQLAlchemy Error!..")
@@ -312,22 +783,38 @@ class User(Base):
 
 class Tweet(Base):
     __tablename__ = "tweets"
+    __table_args__ = (
+        Index("ix_tweets_author_id", "author", "id"),
+        Index("ix_tweets_content_search", "content_search", postgresql_using="gin"),
+    )
 
     id = Column(Integer, primary_key=True)
-    content = Column(String(1000), nullable=False, index=True)
+    content = Column(String(1000), nullable=False)
+    # lexemes of content for full-text search, computed by the database on write
+    content_search = Column(
+        TSVECTOR,
+        Computed(
+            f"to_tsvector('{settings.search_config}'::regconfig, content)",
+            persisted=True,
+        ),
+    )
     attachments: Column[Sequence] = Column(ARRAY(Integer), index=True)
     author = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     date_tweet = Column(Date, default=func.now())
+    # denormalized counter maintained by likes (see repair_counters)
+    like_count = Column(Integer, nullable=False, default=0, server_default="0")
 
     # Define back references for relationships
-    user_of_tweet = relationship("User", back_populates="tweets_of_user")
+    user_of_tweet = relationship(
+        "User", back_populates="tweets_of_user", lazy=RELATIONSHIP_LAZY
+    )
 
     likes_of_tweet = relationship(
         "Like",
         back_populates="tweet_with_like",
         cascade="all, delete-orphan",
         passive_deletes=True,
-        lazy="selectin",
+        lazy=RELATIONSHIP_LAZY,
     )
 
     media_of_tweet = relationship(
@@ -335,82 +822,257 @@ class Tweet(Base):
         back_populates="tweet_with_media",
         cascade="all, delete-orphan",
         passive_deletes=True,
-        lazy="selectin",
+        lazy=RELATIONSHIP_LAZY,
     )
 
     @classmethod
-    async def get_tweets(cls, _session: AsyncSession, api_key: str) -> dict[str, Any]:
+    async def get_tweets(
+        cls,
+        _session: AsyncSession,
+        api_key: str,
+        limit: int | None = None,
+        before: int | None = None,
+        after: int | None = None,
+    ) -> dict[str, Any]:
         """
-        User may get feed of tweets sorted by descent popularity by users he follows
+        User may get feed of own tweets and tweets of users he follows page by page,
+        the newest tweets first. The feed is read from home timeline.
+        Pagination is a keyset over tweet id: "before" gives tweets older than the
+        cursor, "after" gives only tweets newer than the cursor (incremental polling).
+        "next_cursor" continues in the same direction, None if nothing left.
         """
         user = await User.get_current_user(_session, api_key)
+        page_size = min(limit or settings.feed_page_size, settings.feed_page_size_max)
+        # polling for newer tweets scans up from the cursor
+        polling = after is not None and before is None
+
+        page_key = f"{page_size}:{before}:{after}"
+        cached_page = await feed_cache.get_page(user.id, page_key)
+        if cached_page is not None:
+            return cached_page
+        # read before the feed: the page is cached only if not invalidated meanwhile
+        version = await feed_cache.get_version(user.id)
 
         try:
-            # get followings:
-            followings_subq = (
-                select(
-                    FollowRelation.following_id, User.name, FollowRelation.follower_id
+            # get a page of tweet ids by cursor: fanned out tweets from home timeline
+            # plus tweets of followed accounts which are merged on read
+            timeline_stmt = select(
+                HomeTimeline.tweet_id.label("tweet_id"),
+                HomeTimeline.score.label("score"),
+            ).filter(HomeTimeline.user_id == user.id)
+            fanout_on_read_stmt = (
+                select(Tweet.id.label("tweet_id"), Tweet.id.label("score"))
+                .join(FollowRelation, FollowRelation.following_id == Tweet.author)
+                .join(User, User.id == Tweet.author)
+                .filter(
+                    FollowRelation.follower_id == user.id,
+                    User.fanout_on_read.is_(True),
                 )
-                .join(FollowRelation.following_user)
-                .filter(FollowRelation.follower_id == user.id)
-                .subquery()
             )
-
-            # get sorted tweets:
-            tweets_query = await _session.execute(
-                select(
-                    Tweet,
-                    User.name.label("author_name"),
-                    followings_subq.c.name.label("following_name"),
-                    func.count(Like.id).label("likes_count"),
+            page_stmts = []
+            for i_stmt, i_score in (
+                (timeline_stmt, HomeTimeline.score),
+                (fanout_on_read_stmt, Tweet.id),
+            ):
+                if before is not None:
+                    i_stmt = i_stmt.filter(i_score < before)
+                if after is not None:
+                    i_stmt = i_stmt.filter(i_score > after)
+                page_stmts.append(
+                    i_stmt.order_by(i_score.asc() if polling else i_score.desc()).limit(
+                        page_size + 1
+                    )
                 )
-                .join(Tweet.likes_of_tweet, isouter=True)
-                .join(Tweet.user_of_tweet)
-                .join(
-                    followings_subq,
-                    Tweet.author == followings_subq.c.following_id,
-                    isouter=True,
+            page_subq = union(*page_stmts).subquery()
+            page_ids_subq = (
+                select(page_subq.c.tweet_id, page_subq.c.score)
+                .order_by(
+                    page_subq.c.score.asc() if polling else page_subq.c.score.desc()
                 )
-                .group_by(Tweet.id, "author_name", "following_name")
-                .order_by("following_name", desc("likes_count"))
+                .limit(page_size + 1)
+                .subquery()
             )
-            tweets = tweets_query.all()
 
-            # get likes
-            likes_query = await _session.execute(
-                select(Like.tweet_id, Like.follower_id, User.name).join(
-                    Like.user_of_like
+            # plain column tuples: no ORM identity map and relationship loading
+            tweets_stmt = (
+                select(*FEED_COLUMNS)
+                .join(page_ids_subq, Tweet.id == page_ids_subq.c.tweet_id)
+                .order_by(
+                    page_ids_subq.c.score.asc()
+                    if polling
+                    else page_ids_subq.c.score.desc()
                 )
             )
-            likes = likes_query.all()
+
+            tweets_query = await _session.execute(tweets_stmt)
+            tweets = list(tweets_query.all())
+
+            has_more = len(tweets) > page_size
+            tweets = tweets[:page_size]
+            if polling:
+                tweets.reverse()
+
+            next_cursor = None
+            if has_more:
+                next_cursor = tweets[0].id if polling else tweets[-1].id
 
             # compile result
-            tweet_data = [i_tweet[0].to_json() for i_tweet in tweets]
-            tweet_author = [i_tweet[1] for i_tweet in tweets]
-
-            for i, i_tweet in enumerate(tweet_data):
-                # author compilation
-                i_tweet["author"] = {
-                    "id": i_tweet["author"],
-                    "name": tweet_author[i],
-                }
-
-                # attachments compilation
-                if i_tweet["attachments"]:
-                    i_attach_path_query = await _session.execute(
-                        select(Media.host_path).filter(
-                            Media.id.in_(i_tweet["attachments"])
-                        )
+            tweet_data = [feed_row_to_dict(i_tweet) for i_tweet in tweets]
+
+            await cls._hydrate_tweets(_session, tweet_data)
+            page = {"result": True, "tweets": tweet_data, "next_cursor": next_cursor}
+            await feed_cache.set_page(user.id, page_key, page, version)
+            return page
+
+        except SQLAlchemyError as exc:
+            logger_db.error("SQLAlchemy Error!..")
+            raise SQLAlchemyException(error_type=type(exc), error_message=str(exc))
+
+    @classmethod
+    async def search_tweets(
+        cls,
+        _session: AsyncSession,
+        api_key: str,
+        query: str,
+        limit: int | None = None,
+        cursor: str | None = None,
+    ) -> dict[str, Any]:
+        """
+        Tweets matching a web search query (words, "quoted phrase", or, -word),
+        the most relevant first. Matches are found by the GIN index of
+        content_search; pagination is a keyset over rank and tweet id:
+        "next_cursor" is "rank:id" of the last tweet, None if nothing left
+        """
+        await User.get_current_user(_session, api_key)
+        page_size = min(limit or settings.feed_page_size, settings.feed_page_size_max)
+        ts_query = func.websearch_to_tsquery(
+            literal_column(f"'{settings.search_config}'::regconfig"), query
+        )
+        rank = func.ts_rank(Tweet.content_search, ts_query)
+
+        try:
+            search_stmt = select(*FEED_COLUMNS, rank.label("rank")).filter(
+                Tweet.content_search.bool_op("@@")(ts_query)
+            )
+            if cursor is not None:
+                cursor_rank, _, cursor_id = cursor.partition(":")
+                search_stmt = search_stmt.filter(
+                    tuple_(rank, Tweet.id)
+                    < tuple_(literal(float(cursor_rank)), literal(int(cursor_id)))
+                )
+            search_query = await _session.execute(
+                search_stmt.order_by(rank.desc(), Tweet.id.desc()).limit(page_size + 1)
+            )
+            tweets = list(search_query.all())
+
+            next_cursor = None
+            if len(tweets) > page_size:
+                tweets = tweets[:page_size]
+                next_cursor = f"{tweets[-1].rank!r}:{tweets[-1].id}"
+
+            tweet_data = [feed_row_to_dict(i_tweet) for i_tweet in tweets]
+            await cls._hydrate_tweets(_session, tweet_data)
+            return {"result": True, "tweets": tweet_data, "next_cursor": next_cursor}
+
+        except SQLAlchemyError as exc:
+            logger_db.error("SQLAlchemy Error!..")
+            raise SQLAlchemyException(error_type=type(exc), error_message=str(exc))
+
+    @classmethod
+    async def _hydrate_tweets(
+        cls, _session: AsyncSession, tweet_data: list[dict[str, Any]]
+    ) -> None:
+        """
+        Replace attachment ids with paths to files and add author and likes to a page
+        of tweets. Only rows of the page are fetched: one query for media, one for
+        likes, user names are resolved through identity cache
+        """
+        if not tweet_data:
+            return
+
+        # attachments compilation
+        media_ids = {
+            i_media_id
+            for i_tweet in tweet_data
+            for i_media_id in i_tweet["attachments"] or []
+        }
+        media_paths: dict[int, str] = dict()
+        media_sizes: dict[int, dict[str, str]] = dict()
+        if media_ids:
+            media_query = await _session.execute(
+                select(Media.id, Media.host_path, MediaBlob.derivatives)
+                .outerjoin(MediaBlob, Media.blob_sha256 == MediaBlob.sha256)
+                .filter(Media.id.in_(media_ids))
+            )
+            for i_id, i_path, i_derivatives in media_query.all():
+                media_paths[i_id] = i_path
+                media_sizes[i_id] = {"original": i_path}
+                for i_size_name, i_file_name in (i_derivatives or dict()).items():
+                    media_sizes[i_id][i_size_name] = str(
+                        settings.media_dir_host / i_file_name
                     )
-                    i_attach_path = i_attach_path_query.scalars().all()
-                    # replace attachment ids with paths to files
-                    i_tweet["attachments"] = i_attach_path
-                # likes compilation
-                i_tweet["likes"] = list()
-                for tweet_id, follower_id, name in likes:
-                    if tweet_id == i_tweet["id"]:
-                        i_tweet["likes"].append({"user_id": follower_id, "name": name})
-            return {"result": True, "tweets": tweet_data}
+
+        # likes compilation
+        likes_query = await _session.execute(
+            select(Like.tweet_id, Like.follower_id)
+            .filter(Like.tweet_id.in_([i_tweet["id"] for i_tweet in tweet_data]))
+            .order_by(Like.id)
+        )
+        likes_rows = likes_query.all()
+
+        names = await User.get_names(
+            _session,
+            {i_tweet["author"] for i_tweet in tweet_data}
+            | {follower_id for _, follower_id in likes_rows},
+        )
+
+        likes: dict[int, list[dict[str, Any]]] = defaultdict(list)
+        for tweet_id, follower_id in likes_rows:
+            likes[tweet_id].append({"user_id": follower_id, "name": names[follower_id]})
+
+        for i_tweet in tweet_data:
+            # author compilation
+            i_tweet["author"] = {
+                "id": i_tweet["author"],
+                "name": names[i_tweet["author"]],
+            }
+            i_tweet["attachment_sizes"] = [
+                media_sizes[i_media_id]
+                for i_media_id in i_tweet["attachments"] or []
+                if i_media_id in media_sizes
+            ]
+            if i_tweet["attachments"]:
+                i_tweet["attachments"] = [
+                    media_paths[i_media_id]
+                    for i_media_id in i_tweet["attachments"]
+                    if i_media_id in media_paths
+                ]
+            i_tweet["likes"] = likes[i_tweet["id"]]
+
+    @classmethod
+    async def get_tweets_by_ids(
+        cls, _session: AsyncSession, api_key: str, tweet_ids: Iterable[int]
+    ) -> dict[str, Any]:
+        """
+        Tweets by ids in the shape of feed: one query for tweets, the rest as
+        for a feed page. Unknown ids are listed in "not_found"
+        """
+        await User.get_current_user(_session, api_key)
+        tweet_ids = list(dict.fromkeys(tweet_ids))
+        try:
+            tweets_query = await _session.execute(
+                select(*FEED_COLUMNS).filter(Tweet.id.in_(tweet_ids))
+            )
+            tweets = {
+                i_tweet.id: feed_row_to_dict(i_tweet) for i_tweet in tweets_query.all()
+            }
+            tweet_data = [tweets[i_id] for i_id in tweet_ids if i_id in tweets]
+            await cls._hydrate_tweets(_session, tweet_data)
+            return {
+                "result": True,
+                "tweets": tweet_data,
+                "not_found": [i_id for i_id in tweet_ids if i_id not in tweets],
+            }
 
         except SQLAlchemyError as exc:
             logger_db.error("SQLAlchemy Error!..")
@@ -428,17 +1090,30 @@ class Tweet(Base):
                 author=user.id,
             )
             _session.add(new_tweet)
+            await _session.flush()
+            new_tweet_id: int = new_tweet.id  # type:ignore
 
             # update row with tweet id in Media table
             if data["tweet_media_ids"]:
-                await _session.flush()
-                new_tweet_id = new_tweet.id
                 await _session.execute(
                     update(Media)
                     .values(tweet_id=new_tweet_id)
                     .where(Media.id.in_(data["tweet_media_ids"]))
                 )
+
+            await _session.execute(
+                update(User)
+                .values(tweets_count=User.tweets_count + 1)
+                .where(User.id == user.id)
+            )
+            await HomeTimeline.fan_out(_session, user.id, new_tweet_id)
+            audience = await HomeTimeline.audience(_session, [new_tweet_id])
             await _session.commit()
+            await feed_cache.invalidate(audience)
+            await profile_cache.invalidate([user.id])
+            await event_bus.publish(
+                audience, "tweet", {"id": new_tweet_id, "author_id": user.id}
+            )
 
             return new_tweet.id
 
@@ -451,36 +1126,68 @@ class Tweet(Base):
         cls, _session: AsyncSession, api_key: str, tweet_id: int
     ) -> bool:
         user = await User.get_current_user(_session, api_key)
-        tweet_to_delete = await _session.get(Tweet, tweet_id)
-        if tweet_to_delete is None:
+        # author only: the tweet entity (with its likes and media) is not loaded
+        tweet_author_query = await _session.execute(
+            select(Tweet.author).filter(Tweet.id == tweet_id)
+        )
+        tweet_author = tweet_author_query.scalar_one_or_none()
+        if tweet_author is None:
             raise ObjectNotFoundException(error_message="Tweet not found")
-        elif tweet_to_delete.author != user.id:
+        elif tweet_author != user.id:
             raise ObjectNotFoundException(
                 error_message="User does not have a permission to remove the tweet"
             )
 
-        attachment_to_delete = None
+        files_to_delete = []
         # get attachment locations for tweet to delete
         try:
-            if tweet_to_delete.attachments:
-                attachment_to_delete_query = await _session.execute(
-                    select(Media).filter(
-                        Media.id.in_(tweet_to_delete.attachments)  # type:ignore
-                    )
+            attachment_to_delete_query = await _session.execute(
+                select(Media.local_path, Media.blob_sha256).filter(
+                    Media.tweet_id == tweet_id
                 )
-                attachment_to_delete = attachment_to_delete_query.scalars()
+            )
+            attachment_to_delete = attachment_to_delete_query.all()
 
-            await _session.delete(tweet_to_delete)
-            await _session.commit()
-        except SQLAlchemyError as exc:
-            logger_db.error("SQLAlchemy Error!..")
-            raise SQLAlchemyException(error_type=type(exc), error_message=str(exc))
+            # retract the tweet from home timelines
+            audience = await HomeTimeline.audience(_session, [tweet_id])
+            await _session.execute(
+                delete(HomeTimeline).filter(HomeTimeline.tweet_id == tweet_id)
+            )
+            # likes and media rows are removed by foreign keys (on delete cascade)
+            await _session.execute(delete(Tweet).filter(Tweet.id == tweet_id))
 
-        # delete attachments
-        if attachment_to_delete is not None:
-            for i_media in attachment_to_delete:
-                # os.remove(i_media.local_path)  # type:ignore
-                await files_clean_up(_path=i_media.local_path)
+            # files of blobs are shared: removed with the last reference only
+            blobs_unused = await MediaBlob.release(
+                _session,
+                [
+                    i_media.blob_sha256
+                    for i_media in attachment_to_delete
+                    if i_media.blob_sha256 is not None
+                ],
+            )
+            files_to_delete = [
+                str(settings.media_dir_local / i_file_name)
+                for i_file_name in blobs_unused
+            ] + [
+                i_media.local_path
+                for i_media in attachment_to_delete
+                if i_media.blob_sha256 is None and i_media.local_path
+            ]
+            await _session.execute(
+                update(User)
+                .values(tweets_count=User.tweets_count - 1)
+                .where(User.id == user.id)
+            )
+            await _session.commit()
+            await feed_cache.invalidate(audience)
+            await profile_cache.invalidate([user.id])
+            await event_bus.publish(audience, "tweet_deleted", {"id": tweet_id})
+        except SQLAlchemyError as exc:
+            logger_db.error("SQLAlchemy Error!..")
+            raise SQLAlchemyException(error_type=type(exc), error_message=str(exc))
+
+        # delete attachments
+        files_clean_up(files_to_delete)
 
         return True
 
@@ -496,19 +1203,29 @@ class Tweet(Base):
         }
 
 
+# columns of a tweet in feed (as in TweetBaseWithPathsModel before hydration)
+FEED_COLUMNS = (
+    Tweet.id,
+    Tweet.content,
+    Tweet.attachments,
+    Tweet.author,
+    Tweet.like_count,
+)
+feed_row_to_dict = row_mapper(*FEED_COLUMNS)
+
+
 class FollowRelation(Base):
     __tablename__ = "follow_relations"
-    # __table_args__ = (
-    #     UniqueConstraint("id1", "id2", name="unique"),
-    # )
+    __table_args__ = (
+        UniqueConstraint("follower_id", "following_id", name="single_follow"),
+        # keyset pagination of followers and followings by follow id
+        Index("ix_follow_relations_follower_id", "follower_id", "id"),
+        Index("ix_follow_relations_following_id", "following_id", "id"),
+    )
 
     id = Column(Integer, primary_key=True)
-    follower_id = Column(
-        Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True
-    )
-    following_id = Column(
-        Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True
-    )
+    follower_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
+    following_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"))
     date_follow = Column(Date, default=func.now())
     date_unfollow = Column(Date, default=None)
 
@@ -517,11 +1234,13 @@ class FollowRelation(Base):
         "User",
         back_populates="following_to",
         foreign_keys="FollowRelation.follower_id",
+        lazy=RELATIONSHIP_LAZY,
     )
     following_user = relationship(
         "User",
         back_populates="following_by",
         foreign_keys="FollowRelation.following_id",
+        lazy=RELATIONSHIP_LAZY,
     )
 
     @classmethod
@@ -529,22 +1248,62 @@ class FollowRelation(Base):
         cls, _session: AsyncSession, api_key: str, user_id: int
     ) -> Any:
         user = await User.get_current_user(_session, api_key)
+        try:
+            # insert follow if user exists, is not me and follow doesn't exist yet,
+            # and update follow counters of both users in the same statement
+            new_follow_cte = (
+                insert(FollowRelation)
+                .from_select(
+                    ["follower_id", "following_id"],
+                    select(literal(user.id), User.id).filter(
+                        User.id == user_id, User.id != user.id
+                    ),
+                )
+                .on_conflict_do_nothing(constraint="single_follow")
+                .returning(FollowRelation.follower_id, FollowRelation.following_id)
+                .cte("new_follow")
+            )
+            followed_query = await _session.execute(
+                update(User)
+                .values(
+                    followers_count=User.followers_count
+                    + case((User.id == new_follow_cte.c.following_id, 1), else_=0),
+                    following_count=User.following_count
+                    + case((User.id == new_follow_cte.c.follower_id, 1), else_=0),
+                )
+                .where(
+                    User.id.in_(
+                        [new_follow_cte.c.follower_id, new_follow_cte.c.following_id]
+                    )
+                )
+                .returning(User.id, User.fanout_on_read)
+                .execution_options(synchronize_session=False)
+            )
+            followed = {i_id: i_fanout for i_id, i_fanout in followed_query.all()}
 
-        user_requested = await _session.get(User, user_id)
-        if user_requested is None:
-            raise ObjectNotFoundException(error_message="User not found.")
-
-        if user.id == user_id:
-            logger_db.info("!!! You can't follow yourself!")
-            return False
+            if user_id not in followed:
+                # nothing inserted: find out why
+                user_exist_query = await _session.execute(
+                    select(User.id).filter(User.id == user_id)
+                )
+                if user_exist_query.one_or_none() is None:
+                    raise ObjectNotFoundException(error_message="User not found.")
+                if user.id == user_id:
+                    logger_db.info("!!! You can't follow yourself!")
+                    return False
+                logger_db.info("!!! Follow already exists! No record created")
+                return True
 
-        new_follow = FollowRelation(
-            follower_id=user.id,
-            following_id=user_id,
-        )
-        try:
-            _session.add(new_follow)
+            if not followed[user_id]:
+                await HomeTimeline.backfill(_session, user.id, [user_id])
             await _session.commit()
+            await feed_cache.invalidate([user.id])
+            await profile_cache.invalidate([user.id, user_id])
+            await event_bus.publish(
+                [user.id, user_id],
+                "follow",
+                {"follower_id": user.id, "following_ids": [user_id]},
+            )
             return True
 
         except SQLAlchemyError as exc:
@@ -569,13 +1328,192 @@ class FollowRelation(Base):
                 raise ObjectNotFoundException(
                     error_message="User does not follow this user"
                 )
+            await FollowRelation._count(
+                _session, user.id, user_id, -follow_to_delete.rowcount
+            )
+            await HomeTimeline.prune(_session, user.id, [user_id])
             await _session.commit()
+            await feed_cache.invalidate([user.id])
+            await profile_cache.invalidate([user.id, user_id])
+            await event_bus.publish(
+                [user.id, user_id],
+                "unfollow",
+                {"follower_id": user.id, "following_ids": [user_id]},
+            )
             return True
 
         except SQLAlchemyError as exc:
             logger_db.error("SQLAlchemy Error!..")
             raise SQLAlchemyException(error_type=type(exc), error_message=str(exc))
 
+    @classmethod
+    async def create_follows(
+        cls, _session: AsyncSession, api_key: str, user_ids: Iterable[int]
+    ) -> dict[str, Any]:
+        """
+        Follow many users in one transaction: follows are inserted and counters
+        of all users updated in one statement, timeline backfilled in another
+        """
+        user = await User.get_current_user(_session, api_key)
+        user_ids = list(dict.fromkeys(user_ids))
+        try:
+            new_follows_cte = (
+                insert(FollowRelation)
+                .from_select(
+                    ["follower_id", "following_id"],
+                    select(literal(user.id), User.id).filter(
+                        User.id.in_(user_ids), User.id != user.id
+                    ),
+                )
+                .on_conflict_do_nothing(constraint="single_follow")
+                .returning(FollowRelation.following_id)
+                .cte("new_follows")
+            )
+            followed_ids = select(new_follows_cte.c.following_id)
+            followed_query = await _session.execute(
+                update(User)
+                .values(
+                    followers_count=User.followers_count
+                    + case((User.id.in_(followed_ids), 1), else_=0),
+                    following_count=User.following_count
+                    + case(
+                        (
+                            User.id == user.id,
+                            select(func.count())
+                            .select_from(new_follows_cte)
+                            .scalar_subquery(),
+                        ),
+                        else_=0,
+                    ),
+                )
+                .where(or_(User.id == user.id, User.id.in_(followed_ids)))
+                .returning(User.id, User.fanout_on_read)
+                .execution_options(synchronize_session=False)
+            )
+            followed = {
+                i_id: i_fanout
+                for i_id, i_fanout in followed_query.all()
+                if i_id != user.id
+            }
+
+            statuses = {i_id: "created" for i_id in followed}
+            missed = [i_id for i_id in user_ids if i_id not in followed]
+            if missed:
+                # nothing inserted: find out why
+                users_exist_query = await _session.execute(
+                    select(User.id).filter(User.id.in_(missed))
+                )
+                users_exist = set(users_exist_query.scalars().all())
+                for i_id in missed:
+                    if i_id not in users_exist:
+                        statuses[i_id] = "not_found"
+                    elif i_id == user.id:
+                        statuses[i_id] = "not_allowed"
+                    else:
+                        statuses[i_id] = "exists"
+
+            backfill_ids = [i_id for i_id, i_fanout in followed.items() if not i_fanout]
+            if backfill_ids:
+                await HomeTimeline.backfill(_session, user.id, backfill_ids)
+            await _session.commit()
+            if followed:
+                await feed_cache.invalidate([user.id])
+                await profile_cache.invalidate([user.id, *followed])
+                await event_bus.publish(
+                    [user.id, *followed],
+                    "follow",
+                    {"follower_id": user.id, "following_ids": list(followed)},
+                )
+            return batch_results(user_ids, statuses)
+
+        except SQLAlchemyError as exc:
+            logger_db.error("SQLAlchemy Error!..")
+            raise SQLAlchemyException(error_type=type(exc), error_message=str(exc))
+
+    @classmethod
+    async def delete_follows(
+        cls, _session: AsyncSession, api_key: str, user_ids: Iterable[int]
+    ) -> dict[str, Any]:
+        """
+        Unfollow many users in one transaction: follows are deleted and counters
+        of all users updated in one statement, timeline pruned in another
+        """
+        user = await User.get_current_user(_session, api_key)
+        user_ids = list(dict.fromkeys(user_ids))
+        try:
+            deleted_follows_cte = (
+                delete(FollowRelation)
+                .filter(
+                    FollowRelation.follower_id == user.id,
+                    FollowRelation.following_id.in_(user_ids),
+                )
+                .returning(FollowRelation.following_id)
+                .cte("deleted_follows")
+            )
+            unfollowed_ids = select(deleted_follows_cte.c.following_id)
+            unfollowed_query = await _session.execute(
+                update(User)
+                .values(
+                    followers_count=User.followers_count
+                    - case((User.id.in_(unfollowed_ids), 1), else_=0),
+                    following_count=User.following_count
+                    - case(
+                        (
+                            User.id == user.id,
+                            select(func.count())
+                            .select_from(deleted_follows_cte)
+                            .scalar_subquery(),
+                        ),
+                        else_=0,
+                    ),
+                )
+                .where(or_(User.id == user.id, User.id.in_(unfollowed_ids)))
+                .returning(User.id)
+                .execution_options(synchronize_session=False)
+            )
+            unfollowed = set(unfollowed_query.scalars().all()) - {user.id}
+
+            if unfollowed:
+                await HomeTimeline.prune(_session, user.id, unfollowed)
+            await _session.commit()
+            if unfollowed:
+                await feed_cache.invalidate([user.id])
+                await profile_cache.invalidate([user.id, *unfollowed])
+                await event_bus.publish(
+                    [user.id, *unfollowed],
+                    "unfollow",
+                    {"follower_id": user.id, "following_ids": sorted(unfollowed)},
+                )
+            return batch_results(
+                user_ids,
+                {
+                    i_id: "deleted" if i_id in unfollowed else "not_found"
+                    for i_id in user_ids
+                },
+            )
+
+        except SQLAlchemyError as exc:
+            logger_db.error("SQLAlchemy Error!..")
+            raise SQLAlchemyException(error_type=type(exc), error_message=str(exc))
+
+    @classmethod
+    async def _count(
+        cls, _session: AsyncSession, follower_id: int, following_id: int, delta: int
+    ) -> None:
+        """
+        Update follow counters of both users by delta
+        """
+        await _session.execute(
+            update(User)
+            .values(following_count=User.following_count + delta)
+            .where(User.id == follower_id)
+        )
+        await _session.execute(
+            update(User)
+            .values(followers_count=User.followers_count + delta)
+            .where(User.id == following_id)
+        )
+
     def __repr__(self):
         return (
             f"Пользователь {self.follower_id} "
@@ -590,9 +1528,8 @@ class FollowRelation(Base):
 
 class Like(Base):
     __tablename__ = "likes"
-    # __table_args__ = (
-    #     UniqueConstraint("tweet_id", "follower_id", name="single_like"),
-    # )
+    __table_args__ = (UniqueConstraint("tweet_id", "follower_id", name="single_like"),)
+
     id = Column(Integer, primary_key=True)
     tweet_id = Column(Integer, ForeignKey("tweets.id", ondelete="CASCADE"), index=True)
     follower_id = Column(
@@ -602,8 +1539,12 @@ class Like(Base):
     date_unlike = Column(Date, default=None)
 
     # Define back references for relationships
-    user_of_like = relationship("User", back_populates="likes_of_user")
-    tweet_with_like = relationship("Tweet", back_populates="likes_of_tweet")
+    user_of_like = relationship(
+        "User", back_populates="likes_of_user", lazy=RELATIONSHIP_LAZY
+    )
+    tweet_with_like = relationship(
+        "Tweet", back_populates="likes_of_tweet", lazy=RELATIONSHIP_LAZY
+    )
 
     @classmethod
     async def create_like(
@@ -611,51 +1552,54 @@ class Like(Base):
     ) -> Any:
         user = await User.get_current_user(_session, api_key)
         try:
-            # check whether tweet exists
-            tweet_exist_query = await _session.execute(
-                select(Tweet.id).filter(Tweet.id == tweet_id)
+            # insert like if tweet exists, is not mine and like doesn't exist yet,
+            # and update like counter of the tweet in the same statement
+            new_like_cte = (
+                insert(Like)
+                .from_select(
+                    ["tweet_id", "follower_id"],
+                    select(Tweet.id, literal(user.id)).filter(
+                        Tweet.id == tweet_id, Tweet.author != user.id
+                    ),
+                )
+                .on_conflict_do_nothing(constraint="single_like")
+                .returning(Like.tweet_id)
+                .cte("new_like")
+            )
+            liked_query = await _session.execute(
+                update(Tweet)
+                .values(like_count=Tweet.like_count + 1)
+                .where(Tweet.id == new_like_cte.c.tweet_id)
+                .returning(Tweet.like_count)
+                .execution_options(synchronize_session=False)
             )
+            like_count = liked_query.scalar_one_or_none()
 
-            tweet_exist = tweet_exist_query.one_or_none()
-            if tweet_exist:
-                # check whether tweet owner is current user
-                tweet_is_mine_query = await _session.execute(
-                    select(Tweet.author).filter(
-                        and_(Tweet.id == tweet_id, Tweet.author == user.id)
-                    )
+            if like_count is None:
+                # nothing inserted: find out why
+                tweet_author_query = await _session.execute(
+                    select(Tweet.author).filter(Tweet.id == tweet_id)
                 )
-                tweet_is_mine = tweet_is_mine_query.one_or_none()
-
-                if tweet_is_mine:
+                tweet_author = tweet_author_query.scalar_one_or_none()
+                if tweet_author is None:
+                    raise ObjectNotFoundException(error_message="Tweet not found")
+                if tweet_author == user.id:
                     logger_db.info(
                         "Create like.. Fail! Like personal tweets is not allowed"
                     )
-                    return False
-
-                # check whether like by current user exists
-                like_exist_query = await _session.execute(
-                    select(Like.id).filter(
-                        and_(Like.tweet_id == tweet_id, Like.follower_id == user.id)
-                    )
-                )
-                like_exist = like_exist_query.one_or_none()
-
-                if like_exist:
+                else:
                     logger_db.info(
                         "Create like.. Like already exists! No record created"
                     )
-                    return False
-
-                new_like = Like(
-                    tweet_id=tweet_id,
-                    follower_id=user.id,
-                )
-                _session.add(new_like)
-                await _session.commit()
-                return True
+                return False
 
-            else:
-                raise ObjectNotFoundException(error_message="Tweet not found")
+            audience = await HomeTimeline.audience(_session, [tweet_id])
+            await _session.commit()
+            await feed_cache.invalidate(audience)
+            await event_bus.publish(
+                audience, "like", like_counts({tweet_id: like_count})
+            )
+            return True
 
         except SQLAlchemyError as exc:
             logger_db.error("SQLAlchemy Error!..")
@@ -679,13 +1623,125 @@ class Like(Base):
                 raise ObjectNotFoundException(
                     error_message="User's like not found on this tweet"
                 )
+            like_count_query = await _session.execute(
+                update(Tweet)
+                .values(like_count=Tweet.like_count - like_to_delete.rowcount)
+                .where(Tweet.id == tweet_id)
+                .returning(Tweet.like_count)
+            )
+            like_count = like_count_query.scalar_one()
+            audience = await HomeTimeline.audience(_session, [tweet_id])
             await _session.commit()
+            await feed_cache.invalidate(audience)
+            await event_bus.publish(
+                audience, "like", like_counts({tweet_id: like_count})
+            )
             return True
 
         except SQLAlchemyError as exc:
             logger_db.error("SQLAlchemy Error!..")
             raise SQLAlchemyException(error_type=type(exc), error_message=str(exc))
 
+    @classmethod
+    async def create_likes(
+        cls, _session: AsyncSession, api_key: str, tweet_ids: Iterable[int]
+    ) -> dict[str, Any]:
+        """
+        Like many tweets in one transaction: likes are inserted and like counters
+        updated in one statement
+        """
+        user = await User.get_current_user(_session, api_key)
+        tweet_ids = list(dict.fromkeys(tweet_ids))
+        try:
+            new_likes_cte = (
+                insert(Like)
+                .from_select(
+                    ["tweet_id", "follower_id"],
+                    select(Tweet.id, literal(user.id)).filter(
+                        Tweet.id.in_(tweet_ids), Tweet.author != user.id
+                    ),
+                )
+                .on_conflict_do_nothing(constraint="single_like")
+                .returning(Like.tweet_id)
+                .cte("new_likes")
+            )
+            liked_query = await _session.execute(
+                update(Tweet)
+                .values(like_count=Tweet.like_count + 1)
+                .where(Tweet.id == new_likes_cte.c.tweet_id)
+                .returning(Tweet.id, Tweet.like_count)
+                .execution_options(synchronize_session=False)
+            )
+            liked = dict(liked_query.tuples().all())
+
+            statuses = {i_id: "created" for i_id in liked}
+            missed = [i_id for i_id in tweet_ids if i_id not in liked]
+            if missed:
+                # nothing inserted: find out why
+                tweet_authors_query = await _session.execute(
+                    select(Tweet.id, Tweet.author).filter(Tweet.id.in_(missed))
+                )
+                tweet_authors = dict(tweet_authors_query.tuples().all())
+                for i_id in missed:
+                    if i_id not in tweet_authors:
+                        statuses[i_id] = "not_found"
+                    elif tweet_authors[i_id] == user.id:
+                        statuses[i_id] = "not_allowed"
+                    else:
+                        statuses[i_id] = "exists"
+
+            audience = await HomeTimeline.audience(_session, liked) if liked else []
+            await _session.commit()
+            await feed_cache.invalidate(audience)
+            await event_bus.publish(audience, "like", like_counts(liked))
+            return batch_results(tweet_ids, statuses)
+
+        except SQLAlchemyError as exc:
+            logger_db.error("SQLAlchemy Error!..")
+            raise SQLAlchemyException(error_type=type(exc), error_message=str(exc))
+
+    @classmethod
+    async def delete_likes(
+        cls, _session: AsyncSession, api_key: str, tweet_ids: Iterable[int]
+    ) -> dict[str, Any]:
+        """
+        Unlike many tweets in one transaction: likes are deleted and like counters
+        updated in one statement
+        """
+        user = await User.get_current_user(_session, api_key)
+        tweet_ids = list(dict.fromkeys(tweet_ids))
+        try:
+            deleted_likes_cte = (
+                delete(Like)
+                .filter(Like.follower_id == user.id, Like.tweet_id.in_(tweet_ids))
+                .returning(Like.tweet_id)
+                .cte("deleted_likes")
+            )
+            unliked_query = await _session.execute(
+                update(Tweet)
+                .values(like_count=Tweet.like_count - 1)
+                .where(Tweet.id == deleted_likes_cte.c.tweet_id)
+                .returning(Tweet.id, Tweet.like_count)
+                .execution_options(synchronize_session=False)
+            )
+            unliked = dict(unliked_query.tuples().all())
+
+            audience = await HomeTimeline.audience(_session, unliked) if unliked else []
+            await _session.commit()
+            await feed_cache.invalidate(audience)
+            await event_bus.publish(audience, "like", like_counts(unliked))
+            return batch_results(
+                tweet_ids,
+                {
+                    i_id: "deleted" if i_id in unliked else "not_found"
+                    for i_id in tweet_ids
+                },
+            )
+
+        except SQLAlchemyError as exc:
+            logger_db.error("SQLAlchemy Error!..")
+            raise SQLAlchemyException(error_type=type(exc), error_message=str(exc))
+
     def __repr__(self):
         return f"Пользователь {self.follower_id} " f"отметил твит {self.tweet_id}"
 
@@ -695,6 +1751,322 @@ class Like(Base):
         }
 
 
+class HomeTimeline(Base):
+    """
+    Materialized home timeline: feed entries of a user scored by tweet id.
+    Filled on tweet creation (fan-out on write) and on follow (backfill)
+    """
+
+    __tablename__ = "home_timeline"
+    __table_args__ = (Index("ix_home_timeline_user_score", "user_id", "score"),)
+
+    user_id = Column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True
+    )
+    tweet_id = Column(
+        Integer, ForeignKey("tweets.id", ondelete="CASCADE"), primary_key=True
+    )
+    score = Column(BigInteger, nullable=False)
+
+    @classmethod
+    async def fan_out(
+        cls, _session: AsyncSession, author_id: int, tweet_id: int
+    ) -> None:
+        """
+        Put a new tweet to home timelines of the author and of his followers.
+        Accounts with more followers than allowed are switched to fan-out on read
+        """
+        await _session.execute(
+            insert(HomeTimeline)
+            .values(user_id=author_id, tweet_id=tweet_id, score=tweet_id)
+            .on_conflict_do_nothing()
+        )
+
+        followers_count_query = await _session.execute(
+            select(User.followers_count).filter(User.id == author_id)
+        )
+        if followers_count_query.scalar_one() > settings.fanout_followers_max:
+            logger_db.info("!!! User %s is fanned out on read", author_id)
+            await _session.execute(
+                update(User)
+                .values(fanout_on_read=True)
+                .where(User.id == author_id, User.fanout_on_read.is_(False))
+            )
+            return
+
+        await _session.execute(
+            insert(HomeTimeline)
+            .from_select(
+                ["user_id", "tweet_id", "score"],
+                select(FollowRelation.follower_id, literal(tweet_id), literal(tweet_id))
+                .filter(
+                    FollowRelation.following_id == author_id,
+                    FollowRelation.follower_id != author_id,
+                )
+                .distinct(),
+            )
+            .on_conflict_do_nothing()
+        )
+
+    @classmethod
+    async def backfill(
+        cls, _session: AsyncSession, user_id: int, following_ids: Iterable[int]
+    ) -> None:
+        """
+        Put recent tweets of followed users to home timeline of the follower
+        """
+        recent_tweets = (
+            select(Tweet.id)
+            .filter(Tweet.author == User.id)
+            .order_by(Tweet.id.desc())
+            .limit(settings.timeline_backfill_size)
+            .lateral("recent_tweets")
+        )
+        await _session.execute(
+            insert(HomeTimeline)
+            .from_select(
+                ["user_id", "tweet_id", "score"],
+                select(literal(user_id), recent_tweets.c.id, recent_tweets.c.id)
+                .select_from(User)
+                .join(recent_tweets, true())
+                .filter(User.id.in_(list(following_ids))),
+            )
+            .on_conflict_do_nothing()
+        )
+
+    @classmethod
+    async def prune(
+        cls, _session: AsyncSession, user_id: int, following_ids: Iterable[int]
+    ) -> None:
+        """
+        Remove tweets of unfollowed users from home timeline of the follower
+        """
+        await _session.execute(
+            delete(HomeTimeline).filter(
+                HomeTimeline.user_id == user_id,
+                HomeTimeline.tweet_id.in_(
+                    select(Tweet.id).filter(Tweet.author.in_(list(following_ids)))
+                ),
+            )
+        )
+
+    @classmethod
+    async def audience(
+        cls, _session: AsyncSession, tweet_ids: Iterable[int]
+    ) -> list[int]:
+        """
+        Ids of users whose feed shows the tweets: the authors, their followers
+        and users having the tweets in home timeline
+        """
+        tweet_ids = list(tweet_ids)
+        authors_subq = select(Tweet.author).filter(Tweet.id.in_(tweet_ids))
+        audience_query = await _session.execute(
+            union(
+                authors_subq,
+                select(FollowRelation.follower_id).filter(
+                    FollowRelation.following_id.in_(authors_subq)
+                ),
+                select(HomeTimeline.user_id).filter(
+                    HomeTimeline.tweet_id.in_(tweet_ids)
+                ),
+            )
+        )
+        return list(audience_query.scalars().all())
+
+    @classmethod
+    async def rebuild(cls, _session: AsyncSession) -> None:
+        """
+        Fill home timelines from scratch with own tweets and tweets of followed users
+        (for data created bypassing fan-out, e.g. dummy data)
+        """
+        await _session.execute(delete(HomeTimeline))
+        await _session.execute(
+            insert(HomeTimeline).from_select(
+                ["user_id", "tweet_id", "score"],
+                union(
+                    select(Tweet.author, Tweet.id, Tweet.id),
+                    select(FollowRelation.follower_id, Tweet.id, Tweet.id)
+                    .join(FollowRelation, FollowRelation.following_id == Tweet.author)
+                    .join(User, User.id == Tweet.author)
+                    .filter(User.fanout_on_read.is_(False)),
+                ),
+            )
+        )
+
+    def __repr__(self):
+        return f"Лента пользователя {self.user_id}: твит {self.tweet_id}"
+
+
+class MediaBlob(Base):
+    __tablename__ = "media_blobs"
+
+    sha256 = Column(String(64), primary_key=True)
+    file_name = Column(String(200), nullable=False)
+    content_type = Column(String(50), nullable=False)
+    size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, nullable=False, server_default="1")
+    # size name -> file name of re-encoded image, filled in background
+    derivatives = Column(JSON, nullable=True)
+
+    media_of_blob = relationship(
+        "Media", back_populates="blob_of_media", lazy=RELATIONSHIP_LAZY
+    )
+
+    @staticmethod
+    def relative_path(sha256: str, extension: str) -> pathlib.Path:
+        """
+        Blob location sharded by the leading hex digits of its hash: ab/cd/abcd...
+        """
+        return pathlib.Path(sha256[:2], sha256[2:4], f"{sha256}.{extension}")
+
+    @classmethod
+    async def acquire(
+        cls,
+        _session: AsyncSession,
+        media_path_local: pathlib.Path,
+        upload: StreamedUpload,
+    ) -> "MediaBlob":
+        """
+        Reference the blob with the content of upload. The file is stored only once:
+        the upload replaces the file of the blob, so a file queued for removal
+        after the blob was released is put back (the removal skips referenced
+        blobs under the same lock)
+        """
+        relative_path = cls.relative_path(upload.sha256, upload.extension)
+        # concurrent uploads and removals of the same content wait here
+        await _session.execute(select(blob_lock(upload.sha256)))
+        blob_query = await _session.execute(
+            insert(MediaBlob)
+            .values(
+                sha256=upload.sha256,
+                file_name=str(relative_path),
+                content_type=upload.content_type,
+                size=upload.size,
+            )
+            .on_conflict_do_update(
+                index_elements=[MediaBlob.sha256],
+                set_={"ref_count": MediaBlob.ref_count + 1},
+            )
+            .returning(MediaBlob)
+        )
+        blob = blob_query.scalar_one()
+
+        destination_local = media_path_local / blob.file_name
+        try:
+            await aiofiles.os.makedirs(destination_local.parent, exist_ok=True)
+            # the file is already on the same disk: rename instead of copy,
+            # an existing file has the same content
+            await aiofiles.os.replace(upload.path, destination_local)
+        except OSError:
+            await _session.rollback()
+            raise AppException(error_message="Error! File not saved.")
+        return blob
+
+    @classmethod
+    async def release(
+        cls, _session: AsyncSession, blob_ids: Iterable[str]
+    ) -> list[str]:
+        """
+        Drop a reference for every item of blob_ids (a blob may repeat).
+        Return file names of blobs which are not referenced anymore
+        """
+        references: Dict[str, int] = defaultdict(int)
+        for i_blob_id in blob_ids:
+            references[i_blob_id] += 1
+        if not references:
+            return []
+
+        await _session.execute(
+            update(MediaBlob)
+            .values(
+                ref_count=MediaBlob.ref_count
+                - case(references, value=MediaBlob.sha256, else_=0)
+            )
+            .where(MediaBlob.sha256.in_(references))
+            .execution_options(synchronize_session=False)
+        )
+        unused_query = await _session.execute(
+            delete(MediaBlob)
+            .where(MediaBlob.sha256.in_(references), MediaBlob.ref_count <= 0)
+            .returning(MediaBlob.file_name, MediaBlob.derivatives)
+            .execution_options(synchronize_session=False)
+        )
+        files_unused = []
+        for i_file_name, i_derivatives in unused_query.all():
+            files_unused.append(i_file_name)
+            files_unused.extend((i_derivatives or dict()).values())
+        return files_unused
+
+    @classmethod
+    async def set_derivatives(
+        cls, _session: AsyncSession, sha256: str, derivatives: Dict[str, str]
+    ) -> None:
+        """
+        Record generated derivatives and drop feed pages showing the blob
+        """
+        try:
+            result = await _session.execute(
+                update(MediaBlob)
+                .values(derivatives=derivatives)
+                .where(MediaBlob.sha256 == sha256)
+            )
+            if result.rowcount == 0:  # type: ignore
+                # the blob has been released meanwhile
+                files_clean_up(
+                    str(settings.media_dir_local / i_file_name)
+                    for i_file_name in derivatives.values()
+                )
+                return
+
+            tweet_ids_query = await _session.execute(
+                select(Media.tweet_id)
+                .filter(Media.blob_sha256 == sha256, Media.tweet_id.is_not(None))
+                .distinct()
+            )
+            audience = await HomeTimeline.audience(
+                _session, tweet_ids_query.scalars().all()
+            )
+            await _session.commit()
+            await feed_cache.invalidate(audience)
+        except SQLAlchemyError as exc:
+            logger_db.error("SQLAlchemy Error!..")
+            raise SQLAlchemyException(error_type=type(exc), error_message=str(exc))
+
+    @classmethod
+    async def get_identity(cls, _session: AsyncSession, file_name: str) -> str:
+        """
+        Stable identity of a stored media file (original or derivative) for ETag:
+        files never change under their names
+        """
+        try:
+            sha256 = pathlib.PurePath(file_name).stem[:64]
+            blob = await _session.get(MediaBlob, sha256)
+            if blob is not None:
+                if file_name == blob.file_name:
+                    return sha256
+                for i_size_name, i_file_name in (blob.derivatives or dict()).items():
+                    if file_name == i_file_name:
+                        return f"{sha256}-{i_size_name}"
+
+            # files stored before content addressing
+            media_id_query = await _session.execute(
+                select(Media.id).filter(
+                    Media.file_name == file_name, Media.blob_sha256.is_(None)
+                )
+            )
+            media_id = media_id_query.scalars().first()
+        except SQLAlchemyError as exc:
+            logger_db.error("SQLAlchemy Error!..")
+            raise SQLAlchemyException(error_type=type(exc), error_message=str(exc))
+
+        if media_id is None:
+            raise ObjectNotFoundException(error_message="Media not found")
+        return f"media-{media_id}"
+
+    def __repr__(self):
+        return f"файл {self.file_name}: ссылок {self.ref_count}"
+
+
 class Media(Base):
     __tablename__ = "media_attachments"
 
@@ -703,27 +2075,17 @@ class Media(Base):
     file_name = Column(String(1000))
     local_path = Column(String(1000))
     host_path = Column(String(500))
+    blob_sha256 = Column(
+        String(64), ForeignKey("media_blobs.sha256"), index=True, nullable=True
+    )
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
 
-    tweet_with_media = relationship("Tweet", back_populates="media_of_tweet")
-
-    @staticmethod
-    async def check_file(_session: AsyncSession, file) -> bool:
-        # Get the file size (in bytes)
-        file.file.seek(0, 2)
-        file_size = file.file.tell()
-
-        # move the cursor back to the beginning
-        await file.seek(0)
-
-        if file_size > 2 * 1024 * 1024:
-            # more than 2 MB
-            raise HTTPException(status_code=400, detail="File is too large (over 2Mb)")
-
-        # check the content type (MIME type)
-        content_type = file.content_type
-        if content_type not in ["image/jpeg", "image/png", "image/gif"]:
-            raise HTTPException(status_code=400, detail="Invalid file type")
-        return True
+    tweet_with_media = relationship(
+        "Tweet", back_populates="media_of_tweet", lazy=RELATIONSHIP_LAZY
+    )
+    blob_of_media = relationship(
+        "MediaBlob", back_populates="media_of_blob", lazy=RELATIONSHIP_LAZY
+    )
 
     @staticmethod
     async def process_file(
@@ -731,49 +2093,27 @@ class Media(Base):
         _session: AsyncSession,
         media_path_host: pathlib.Path,
         media_path_local: pathlib.Path,
-        file: UploadFile,
+        upload: StreamedUpload,
     ) -> int:
-        destination_local = pathlib.Path("")
-        media_data = dict()
-        try:
-            # getting an ID for new attachment record
-            new_media = Media()
-            _session.add(new_media)
-            await _session.flush()
-        except SQLAlchemyError as exc:
-            logger_db.error("SQLAlchemy Error!..")
-            raise SQLAlchemyException(error_type=type(exc), error_message=str(exc))
-
-        if file.filename:
-            reg_filename = "{file_id}_{api_key}_media.{extension}".format(
-                file_id=new_media.id,
-                api_key=api_key,
-                extension=file.filename.split(".")[-1:][0],
-            )
-            destination_local = media_path_local / reg_filename
-            destination_host = media_path_host / reg_filename
-            media_data = {
-                "file_name": reg_filename,
-                "local_path": str(destination_local),
-                "host_path": str(destination_host),
-            }
-
-        try:
-            # copy the file contents
-            file_content = await file.read()
-            async with aiofiles.open(destination_local, "w+b") as new_file:
-                await new_file.write(file_content)
-        except Exception:
-            raise AppException(error_message="Error! File not saved.")
-
+        """
+        Register the upload streamed to a temporary file as a reference to
+        the content-addressed blob
+        """
         try:
-            # updating attachment record with data
-            await _session.execute(
-                update(Media).values(**media_data).where(Media.id == new_media.id)
+            blob = await MediaBlob.acquire(_session, media_path_local, upload)
+            new_media = Media(
+                file_name=blob.file_name,
+                local_path=str(media_path_local / blob.file_name),
+                host_path=str(media_path_host / blob.file_name),
+                blob_sha256=blob.sha256,
             )
+            _session.add(new_media)
             await _session.commit()
+            logger_db.info("!!! Media %s uploaded by %s", new_media.id, api_key)
             return new_media.id
 
         except SQLAlchemyError as exc:
             logger_db.error("SQLAlchemy Error!..")
+            if await aiofiles.os.path.exists(upload.path):
+                await aiofiles.os.remove(upload.path)
             raise SQLAlchemyException(error_type=type(exc), error_message=str(exc))
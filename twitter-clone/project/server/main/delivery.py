@@ -0,0 +1,134 @@
+import logging
+import mimetypes
+import os
+import pathlib
+from typing import Any, AsyncIterator, Dict, Tuple
+
+import aiofiles
+from starlette.requests import Request
+from starlette.responses import FileResponse, Response, StreamingResponse
+
+from .cache import FeedCache
+from .config import Settings, get_settings
+from .error_handler import ObjectNotFoundException
+
+# Initialize logging
+logger_delivery = logging.getLogger("logger_delivery")
+
+# setting environment
+settings: Settings = get_settings()
+
+mimetypes.add_type("image/webp", ".webp")
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Weak comparison of If-None-Match header with ETag
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    etag = etag.removeprefix("W/")
+    return any(
+        i_tag.strip().removeprefix("W/") == etag for i_tag in if_none_match.split(",")
+    )
+
+
+async def version_headers(
+    cache: FeedCache, owner_id: int, *parts: Any
+) -> Dict[str, str]:
+    """
+    Headers of conditional requests for data of the owner (feed of a viewer,
+    profile of a user): weak ETag by version token of the data in the cache and
+    request parameters, revalidated by clients every time
+    """
+    version = await cache.get_version(owner_id)
+    etag = "-".join(str(i_part) for i_part in (version, *parts))
+    return {"ETag": f'W/"{etag}"', "Cache-Control": "private, no-cache"}
+
+
+def parse_range(range_header: str, size: int) -> Tuple[int, int] | None:
+    """
+    First and last byte of a single range "bytes=first-last", "bytes=first-" or
+    "bytes=-suffix". None for other forms which are answered by the whole file.
+    ValueError if the range is not satisfiable
+    """
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in ranges:
+        return None
+    first_str, _, last_str = ranges.strip().partition("-")
+    if not (first_str + last_str).isdigit():
+        return None
+
+    if not first_str:
+        # the last bytes of the file
+        first, last = max(size - int(last_str), 0), size - 1
+    else:
+        first = int(first_str)
+        last = min(int(last_str), size - 1) if last_str else size - 1
+    if first > last or first >= size:
+        raise ValueError("Range not satisfiable")
+    return first, last
+
+
+async def read_range(path: pathlib.Path, first: int, last: int) -> AsyncIterator[bytes]:
+    async with aiofiles.open(path, "rb") as file:
+        await file.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = await file.read(min(settings.upload_chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def media_response(request: Request, file_name: str, identity: str) -> Response:
+    """
+    Response for a stored media file. Files never change under their names, so
+    the ETag comes from the stored identity and caching is unlimited. With
+    media_accel_redirect the bytes are sent by nginx from its internal location
+    """
+    etag = f'"{identity}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={settings.media_cache_max_age}, immutable",
+        "Accept-Ranges": "bytes",
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+
+    media_type = mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+    if settings.media_accel_redirect:
+        # nginx serves ranges of static files itself
+        headers["X-Accel-Redirect"] = f"{settings.media_accel_redirect}/{file_name}"
+        return Response(headers=headers, media_type=media_type)
+
+    path = settings.media_dir_local / file_name
+    try:
+        size = os.stat(path).st_size
+    except FileNotFoundError:
+        logger_delivery.error("!!! Media file is missing: %s", path)
+        raise ObjectNotFoundException(error_message="Media not found")
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range == etag):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        if byte_range is not None:
+            first, last = byte_range
+            headers["Content-Range"] = f"bytes {first}-{last}/{size}"
+            headers["Content-Length"] = str(last - first + 1)
+            return StreamingResponse(
+                read_range(path, first, last),
+                status_code=206,
+                headers=headers,
+                media_type=media_type,
+            )
+
+    return FileResponse(path, headers=headers, media_type=media_type)
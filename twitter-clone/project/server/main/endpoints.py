@@ -1,16 +1,46 @@
 from typing import Annotated, Any, List
 
-from fastapi import Body, Depends, Header, UploadFile
+from fastapi import Body, Depends, Header, Query
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette.requests import Request
-from starlette.responses import HTMLResponse, RedirectResponse
-from starlette.status import HTTP_200_OK, HTTP_201_CREATED
+from starlette.responses import (
+    HTMLResponse,
+    JSONResponse,
+    PlainTextResponse,
+    RedirectResponse,
+    Response,
+    StreamingResponse,
+)
+from starlette.status import (
+    HTTP_200_OK,
+    HTTP_201_CREATED,
+    HTTP_304_NOT_MODIFIED,
+    HTTP_503_SERVICE_UNAVAILABLE,
+)
 
 from . import schemas
 from .app import media_dir_host, media_dir_local, router, templates
+from .cache import feed_cache, profile_cache
 from .config import Settings, get_settings, logger
-from .database import FollowRelation, Like, Media, Tweet, User, get_session
+from .database import (
+    FollowRelation,
+    Like,
+    Media,
+    MediaBlob,
+    Tweet,
+    User,
+    async_session,
+    get_read_session,
+    get_session,
+    ping,
+)
+from .delivery import etag_matches, media_response, version_headers
 from .error_handler import ObjectNotFoundException
+from .events import event_bus
+from .images import derivative_pool
+from .metrics import engines, pool_status, registry
+from .uploads import UPLOAD_OPENAPI, stream_upload
 
 
 # Endpoints creation
@@ -38,7 +68,7 @@ async def get_current_user_info(
     api_key: Annotated[str, Header()],
     request: Request,
     settings: Annotated[Settings, Depends(get_settings)],
-    _session: AsyncSession = Depends(get_session),
+    _session: AsyncSession = Depends(get_read_session),
 ) -> Any:
     """
     Get current user's profile
@@ -46,9 +76,15 @@ async def get_current_user_info(
 
     logger.info("Extracting my profile..")
     user_api_key = request.headers.get("api-key")
+    user = await User.get_current_user(_session, user_api_key)
+    headers = await version_headers(profile_cache, user.id)
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=HTTP_304_NOT_MODIFIED, headers=headers)
+
     user_by_api = await User.get_user_by_apikey(_session, user_api_key)
     logger.info("Extracting my profile.. Success!")
-    return user_by_api
+    # data from the database is trusted: serialized without model validation
+    return ORJSONResponse(user_by_api, headers=headers)
 
 
 @router.get(
@@ -59,16 +95,68 @@ async def get_current_user_info(
 )
 async def get_user_info_by_id(
     user_id: int,
+    request: Request,
     settings: Annotated[Settings, Depends(get_settings)],
-    _session: AsyncSession = Depends(get_session),
+    _session: AsyncSession = Depends(get_read_session),
 ) -> Any:
     """
     Get a user's profile by user_id
     """
     logger.info("Extracting user profile by ID..")
+    headers = await version_headers(profile_cache, user_id)
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=HTTP_304_NOT_MODIFIED, headers=headers)
+
     user_by_id = await User.get_user_by_id(_session, user_id)
     logger.info("Extracting user profile by ID.. Success")
-    return user_by_id
+    # data from the database is trusted: serialized without model validation
+    return ORJSONResponse(user_by_id, headers=headers)
+
+
+@router.get(
+    "/api/users/{user_id}/followers",
+    response_model=schemas.FollowsResponseModel,
+    responses=schemas.responses,
+    tags=["Users"],
+)
+async def get_user_followers(
+    user_id: int,
+    limit: Annotated[int | None, Query(ge=1)] = None,
+    before: Annotated[int | None, Query(ge=1)] = None,
+    _session: AsyncSession = Depends(get_read_session),
+) -> Any:
+    """
+    Get a page of user's followers (the newest first).
+    Pass "next_cursor" as "before" to get the next page
+    """
+    followers = await User.get_follows_page(
+        _session, user_id, "followers", limit=limit, before=before
+    )
+    # data from the database is trusted: serialized without model validation
+    return ORJSONResponse(followers)
+
+
+@router.get(
+    "/api/users/{user_id}/following",
+    response_model=schemas.FollowsResponseModel,
+    responses=schemas.responses,
+    tags=["Users"],
+)
+async def get_user_following(
+    user_id: int,
+    limit: Annotated[int | None, Query(ge=1)] = None,
+    before: Annotated[int | None, Query(ge=1)] = None,
+    _session: AsyncSession = Depends(get_read_session),
+) -> Any:
+    """
+    Get a page of users the user follows to (the newest first).
+    Pass "next_cursor" as "before" to get the next page
+    """
+    following = await User.get_follows_page(
+        _session, user_id, "following", limit=limit, before=before
+    )
+    # data from the database is trusted: serialized without model validation
+    return ORJSONResponse(following)
 
 
 @router.post(
@@ -111,16 +199,84 @@ async def get_tweets(
     api_key: Annotated[str, Header()],
     request: Request,
     settings: Annotated[Settings, Depends(get_settings)],
-    _session: AsyncSession = Depends(get_session),
+    limit: Annotated[int | None, Query(ge=1)] = None,
+    before: Annotated[int | None, Query(ge=1)] = None,
+    after: Annotated[int | None, Query(ge=0)] = None,
+    _session: AsyncSession = Depends(get_read_session),
 ) -> Any:
     """
-    Get a list of tweets for current user
+    Get a page of tweets for current user (the newest first).
+    Pass "next_cursor" as "before" to get older tweets or the newest tweet id
+    as "after" to get only tweets newer than that
     """
     logger.info("Extracting tweets..")
     user_api_key = request.headers["api-key"]
-    tweets_all = await Tweet.get_tweets(_session, user_api_key)
+    user = await User.get_current_user(_session, user_api_key)
+    headers = await version_headers(feed_cache, user.id, limit, before, after)
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=HTTP_304_NOT_MODIFIED, headers=headers)
+
+    tweets_all = await Tweet.get_tweets(
+        _session, user_api_key, limit=limit, before=before, after=after
+    )
     logger.info("Extracting tweets.. Success!")
-    return tweets_all
+    # data from the database is trusted: serialized without model validation
+    return ORJSONResponse(tweets_all, headers=headers)
+
+
+@router.get(
+    "/api/events",
+    response_class=StreamingResponse,
+    responses=schemas.responses,
+    tags=["Events"],
+)
+async def get_events(
+    settings: Annotated[Settings, Depends(get_settings)],
+    api_key: Annotated[str | None, Header()] = None,
+    api_key_query: Annotated[str | None, Query(alias="api_key")] = None,
+) -> Any:
+    """
+    Stream of feed events of current user (server-sent events) instead of polling:
+    "tweet", "tweet_deleted", "like" (new like counters), "follow", "unfollow" and
+    "reset" (events were dropped: refetch the feed).
+    Browsers pass api key as "?api_key=" (EventSource sends no custom headers)
+    """
+    # the session is closed before streaming: connections are not held by clients
+    async with async_session() as _session:
+        user = await User.get_current_user(_session, api_key or api_key_query)
+    logger.info("Streaming events..")
+    return StreamingResponse(
+        event_bus.stream(user.id, settings.events_keepalive),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get(
+    "/api/search/tweets",
+    response_model=schemas.SearchResponseModel,
+    responses=schemas.responses,
+    tags=["Tweets"],
+)
+async def search_tweets(
+    api_key: Annotated[str, Header()],
+    request: Request,
+    q: Annotated[str, Query(min_length=1, max_length=200)],
+    limit: Annotated[int | None, Query(ge=1)] = None,
+    cursor: Annotated[str | None, Query(pattern=r"^\d+(\.\d+)?(e-?\d+)?:\d+$")] = None,
+    _session: AsyncSession = Depends(get_read_session),
+) -> Any:
+    """
+    Search tweets by words, "quoted phrases", "or" and -excluded words, the most
+    relevant first. Pass "next_cursor" as "cursor" to get the next page
+    """
+    logger.info("Searching tweets..")
+    user_api_key = request.headers["api-key"]
+    found = await Tweet.search_tweets(
+        _session, user_api_key, q, limit=limit, cursor=cursor
+    )
+    # data from the database is trusted: serialized without model validation
+    return ORJSONResponse(found)
 
 
 @router.delete("/api/tweets/{tweet_id}", responses=schemas.responses, tags=["Tweets"])
@@ -146,11 +302,11 @@ async def delete_tweet(
     status_code=HTTP_201_CREATED,
     responses=schemas.responses,
     tags=["Tweets"],
+    openapi_extra=UPLOAD_OPENAPI,
 )
 async def upload_media(
     api_key: Annotated[str, Header()],
     request: Request,
-    file: UploadFile,
     settings: Annotated[Settings, Depends(get_settings)],
     _session: AsyncSession = Depends(get_session),
 ) -> dict[str, Any]:
@@ -159,14 +315,39 @@ async def upload_media(
     """
     logger.info("Uploading media..")
     user_api_key = request.headers["api-key"]
-    new_media = Media()
-    await new_media.check_file(_session, file)
-    file_id = await new_media.process_file(
-        user_api_key, _session, media_dir_host, media_dir_local, file
+    # the body is streamed to disk: rejected before it is read when too large
+    upload = await stream_upload(
+        request,
+        media_dir_local / "tmp",
+        settings.media_max_size,
+        settings.upload_chunk_size,
+    )
+    file_id = await Media.process_file(
+        user_api_key, _session, media_dir_host, media_dir_local, upload
     )
+    # thumbnail and display size are generated in background
+    derivative_pool.schedule(upload.sha256)
     return {"result": True, "media_id": file_id}
 
 
+@router.get(
+    f"{media_dir_host}/{{file_name:path}}",
+    response_class=Response,
+    responses=schemas.responses,
+    tags=["Media"],
+)
+async def get_media(
+    file_name: str,
+    request: Request,
+    _session: AsyncSession = Depends(get_session),
+) -> Response:
+    """
+    Get a media file: cacheable forever, validated by ETag, supports Range
+    """
+    identity = await MediaBlob.get_identity(_session, file_name)
+    return media_response(request, file_name, identity)
+
+
 @router.post(
     "/api/tweets/{tweet_id}/likes",
     response_model=None,
@@ -258,3 +439,169 @@ async def delete_follow(
     follow_delete = await FollowRelation.delete_follow(_session, user_api_key, user_id)
     logger.info("Deleting follow.. Success!")
     return {"result": follow_delete}
+
+
+# batch ids: in body to act on, in query to get
+BatchIds = Annotated[
+    List[int],
+    Body(embed=True, min_length=1, max_length=get_settings().batch_size_max),
+]
+BatchQueryIds = Annotated[
+    List[int],
+    Query(min_length=1, max_length=get_settings().batch_size_max),
+]
+
+
+@router.post(
+    "/api/batch/likes",
+    response_model=schemas.BatchResponseModel,
+    responses=schemas.responses,
+    tags=["Batch"],
+)
+async def create_likes(
+    api_key: Annotated[str, Header()],
+    ids: BatchIds,
+    request: Request,
+    _session: AsyncSession = Depends(get_session),
+) -> dict[str, Any]:
+    """
+    Like many tweets by ids in one transaction, result per tweet
+    """
+    logger.info("Create likes for %s tweets..", len(ids))
+    user_api_key = request.headers["api-key"]
+    return await Like.create_likes(_session, user_api_key, ids)
+
+
+@router.delete(
+    "/api/batch/likes",
+    response_model=schemas.BatchResponseModel,
+    responses=schemas.responses,
+    tags=["Batch"],
+)
+async def delete_likes(
+    api_key: Annotated[str, Header()],
+    ids: BatchIds,
+    request: Request,
+    _session: AsyncSession = Depends(get_session),
+) -> dict[str, Any]:
+    """
+    Delete likes of many tweets by ids in one transaction, result per tweet
+    """
+    logger.info("Deleting likes for %s tweets..", len(ids))
+    user_api_key = request.headers["api-key"]
+    return await Like.delete_likes(_session, user_api_key, ids)
+
+
+@router.post(
+    "/api/batch/follows",
+    response_model=schemas.BatchResponseModel,
+    responses=schemas.responses,
+    tags=["Batch"],
+)
+async def create_follows(
+    api_key: Annotated[str, Header()],
+    ids: BatchIds,
+    request: Request,
+    _session: AsyncSession = Depends(get_session),
+) -> dict[str, Any]:
+    """
+    Follow many users by ids in one transaction, result per user
+    """
+    logger.info("Following %s users..", len(ids))
+    user_api_key = request.headers["api-key"]
+    return await FollowRelation.create_follows(_session, user_api_key, ids)
+
+
+@router.delete(
+    "/api/batch/follows",
+    response_model=schemas.BatchResponseModel,
+    responses=schemas.responses,
+    tags=["Batch"],
+)
+async def delete_follows(
+    api_key: Annotated[str, Header()],
+    ids: BatchIds,
+    request: Request,
+    _session: AsyncSession = Depends(get_session),
+) -> dict[str, Any]:
+    """
+    Delete follows to many users by ids in one transaction, result per user
+    """
+    logger.info("Deleting follows to %s users..", len(ids))
+    user_api_key = request.headers["api-key"]
+    return await FollowRelation.delete_follows(_session, user_api_key, ids)
+
+
+@router.get(
+    "/api/batch/users",
+    response_model=schemas.UsersResponseModel,
+    responses=schemas.responses,
+    tags=["Batch"],
+)
+async def get_users(
+    ids: BatchQueryIds,
+    _session: AsyncSession = Depends(get_read_session),
+) -> Any:
+    """
+    Get profiles of many users by ids (?ids=1&ids=2)
+    """
+    users = await User.get_users_by_ids(_session, ids)
+    # data from the database is trusted: serialized without model validation
+    return ORJSONResponse(users)
+
+
+@router.get(
+    "/api/batch/tweets",
+    response_model=schemas.TweetsResponseModel,
+    responses=schemas.responses,
+    tags=["Batch"],
+)
+async def get_tweets_by_ids(
+    api_key: Annotated[str, Header()],
+    ids: BatchQueryIds,
+    request: Request,
+    _session: AsyncSession = Depends(get_read_session),
+) -> Any:
+    """
+    Get many tweets by ids (?ids=1&ids=2)
+    """
+    user_api_key = request.headers["api-key"]
+    tweets = await Tweet.get_tweets_by_ids(_session, user_api_key, ids)
+    # data from the database is trusted: serialized without model validation
+    return ORJSONResponse(tweets)
+
+
+@router.get("/metrics", response_class=PlainTextResponse, tags=["Health"])
+async def get_metrics() -> PlainTextResponse:
+    """
+    Metrics in Prometheus text format
+    """
+    return PlainTextResponse(
+        registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@router.get("/health/live", tags=["Health"])
+async def get_liveness() -> dict[str, Any]:
+    """
+    Liveness: the process serves requests
+    """
+    return {"status": "ok"}
+
+
+@router.get("/health/ready", tags=["Health"])
+async def get_readiness(_session: AsyncSession = Depends(get_session)) -> JSONResponse:
+    """
+    Readiness: the database answers and requests do not wait for connections
+    """
+    database_ok = await ping(_session)
+    pools = {i_name: pool_status(i_engine) for i_name, i_engine in engines.items()}
+    ready = database_ok and all(i_pool["waiting"] == 0 for i_pool in pools.values())
+    return JSONResponse(
+        status_code=HTTP_200_OK if ready else HTTP_503_SERVICE_UNAVAILABLE,
+        content={
+            "status": "ok" if ready else "unavailable",
+            "database": database_ok,
+            "pools": pools,
+        },
+    )
@@ -0,0 +1,235 @@
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from typing import Any, AsyncGenerator, Callable, Dict, Iterable, List, Set
+
+import orjson
+
+from .config import Settings, get_settings
+
+try:
+    from redis import asyncio as redis_asyncio  # type: ignore
+    from redis.exceptions import RedisError  # type: ignore
+except ImportError:  # redis is optional: only needed to share events between workers
+    redis_asyncio = None
+    RedisError = OSError
+
+# Initialize logging
+logger_events = logging.getLogger("logger_events")
+
+# setting environment
+settings: Settings = get_settings()
+
+# server-sent events frames without data: reconnection delay of clients (ms),
+# keep-alive comment, reset after events of a slow client were dropped
+RETRY_FRAME = b"retry: 3000\n\n"
+KEEPALIVE_FRAME = b": keepalive\n\n"
+RESET_FRAME = b"event: reset\ndata: {}\n\n"
+
+Deliver = Callable[[List[int], bytes], None]
+
+
+def event_frame(event_type: str, data: Dict[str, Any]) -> bytes:
+    """
+    Server-sent event frame: serialized once for all subscribers
+    """
+    return b"event: %s\ndata: %s\n\n" % (event_type.encode(), orjson.dumps(data))
+
+
+class Subscription:
+    """
+    Event frames queued for one connection of a viewer. When the client does not
+    keep up, queued frames are dropped and replaced by a reset (refetch the feed)
+    """
+
+    def __init__(self, viewer_id: int, maxsize: int) -> None:
+        self.viewer_id = viewer_id
+        self.queue: asyncio.Queue[bytes] = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+    def put(self, frame: bytes) -> None:
+        try:
+            self.queue.put_nowait(frame)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+                self.dropped += 1
+            self.queue.put_nowait(RESET_FRAME)
+
+
+class EventBusBackend(ABC):
+    """
+    Transport of event frames to the subscribers of the process
+    """
+
+    @abstractmethod
+    def start(self, deliver: Deliver) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def publish(self, viewer_ids: List[int], frame: bytes) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    async def close(self) -> None:
+        raise NotImplementedError
+
+
+class InProcessEventBusBackend(EventBusBackend):
+    """
+    Events of the process only: delivered right away
+    """
+
+    def __init__(self) -> None:
+        self._deliver: Deliver | None = None
+
+    def start(self, deliver: Deliver) -> None:
+        self._deliver = deliver
+
+    async def publish(self, viewer_ids: List[int], frame: bytes) -> None:
+        if self._deliver is not None:
+            self._deliver(viewer_ids, frame)
+
+    async def close(self) -> None:
+        self._deliver = None
+
+
+class RedisEventBusBackend(EventBusBackend):
+    """
+    Events shared by all workers through a redis channel: each process listens to
+    the channel and delivers to its own subscribers
+    """
+
+    channel = "events"
+
+    def __init__(self, url: str) -> None:
+        if redis_asyncio is None:
+            raise RuntimeError("Package 'redis' is required for events at %s" % url)
+        self._redis = redis_asyncio.from_url(url)
+        self._listener: asyncio.Task | None = None
+
+    def start(self, deliver: Deliver) -> None:
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen(deliver))
+
+    async def _listen(self, deliver: Deliver) -> None:
+        while True:
+            try:
+                async with self._redis.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    async for i_message in pubsub.listen():
+                        if i_message["type"] != "message":
+                            continue
+                        viewer_ids, _, frame = i_message["data"].partition(b"\n")
+                        deliver(orjson.loads(viewer_ids), frame)
+            except (RedisError, OSError) as exc:
+                logger_events.error("!!! Events channel is not available: %s", exc)
+                await asyncio.sleep(1.0)
+
+    async def publish(self, viewer_ids: List[int], frame: bytes) -> None:
+        await self._redis.publish(
+            self.channel, orjson.dumps(viewer_ids) + b"\n" + frame
+        )
+
+    async def close(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+
+
+class EventBus:
+    """
+    Pub/sub of feed deltas for push channels: write paths publish compact events
+    (new and deleted tweets, like counters, follows) to the viewers concerned,
+    connected clients get them as server-sent events instead of polling the feed.
+    Backend errors are logged: events are best effort, clients refetch on reset
+    """
+
+    def __init__(self, backend: EventBusBackend, queue_size: int) -> None:
+        self.backend = backend
+        self.queue_size = queue_size
+        self._subscriptions: Dict[int, Set[Subscription]] = dict()
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+
+    def subscribe(self, viewer_id: int) -> Subscription:
+        self.backend.start(self.deliver)
+        subscription = Subscription(viewer_id, self.queue_size)
+        self._subscriptions.setdefault(viewer_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscriptions = self._subscriptions.get(subscription.viewer_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.viewer_id]
+        self.dropped += subscription.dropped
+
+    def deliver(self, viewer_ids: List[int], frame: bytes) -> None:
+        """
+        Queue the frame for connections of the viewers in this process
+        """
+        for i_viewer_id in viewer_ids:
+            for i_subscription in self._subscriptions.get(i_viewer_id, ()):
+                i_subscription.put(frame)
+                self.delivered += 1
+
+    async def publish(
+        self, viewer_ids: Iterable[int], event_type: str, data: Dict[str, Any]
+    ) -> None:
+        viewer_ids = list(set(viewer_ids))
+        if not viewer_ids:
+            return
+        try:
+            await self.backend.publish(viewer_ids, event_frame(event_type, data))
+            self.published += 1
+        except (RedisError, OSError) as exc:
+            logger_events.error("!!! Event is not published: %s", exc)
+
+    async def stream(
+        self, viewer_id: int, keepalive: float
+    ) -> AsyncGenerator[bytes, None]:
+        """
+        Server-sent events of the viewer until the client disconnects, with a
+        keep-alive comment when there are no events
+        """
+        subscription = self.subscribe(viewer_id)
+        try:
+            yield RETRY_FRAME
+            while True:
+                try:
+                    yield await asyncio.wait_for(subscription.queue.get(), keepalive)
+                except asyncio.TimeoutError:
+                    yield KEEPALIVE_FRAME
+        finally:
+            self.unsubscribe(subscription)
+
+    async def close(self) -> None:
+        await self.backend.close()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "subscribers": sum(len(i_subs) for i_subs in self._subscriptions.values()),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped
+            + sum(
+                i_sub.dropped
+                for i_subs in self._subscriptions.values()
+                for i_sub in i_subs
+            ),
+        }
+
+
+def create_event_bus(_settings: Settings) -> EventBus:
+    if _settings.events_url:
+        logger_events.info("!!! Events channel at %s", _settings.events_url)
+        return EventBus(
+            RedisEventBusBackend(_settings.events_url), _settings.events_queue_size
+        )
+    return EventBus(InProcessEventBusBackend(), _settings.events_queue_size)
+
+
+event_bus = create_event_bus(settings)
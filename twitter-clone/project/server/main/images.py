@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import os
+import pathlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict
+
+from PIL import Image, ImageOps
+from sqlalchemy.exc import SQLAlchemyError
+
+from .config import Settings, get_settings
+from .database import MediaBlob, async_session
+from .error_handler import AppException
+
+# Initialize logging
+logger_media = logging.getLogger("logger_media")
+
+# setting environment
+settings: Settings = get_settings()
+
+
+def derivative_name(file_name: str, size_name: str, image_format: str) -> str:
+    """
+    Derivative is stored next to its original: ab/cd/<sha256>_<size>.<format>
+    """
+    original = pathlib.Path(file_name)
+    return str(original.with_name(f"{original.stem}_{size_name}.{image_format}"))
+
+
+def render_derivatives(
+    media_dir: str, file_name: str, sizes: Dict[str, int], image_format: str
+) -> Dict[str, str]:
+    """
+    Re-encode the original image to every size (the longest side in pixels).
+    Runs in a worker process: CPU bound and blocking
+    """
+    derivatives = dict()
+    with Image.open(pathlib.Path(media_dir) / file_name) as original:
+        # apply orientation from EXIF, the metadata itself is not copied
+        image = ImageOps.exif_transpose(original) or original
+        image = image.convert("RGBA" if image.has_transparency_data else "RGB")
+
+        for i_size_name, i_size in sizes.items():
+            i_image = image.copy()
+            i_image.thumbnail((i_size, i_size), Image.Resampling.LANCZOS)
+
+            i_file_name = derivative_name(file_name, i_size_name, image_format)
+            i_path = pathlib.Path(media_dir) / i_file_name
+            i_path_tmp = i_path.with_name(i_path.name + ".tmp")
+            i_image.save(i_path_tmp, format=image_format.upper(), quality=80)
+            os.replace(i_path_tmp, i_path)
+            derivatives[i_size_name] = i_file_name
+    return derivatives
+
+
+class DerivativePool:
+    """
+    Generation of image derivatives in a bounded pool of worker processes,
+    off the event loop. Jobs exceeding the number of workers wait as coroutines
+    """
+
+    def __init__(self, workers: int) -> None:
+        self.workers = workers
+        self._executor: ProcessPoolExecutor | None = None
+        self._slots: asyncio.Semaphore | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def schedule(self, sha256: str) -> None:
+        """
+        Generate derivatives of the blob in background if they are missing
+        """
+        task = asyncio.create_task(self._generate(sha256))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _generate(self, sha256: str) -> None:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.workers)
+
+        async with self._slots:
+            try:
+                async with async_session() as _session:
+                    blob = await _session.get(MediaBlob, sha256)
+                    if blob is None or blob.derivatives:
+                        return
+                    file_name = str(blob.file_name)
+            except SQLAlchemyError as exc:
+                logger_media.error("!!! Blob %s is not available: %s", sha256, exc)
+                return
+
+            loop = asyncio.get_running_loop()
+            try:
+                derivatives = await loop.run_in_executor(
+                    self.executor,
+                    render_derivatives,
+                    str(settings.media_dir_local),
+                    file_name,
+                    settings.media_derivative_sizes,
+                    settings.media_derivative_format,
+                )
+            except (
+                OSError,
+                ValueError,
+                RuntimeError,
+                Image.DecompressionBombError,
+            ) as exc:
+                logger_media.error("!!! Derivatives of %s failed: %s", file_name, exc)
+                return
+
+        try:
+            async with async_session() as _session:
+                await MediaBlob.set_derivatives(_session, sha256, derivatives)
+        except (AppException, SQLAlchemyError) as exc:
+            logger_media.error("!!! Derivatives of %s not saved: %s", file_name, exc)
+            return
+        logger_media.info("!!! Derivatives of %s: %s", file_name, derivatives)
+
+    async def join(self) -> None:
+        """
+        Wait for scheduled jobs, their errors are logged and not raised
+        """
+        results = await asyncio.gather(*self._tasks, return_exceptions=True)
+        for i_result in results:
+            if isinstance(i_result, BaseException):
+                logger_media.error("!!! Derivatives job failed: %s", i_result)
+
+    async def close(self) -> None:
+        await self.join()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+
+derivative_pool = DerivativePool(settings.media_derivative_workers)
@@ -0,0 +1,67 @@
+"""
+Maintenance jobs for the database of a running service, each job in a
+transaction of its own. Prints a JSON report.
+
+    python -m project.server.main.maintenance repair-counters
+    (in the server container: python -m main.maintenance repair-counters)
+"""
+
+import argparse
+import asyncio
+import logging
+from typing import Dict, List
+
+import orjson
+from sqlalchemy.exc import DBAPIError
+
+from .database import async_session, engine, repair_counters
+
+# Initialize logging
+logger_maintenance = logging.getLogger("logger_maintenance")
+
+# serialization failure: the snapshot conflicts with a concurrent write
+SERIALIZATION_FAILURE = "40001"
+
+
+async def run_repair_counters(attempts: int = 3) -> Dict[str, int]:
+    """
+    Repair counters in a repeatable read transaction: counts and updated rows
+    come from one snapshot, conflicts with concurrent writes are retried
+    """
+    for i_attempt in range(1, attempts + 1):
+        try:
+            async with async_session() as _session, _session.begin():
+                await _session.connection(
+                    execution_options={"isolation_level": "REPEATABLE READ"}
+                )
+                return await repair_counters(_session)
+        except DBAPIError as exc:
+            pgcode = getattr(exc.orig, "pgcode", None)
+            if pgcode != SERIALIZATION_FAILURE or i_attempt == attempts:
+                raise
+            logger_maintenance.warning(
+                "!!! Counters repair conflicts with writes, attempt %s", i_attempt
+            )
+    raise RuntimeError("Counters are not repaired")
+
+
+JOBS = {"repair-counters": run_repair_counters}
+
+
+def parse_args(args: List[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=str(__doc__).split("\n\n")[0])
+    parser.add_argument("job", choices=sorted(JOBS))
+    return parser.parse_args(args)
+
+
+async def main() -> None:
+    args = parse_args()
+    try:
+        report = await JOBS[args.job]()
+    finally:
+        await engine.dispose()
+    print(orjson.dumps(report).decode())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
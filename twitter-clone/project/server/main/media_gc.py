@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import os
+import pathlib
+import time
+from typing import (
+    AsyncContextManager,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Set,
+    Tuple,
+)
+
+from .config import Settings, get_settings
+from .error_handler import AppException
+
+# Initialize logging
+logger_gc = logging.getLogger("logger_gc")
+
+# setting environment
+settings: Settings = get_settings()
+
+# paths to remove -> context holding them against reuse which yields paths to keep
+RemovalGuard = Callable[[List[str]], AsyncContextManager[Set[str]]]
+
+
+def remove_files(paths: Iterable[str]) -> Tuple[int, int]:
+    """
+    Remove files (blocking), return number and total size of removed files
+    """
+    removed, reclaimed = 0, 0
+    for i_path in paths:
+        try:
+            i_size = os.stat(i_path).st_size
+            os.remove(i_path)
+        except FileNotFoundError:
+            logger_gc.warning("!!! File not found when deleting: %s", i_path)
+        except OSError as exc:
+            logger_gc.error(f"!!! Error when deleting a file: {exc.strerror}")
+        else:
+            removed += 1
+            reclaimed += i_size
+    return removed, reclaimed
+
+
+def scan_files(directory: pathlib.Path, older_than: float) -> Dict[str, int]:
+    """
+    Files of directory (blocking): relative path -> size, for files modified
+    before older_than (timestamp)
+    """
+    files = dict()
+    for i_root, _, i_file_names in os.walk(directory):
+        for i_file_name in i_file_names:
+            i_path = pathlib.Path(i_root, i_file_name)
+            try:
+                i_stat = i_path.stat()
+            except FileNotFoundError:
+                continue
+            if i_stat.st_mtime < older_than:
+                files[str(i_path.relative_to(directory))] = i_stat.st_size
+    return files
+
+
+class MediaCollector:
+    """
+    Removal of media files off the event loop. Request paths only queue files
+    which are removed in batches by a worker task; a periodic sweep removes
+    media which is not referenced anymore. Files referenced again meanwhile
+    (same content uploaded anew) are kept by the guard. Counts of reclaimed files
+    and bytes are kept
+    """
+
+    def __init__(self, batch_size: int) -> None:
+        self.batch_size = batch_size
+        self.guard: RemovalGuard | None = None
+        self.files_removed = 0
+        self.bytes_reclaimed = 0
+        self.media_removed = 0
+        self._queue: asyncio.Queue[str] | None = None
+        self._worker: asyncio.Task | None = None
+        self._sweeper: asyncio.Task | None = None
+
+    @property
+    def queue(self) -> asyncio.Queue[str]:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        return self._queue
+
+    def discard(self, paths: Iterable[str]) -> None:
+        """
+        Queue files for removal without waiting for it
+        """
+        for i_path in paths:
+            self.queue.put_nowait(i_path)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._drain())
+
+    async def _drain(self) -> None:
+        while True:
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            try:
+                await self.remove(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def remove(self, paths: Iterable[str]) -> Tuple[int, int]:
+        """
+        Remove files in a worker thread, return number and size of removed files
+        """
+        paths = list(paths)
+        if self.guard is None:
+            removed, reclaimed = await asyncio.to_thread(remove_files, paths)
+        else:
+            async with self.guard(paths) as kept:
+                removed, reclaimed = await asyncio.to_thread(
+                    remove_files, [i_path for i_path in paths if i_path not in kept]
+                )
+        self.files_removed += removed
+        self.bytes_reclaimed += reclaimed
+        return removed, reclaimed
+
+    async def join(self) -> None:
+        """
+        Wait until queued files are removed
+        """
+        await self.queue.join()
+
+    def start(
+        self, sweep: Callable[[], Awaitable[Dict[str, int]]], interval: float
+    ) -> None:
+        """
+        Run sweep every interval seconds in background
+        """
+        self._sweeper = asyncio.create_task(self._sweep_periodically(sweep, interval))
+
+    async def _sweep_periodically(
+        self, sweep: Callable[[], Awaitable[Dict[str, int]]], interval: float
+    ) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            started = time.monotonic()
+            try:
+                report = await sweep()
+            except (AppException, OSError) as exc:
+                logger_gc.error("!!! Media garbage collection failed: %s", exc)
+                continue
+            logger_gc.info(
+                "!!! Media garbage collected in %.1fs: %s",
+                time.monotonic() - started,
+                report,
+            )
+
+    async def stop(self) -> None:
+        """
+        Stop the sweep and remove files queued so far
+        """
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+        if self._worker is not None:
+            if not self._worker.done():
+                await self.join()
+            self._worker.cancel()
+        self._sweeper = self._worker = None
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "media_removed": self.media_removed,
+            "files_removed": self.files_removed,
+            "bytes_reclaimed": self.bytes_reclaimed,
+            "files_queued": 0 if self._queue is None else self._queue.qsize(),
+        }
+
+
+media_collector = MediaCollector(settings.media_gc_batch_size)
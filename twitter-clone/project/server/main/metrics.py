@@ -0,0 +1,476 @@
+import bisect
+import contextvars
+import logging
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .cache import feed_cache, identity_cache, profile_cache
+from .events import event_bus
+from .media_gc import media_collector
+
+# Initialize logging
+logger_metrics = logging.getLogger("logger_metrics")
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+STREAM_BUCKETS = (1.0, 10.0, 60.0, 300.0, 900.0, 1800.0, 3600.0, 14400.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for i_name, i_value in zip(names, values):
+        i_value = i_value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{i_name}="{i_value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric(ABC):
+    """
+    Metric family in Prometheus text exposition format
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for i_name, i_labels, i_value in self.samples():
+            lines.append(f"{i_name}{i_labels} {_format_value(i_value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[LabelValues, float] = dict()
+
+    def inc(self, *labelvalues: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def get(self, *labelvalues: str) -> float:
+        return self._values.get(labelvalues, 0.0)
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        for i_values, i_value in sorted(self._values.items()):
+            yield self.name, _format_labels(self.labelnames, i_values), i_value
+
+
+class Gauge(Metric):
+    """
+    Gauge with values collected by a callback at scrape time:
+    callback returns label values -> value
+    """
+
+    kind = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], Dict[LabelValues, float]],
+        labelnames: Sequence[str] = (),
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        for i_values, i_value in sorted(self.callback().items()):
+            yield self.name, _format_labels(self.labelnames, i_values), i_value
+
+
+@dataclass
+class _HistogramValue:
+    buckets: List[int]
+    count: int = 0
+    sum: float = 0.0
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.bounds = tuple(sorted(buckets))
+        self._values: Dict[LabelValues, _HistogramValue] = dict()
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        with self._lock:
+            histogram = self._values.get(labelvalues)
+            if histogram is None:
+                histogram = _HistogramValue(buckets=[0] * len(self.bounds))
+                self._values[labelvalues] = histogram
+            index = bisect.bisect_left(self.bounds, value)
+            if index < len(self.bounds):
+                histogram.buckets[index] += 1
+            histogram.count += 1
+            histogram.sum += value
+
+    def get(self, *labelvalues: str) -> Tuple[int, float]:
+        """
+        Count and sum of observations
+        """
+        histogram = self._values.get(labelvalues)
+        return (0, 0.0) if histogram is None else (histogram.count, histogram.sum)
+
+    def samples(self) -> Iterable[Tuple[str, str, float]]:
+        for i_values, i_histogram in sorted(self._values.items()):
+            cumulative = 0
+            for i_bound, i_count in zip(self.bounds, i_histogram.buckets):
+                cumulative += i_count
+                yield (
+                    f"{self.name}_bucket",
+                    _format_labels(
+                        self.labelnames + ("le",), i_values + (_format_value(i_bound),)
+                    ),
+                    cumulative,
+                )
+            yield (
+                f"{self.name}_bucket",
+                _format_labels(self.labelnames + ("le",), i_values + ("+Inf",)),
+                i_histogram.count,
+            )
+            labels = _format_labels(self.labelnames, i_values)
+            yield f"{self.name}_count", labels, i_histogram.count
+            yield f"{self.name}_sum", labels, i_histogram.sum
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: Dict[str, Metric] = dict()
+
+    def register(self, metric: Metric) -> Any:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for i_metric in self.metrics.values():
+            try:
+                lines.extend(i_metric.render())
+            except (AttributeError, TypeError, ValueError) as exc:
+                logger_metrics.error("!!! Metric %s failed: %s", i_metric.name, exc)
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.register(
+    Counter(
+        "http_requests_total",
+        "HTTP requests by route and status code",
+        ("method", "route", "status"),
+    )
+)
+http_request_duration = registry.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "HTTP request latency by route",
+        ("method", "route"),
+    )
+)
+http_stream_duration = registry.register(
+    Histogram(
+        "http_stream_duration_seconds",
+        "Duration of streamed responses (server-sent events) by route",
+        ("method", "route"),
+        buckets=STREAM_BUCKETS,
+    )
+)
+db_statements_per_request = registry.register(
+    Histogram(
+        "db_statements_per_request",
+        "SQL statements issued while handling a request",
+        ("method", "route"),
+        buckets=COUNT_BUCKETS,
+    )
+)
+db_duration_per_request = registry.register(
+    Histogram(
+        "db_duration_per_request_seconds",
+        "Time spent in SQL statements while handling a request",
+        ("method", "route"),
+    )
+)
+db_statement_duration = registry.register(
+    Histogram(
+        "db_statement_duration_seconds",
+        "Duration of SQL statements",
+        ("operation",),
+    )
+)
+db_pool_wait = registry.register(
+    Histogram(
+        "db_pool_wait_seconds",
+        "Time waiting for a connection from the pool",
+    )
+)
+
+
+@dataclass
+class RequestStats:
+    """
+    SQL statistics of a single request
+    """
+
+    statements: int = 0
+    duration: float = 0.0
+
+
+request_stats: contextvars.ContextVar[RequestStats | None] = contextvars.ContextVar(
+    "request_stats", default=None
+)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """
+    Queue pool which measures waiting for a connection and counts waiters
+    """
+
+    waiting = 0
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        # start times of current waiters by waiter
+        self._waiters: Dict[object, float] = dict()
+
+    def _do_get(self) -> Any:
+        started = time.perf_counter()
+        waiter = object()
+        self._waiters[waiter] = started
+        self.waiting += 1
+        try:
+            return super()._do_get()
+        finally:
+            self.waiting -= 1
+            del self._waiters[waiter]
+            db_pool_wait.observe(time.perf_counter() - started)
+
+    def oldest_wait(self) -> float:
+        """
+        Seconds the longest current waiter has been waiting for a connection
+        """
+        if not self._waiters:
+            return 0.0
+        return time.perf_counter() - min(self._waiters.values())
+
+
+def pool_status(async_engine: AsyncEngine) -> Dict[str, int]:
+    """
+    Size and usage of the connection pool of engine
+    """
+    pool = async_engine.pool
+    if not isinstance(pool, AsyncAdaptedQueuePool):
+        return {"size": 0, "checked_out": 0, "overflow": 0, "waiting": 0}
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0),
+        "waiting": getattr(pool, "waiting", 0),
+    }
+
+
+# engines by name, instrumented with instrument_engine
+engines: Dict[str, AsyncEngine] = dict()
+
+
+def pool_wait(async_engine: AsyncEngine) -> float:
+    """
+    Current wait for a connection from the pool of engine, seconds
+    """
+    pool = async_engine.pool
+    return pool.oldest_wait() if isinstance(pool, InstrumentedPool) else 0.0
+
+
+def _pool_gauge(key: str) -> Callable[[], Dict[LabelValues, float]]:
+    return lambda: {
+        (i_name,): pool_status(i_engine)[key] for i_name, i_engine in engines.items()
+    }
+
+
+for _key, _documentation in (
+    ("size", "Connections kept by the pool"),
+    ("checked_out", "Connections in use"),
+    ("overflow", "Connections opened over the pool size"),
+    ("waiting", "Requests waiting for a connection"),
+):
+    registry.register(
+        Gauge(f"db_pool_{_key}", _documentation, _pool_gauge(_key), ("engine",))
+    )
+
+
+def instrument_engine(async_engine: AsyncEngine, name: str = "primary") -> None:
+    """
+    Count and time statements of engine, per request and overall,
+    expose usage of its connection pool
+    """
+    engines[name] = async_engine
+
+    @event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(async_engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        duration = time.perf_counter() - conn.info["query_started"].pop()
+        db_statement_duration.observe(duration, statement.split(None, 1)[0].upper())
+        stats = request_stats.get()
+        if stats is not None:
+            stats.statements += 1
+            stats.duration += duration
+
+
+def register_cache_metrics(caches: Dict[str, Callable[[], Dict[str, int]]]) -> None:
+    """
+    Expose hits, misses, evictions, size and hit ratio of caches by name
+    """
+
+    def collect(key: str) -> Callable[[], Dict[LabelValues, float]]:
+        def values() -> Dict[LabelValues, float]:
+            result: Dict[LabelValues, float] = dict()
+            for i_cache, i_stats in caches.items():
+                stats = i_stats()
+                if key == "hit_ratio":
+                    lookups = stats["hits"] + stats["misses"]
+                    result[(i_cache,)] = stats["hits"] / lookups if lookups else 0.0
+                else:
+                    result[(i_cache,)] = stats[key]
+            return result
+
+        return values
+
+    for i_key in ("hits", "misses", "evictions", "size", "hit_ratio"):
+        registry.register(
+            Gauge(
+                f"cache_{i_key}",
+                f"Cache {i_key.replace('_', ' ')}",
+                collect(i_key),
+                ("cache",),
+            )
+        )
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: latency, status and SQL statements per route.
+    Event streams last as long as clients stay connected: their durations are
+    kept apart from the latency of requests
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        status_code = 500
+        streaming = False
+        started = time.perf_counter()
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code, streaming
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                streaming = any(
+                    i_name == b"content-type"
+                    and i_value.startswith(b"text/event-stream")
+                    for i_name, i_value in message.get("headers", ())
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration = time.perf_counter() - started
+            request_stats.reset(token)
+            # route template keeps the number of label values bounded
+            route = getattr(scope.get("route"), "path", "unmatched")
+            method = scope["method"]
+            http_requests.inc(method, route, str(status_code))
+            if streaming:
+                http_stream_duration.observe(duration, method, route)
+            else:
+                http_request_duration.observe(duration, method, route)
+            db_statements_per_request.observe(stats.statements, method, route)
+            db_duration_per_request.observe(stats.duration, method, route)
+
+
+register_cache_metrics(
+    {
+        "feed": feed_cache.stats,
+        "profile": profile_cache.stats,
+        "identity_users": identity_cache.users_by_api_key.stats,
+        "identity_names": identity_cache.names_by_id.stats,
+    }
+)
+
+
+def _media_gc_gauge(key: str) -> Callable[[], Dict[LabelValues, float]]:
+    return lambda: {(): media_collector.stats()[key]}
+
+
+for _key in ("media_removed", "files_removed", "bytes_reclaimed", "files_queued"):
+    registry.register(
+        Gauge(
+            f"media_gc_{_key}",
+            f"Media garbage collection: {_key.replace('_', ' ')}",
+            _media_gc_gauge(_key),
+        )
+    )
+
+
+def _events_gauge(key: str) -> Callable[[], Dict[LabelValues, float]]:
+    return lambda: {(): event_bus.stats()[key]}
+
+
+for _key in ("subscribers", "published", "delivered", "dropped"):
+    registry.register(
+        Gauge(
+            f"events_{_key}",
+            f"Push events: {_key}",
+            _events_gauge(_key),
+        )
+    )
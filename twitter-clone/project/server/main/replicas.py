@@ -0,0 +1,142 @@
+import itertools
+import logging
+import math
+import time
+from typing import Dict, Hashable, Iterable, List
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+
+from .cache import LRUCache
+from .config import Settings, get_settings
+from .metrics import Counter, Gauge, LabelValues, registry
+
+# Initialize logging
+logger_replicas = logging.getLogger("logger_replicas")
+
+# setting environment
+settings: Settings = get_settings()
+
+# replication lag of a replica in seconds: 0 when all received changes are
+# replayed (or the database is not a replica), null before the first replay
+REPLICA_LAG_SQL = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() "
+    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+database_reads = registry.register(
+    Counter(
+        "database_reads_total",
+        "Sessions of read-only endpoints by target (primary or replica)",
+        ("target",),
+    )
+)
+
+
+class Replica:
+    """
+    Read replica: sessions of its engine and the replication lag of the last check
+    """
+
+    def __init__(self, name: str, engine: AsyncEngine) -> None:
+        self.name = name
+        self.engine = engine
+        self.session_maker = async_sessionmaker(bind=engine, expire_on_commit=False)
+        self.lag = 0.0
+        self.checked = -math.inf
+
+    async def check_lag(self) -> float:
+        """
+        Replication lag in seconds, infinite if the replica is not available
+        """
+        try:
+            async with self.engine.connect() as conn:
+                lag = (await conn.execute(REPLICA_LAG_SQL)).scalar()
+        except (SQLAlchemyError, OSError) as exc:
+            logger_replicas.error("!!! Replica %s is not available: %s", self.name, exc)
+            lag = None
+        self.lag = math.inf if lag is None else float(lag)
+        self.checked = time.monotonic()
+        return self.lag
+
+
+class ReadRouter:
+    """
+    Routing of read-only sessions between the primary and replicas: replicas in
+    turn while their lag is below lag max (checked at most once per interval),
+    the primary for sticky keys (api keys of users who wrote, ids of users whose
+    feed or profile changed) during the sticky window, so users read their own
+    writes. Stickiness is per process
+    """
+
+    def __init__(
+        self,
+        replicas: List[Replica],
+        lag_max: float,
+        lag_interval: float,
+        sticky_seconds: float,
+        sticky_max: int,
+    ) -> None:
+        self.replicas = replicas
+        self.lag_max = lag_max
+        self.lag_interval = lag_interval
+        self._turn = itertools.cycle(replicas)
+        self._sticky: LRUCache[Hashable, bool] = LRUCache(sticky_max, sticky_seconds)
+
+    def stick(self, keys: Iterable[Hashable]) -> None:
+        for i_key in keys:
+            self._sticky.set(i_key, True)
+
+    def is_sticky(self, keys: Iterable[Hashable]) -> bool:
+        return any(i_key in self._sticky for i_key in keys)
+
+    async def choose(self) -> Replica | None:
+        """
+        The next replica within lag max, None to read from the primary
+        """
+        for _ in range(len(self.replicas)):
+            replica = next(self._turn)
+            lag = replica.lag
+            if time.monotonic() - replica.checked >= self.lag_interval:
+                lag = await replica.check_lag()
+            if lag <= self.lag_max:
+                return replica
+        return None
+
+    def stats(self) -> Dict[LabelValues, float]:
+        return {(i_replica.name,): i_replica.lag for i_replica in self.replicas}
+
+
+# routers of the process: lags of their replicas are exposed in metrics
+read_routers: List[ReadRouter] = []
+
+
+def create_read_router(_settings: Settings, replicas: List[Replica]) -> ReadRouter:
+    router = ReadRouter(
+        replicas,
+        _settings.database_replica_lag_max,
+        _settings.database_replica_lag_interval,
+        _settings.database_sticky_seconds,
+        _settings.database_sticky_max,
+    )
+    read_routers.append(router)
+    return router
+
+
+def _replica_lags() -> Dict[LabelValues, float]:
+    result: Dict[LabelValues, float] = dict()
+    for i_router in read_routers:
+        result.update(i_router.stats())
+    return result
+
+
+registry.register(
+    Gauge(
+        "database_replica_lag_seconds",
+        "Replication lag of replicas at the last check",
+        _replica_lags,
+        ("replica",),
+    )
+)
@@ -1,5 +1,5 @@
 import datetime
-from typing import Any, List, Optional
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel, ConfigDict
 
@@ -43,9 +43,15 @@ class UserExtendBaseModel(BaseModel):
     """ User name """
 
     followers: List[UserBaseModel]
-    """ User followed by other users """
+    """ The latest users following the user (all of them page by page) """
     following: List[UserBaseModel]
-    """ User follows to other users """
+    """ The latest users the user follows to (all of them page by page) """
+    followers_count: int = 0
+    """ Number of users following the user """
+    following_count: int = 0
+    """ Number of users the user follows to """
+    tweets_count: int = 0
+    """ Number of user's tweets """
 
 
 class UserModel(BaseModel):
@@ -88,6 +94,20 @@ class UserResponseModel(BaseModel):
     """ id, name, followers, following only """
 
 
+class FollowsResponseModel(BaseModel):
+    """
+    Followers or followings (page) response model
+    """
+
+    model_config = ConfigDict(use_attribute_docstrings=True)
+    result: bool = True
+    """ Result success/fail """
+    users: List[UserBaseModel]
+    """ Users of the page, the newest follows first """
+    next_cursor: Optional[int] = None
+    """ Cursor to continue the list from, None if no more users """
+
+
 class TweetModel(BaseModel):
     """
     Tweet info
@@ -104,6 +124,8 @@ class TweetModel(BaseModel):
     """ Tweet's autor id """
     date_tweet: datetime.date = datetime.datetime.now()
     """ Tweet's creation date"""
+    like_count: int = 0
+    """ Number of likes of the tweet """
 
 
 class TweetBaseModel(BaseModel):
@@ -136,10 +158,14 @@ class TweetBaseWithPathsModel(BaseModel):
     """ Tweet message/content """
     attachments: Optional[List[str]] = None
     """ Tweet attachments/files/images """
+    attachment_sizes: List[Dict[str, str]] = []
+    """ Attachment paths per size: original and re-encoded (e.g. thumb, display) """
     author: UserBaseModel
     """ Tweet's autor id and name """
     likes: List[UserBaseForLikesOnlyModel] = []
     """Users who likes the tweet"""
+    like_count: int = 0
+    """ Number of likes of the tweet """
 
 
 class TweetResponseModel(BaseModel):
@@ -152,6 +178,22 @@ class TweetResponseModel(BaseModel):
     """ Result success/fail """
     tweets: List[TweetBaseWithPathsModel]
     """ Tweet info + authors +  ent paths + likes """
+    next_cursor: Optional[int] = None
+    """ Cursor to continue the feed from, None if no more tweets """
+
+
+class SearchResponseModel(BaseModel):
+    """
+    Search response model
+    """
+
+    model_config = ConfigDict(use_attribute_docstrings=True)
+    result: bool = True
+    """ Result success/fail """
+    tweets: List[TweetBaseWithPathsModel]
+    """ Tweets matching the query, the most relevant first """
+    next_cursor: Optional[str] = None
+    """ Cursor to continue the search from, None if no more tweets """
 
 
 class TweetCreateResponseModel(BaseModel):
@@ -166,6 +208,60 @@ class TweetCreateResponseModel(BaseModel):
     """ Tweet id created """
 
 
+class UsersResponseModel(BaseModel):
+    """
+    Users (batch) response model
+    """
+
+    model_config = ConfigDict(use_attribute_docstrings=True)
+    result: bool = True
+    """ Result success/fail """
+    users: List[UserExtendBaseModel]
+    """ Found users in the order of requested ids """
+    not_found: List[int] = []
+    """ Requested ids of unknown users """
+
+
+class TweetsResponseModel(BaseModel):
+    """
+    Tweets (batch) response model
+    """
+
+    model_config = ConfigDict(use_attribute_docstrings=True)
+    result: bool = True
+    """ Result success/fail """
+    tweets: List[TweetBaseWithPathsModel]
+    """ Found tweets in the order of requested ids """
+    not_found: List[int] = []
+    """ Requested ids of unknown tweets """
+
+
+class BatchItemModel(BaseModel):
+    """
+    Result of a batch item
+    """
+
+    model_config = ConfigDict(use_attribute_docstrings=True)
+    id: int
+    """ Tweet or user id """
+    result: bool
+    """ The item is in the requested state """
+    status: str
+    """ created, exists, deleted, not_found or not_allowed """
+
+
+class BatchResponseModel(BaseModel):
+    """
+    Batch response model
+    """
+
+    model_config = ConfigDict(use_attribute_docstrings=True)
+    result: bool = True
+    """ Result success/fail """
+    items: List[BatchItemModel]
+    """ Results in the order of requested ids """
+
+
 class FollowRelationModel(BaseModel):
     """
     Follow relation model
@@ -0,0 +1,264 @@
+import hashlib
+import logging
+import os
+import pathlib
+import uuid
+from dataclasses import dataclass, field
+
+import aiofiles
+from fastapi import HTTPException
+from multipart.multipart import MultipartParser, parse_options_header  # type: ignore
+from starlette.requests import Request
+
+# Initialize logging
+logger_upload = logging.getLogger("logger_upload")
+
+ALLOWED_CONTENT_TYPES = ("image/jpeg", "image/png", "image/gif")
+
+# leading bytes of allowed files
+MAGIC_NUMBERS = {
+    b"\xff\xd8\xff": "image/jpeg",
+    b"\x89PNG\r\n\x1a\n": "image/png",
+    b"GIF87a": "image/gif",
+    b"GIF89a": "image/gif",
+}
+MAGIC_LENGTH = max(len(i_magic) for i_magic in MAGIC_NUMBERS)
+
+EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png", "image/gif": "gif"}
+
+# room for multipart boundaries and part headers around the file itself
+MULTIPART_OVERHEAD = 16 * 1024
+
+# OpenAPI description of the body which is parsed from the stream by hand
+UPLOAD_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                }
+            }
+        },
+    }
+}
+
+
+def file_too_large() -> HTTPException:
+    return HTTPException(status_code=400, detail="File is too large (over 2Mb)")
+
+
+def invalid_file_type() -> HTTPException:
+    return HTTPException(status_code=400, detail="Invalid file type")
+
+
+def sniff_content_type(head: bytes) -> str | None:
+    """
+    Detect image type by magic bytes
+    """
+    for i_magic, i_content_type in MAGIC_NUMBERS.items():
+        if head.startswith(i_magic):
+            return i_content_type
+    return None
+
+
+@dataclass
+class StreamedUpload:
+    """
+    Uploaded file stored to a temporary file on disk
+    """
+
+    path: pathlib.Path
+    filename: str
+    content_type: str
+    size: int
+    sha256: str
+
+    @property
+    def extension(self) -> str:
+        return EXTENSIONS[self.content_type]
+
+
+@dataclass
+class _FilePart:
+    filename: str = ""
+    content_type: str = ""
+    data: list[bytes] = field(default_factory=list)
+    finished: bool = False
+
+
+class MediaUploadParser:
+    """
+    Multipart parser which writes the file field to disk in fixed-size chunks while
+    the body is received, hashing and sniffing it on the way. The upload is rejected
+    as soon as it is too large or of wrong type, the rest of the body is not read
+    """
+
+    def __init__(
+        self,
+        request: Request,
+        directory: pathlib.Path,
+        max_size: int,
+        chunk_size: int,
+        field_name: str = "file",
+    ) -> None:
+        self.request = request
+        self.directory = directory
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+        self.field_name = field_name
+
+        self._header_name = b""
+        self._header_value = b""
+        self._part_headers: dict[bytes, bytes] = dict()
+        self._in_file_part = False
+        self._file: _FilePart | None = None
+
+        self._buffer = bytearray()
+        self._head = b""
+        self._content_type: str | None = None
+        self._size = 0
+        self._sha256 = hashlib.sha256()
+
+    # parser callbacks
+    def on_part_begin(self) -> None:
+        self._part_headers = dict()
+        self._in_file_part = False
+
+    def on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def on_header_end(self) -> None:
+        self._part_headers[self._header_name.lower()] = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self) -> None:
+        _, options = parse_options_header(
+            self._part_headers.get(b"content-disposition", b"")
+        )
+        if self._file is not None or options.get(b"name") != self.field_name.encode():
+            return
+        content_type, _ = parse_options_header(
+            self._part_headers.get(b"content-type", b"")
+        )
+        if content_type.decode("latin-1") not in ALLOWED_CONTENT_TYPES:
+            raise invalid_file_type()
+        self._in_file_part = True
+        self._file = _FilePart(
+            filename=options.get(b"filename", b"").decode("utf-8", "replace"),
+            content_type=content_type.decode("latin-1"),
+        )
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._in_file_part and self._file is not None:
+            self._file.data.append(data[start:end])
+
+    def on_part_end(self) -> None:
+        if self._in_file_part and self._file is not None:
+            self._file.finished = True
+        self._in_file_part = False
+
+    def _consume(self, data: bytes) -> None:
+        """
+        Account file bytes: size limit, magic bytes and hash
+        """
+        self._size += len(data)
+        if self._size > self.max_size:
+            raise file_too_large()
+
+        if self._content_type is None:
+            self._head += data[: MAGIC_LENGTH - len(self._head)]
+            if len(self._head) >= MAGIC_LENGTH or self._file_finished:
+                self._content_type = sniff_content_type(self._head)
+                if self._content_type is None:
+                    raise invalid_file_type()
+
+        self._sha256.update(data)
+        self._buffer += data
+
+    @property
+    def _file_finished(self) -> bool:
+        return self._file is not None and self._file.finished
+
+    async def parse(self) -> StreamedUpload:
+        content_length = self.request.headers.get("content-length")
+        if (
+            content_length is not None
+            and content_length.isdigit()
+            and int(content_length) > self.max_size + MULTIPART_OVERHEAD
+        ):
+            raise file_too_large()
+
+        _, params = parse_options_header(self.request.headers.get("content-type", ""))
+        if b"boundary" not in params:
+            raise HTTPException(status_code=400, detail="Missing boundary in multipart")
+
+        parser = MultipartParser(
+            params[b"boundary"],
+            {
+                "on_part_begin": self.on_part_begin,
+                "on_header_field": self.on_header_field,
+                "on_header_value": self.on_header_value,
+                "on_header_end": self.on_header_end,
+                "on_headers_finished": self.on_headers_finished,
+                "on_part_data": self.on_part_data,
+                "on_part_end": self.on_part_end,
+            },
+        )
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{uuid.uuid4().hex}.part"
+        received = 0
+        try:
+            async with aiofiles.open(path, "wb") as tmp_file:
+                async for chunk in self.request.stream():
+                    received += len(chunk)
+                    if received > self.max_size + MULTIPART_OVERHEAD:
+                        raise file_too_large()
+
+                    parser.write(chunk)
+                    if self._file is not None:
+                        for i_data in self._file.data:
+                            self._consume(i_data)
+                        self._file.data.clear()
+
+                    # write fixed-size chunks, the tail after the file is complete
+                    while len(self._buffer) >= self.chunk_size:
+                        await tmp_file.write(self._buffer[: self.chunk_size])
+                        del self._buffer[: self.chunk_size]
+                    if self._file_finished and self._buffer:
+                        await tmp_file.write(self._buffer)
+                        self._buffer.clear()
+                parser.finalize()
+
+            if self._file is None or not self._file.finished:
+                raise HTTPException(status_code=422, detail="File is missing")
+            if self._content_type is None:
+                raise invalid_file_type()
+        except BaseException:
+            os.remove(path)
+            raise
+
+        logger_upload.info("!!! Upload received: %s bytes", self._size)
+        return StreamedUpload(
+            path=path,
+            filename=self._file.filename,
+            content_type=self._content_type,
+            size=self._size,
+            sha256=self._sha256.hexdigest(),
+        )
+
+
+async def stream_upload(
+    request: Request, directory: pathlib.Path, max_size: int, chunk_size: int
+) -> StreamedUpload:
+    """
+    Receive a multipart file upload straight to a temporary file in directory
+    """
+    return await MediaUploadParser(request, directory, max_size, chunk_size).parse()
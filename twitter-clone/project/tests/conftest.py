@@ -1,12 +1,14 @@
 import asyncio
 import logging
 import os
-from typing import Generator
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Callable, ContextManager, Generator, Iterator
 
+import pytest
 import pytest_asyncio
 from faker import Faker
 from httpx import ASGITransport, AsyncClient
-from sqlalchemy import NullPool
+from sqlalchemy import NullPool, delete, event, text
 from sqlalchemy.ext.asyncio import (
     AsyncEngine,
     AsyncSession,
@@ -16,8 +18,18 @@ from sqlalchemy.ext.asyncio import (
 
 from project.server.main import database
 from project.server.main.app import create_app
+from project.server.main.cache import feed_cache, identity_cache, profile_cache
 from project.server.main.config import Settings, get_settings
-from project.server.main.database import FollowRelation, Like, Tweet, User
+from project.server.main.database import (
+    FollowRelation,
+    HomeTimeline,
+    Like,
+    Media,
+    Tweet,
+    User,
+    repair_counters,
+)
+from project.server.main.metrics import instrument_engine
 
 logger_test = logging.getLogger(__name__)
 logging.basicConfig(level=logging.DEBUG)
@@ -35,6 +47,7 @@ settings: Settings = get_settings()
 async_engine = create_async_engine(
     url=settings.database_url, echo=True, poolclass=NullPool
 )  # use NullPool to avoid stuck of running several requests
+instrument_engine(async_engine, "test")
 
 
 # drop all database every time when test complete
@@ -88,6 +101,134 @@ async def async_client(async_db_engine: AsyncEngine) -> AsyncClient:
         yield client
 
 
+# clear caches to isolate tests from data changed bypassing write paths
+@pytest_asyncio.fixture(autouse=True)
+async def clear_caches() -> None:
+    await feed_cache.clear()
+    await profile_cache.clear()
+    identity_cache.clear()
+
+
+class QueryCounter:
+    """
+    SQL statements issued to engines while counting
+    """
+
+    def __init__(self) -> None:
+        self.statements: list[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def __call__(self, conn, cursor, statement, parameters, context, many) -> None:
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(*engines: AsyncEngine) -> Iterator[QueryCounter]:
+    """
+    Count statements of the app engine (and other engines given) in the block:
+        with count_queries() as queries:
+            ...
+        assert queries.count <= budget
+    """
+    counter = QueryCounter()
+    sync_engines = [i_engine.sync_engine for i_engine in (database.engine, *engines)]
+    for i_engine in sync_engines:
+        event.listen(i_engine, "after_cursor_execute", counter)
+    try:
+        yield counter
+    finally:
+        for i_engine in sync_engines:
+            event.remove(i_engine, "after_cursor_execute", counter)
+
+
+# query budgets: count statements issued by endpoint calls
+@pytest.fixture
+def query_counter() -> Callable[..., ContextManager[QueryCounter]]:
+    return count_queries
+
+
+# datasets of query budgets: an author with tweets (media, likes) and followers
+# who see the tweets in their feeds, sizes differ so that statements growing
+# with rows are caught. Rows are removed and id sequences restored afterwards
+@pytest_asyncio.fixture
+async def budget_datasets(
+    async_db: AsyncSession, async_db_dummy_fill: None
+) -> AsyncIterator[dict[str, dict[str, Any]]]:
+    datasets = dict()
+    for i_name, i_size in (("small", 2), ("large", 20)):
+        users = [
+            User(api_key=f"budget-{i_name}-{i_number}", name=f"Budget {i_number}")
+            for i_number in range(i_size + 1)
+        ]
+        async_db.add_all(users)
+        await async_db.flush()
+        author, followers = users[0], users[1:]
+        tweets = [
+            Tweet(content=f"Budget tweet {i_number}", attachments=[], author=author.id)
+            for i_number in range(i_size)
+        ]
+        async_db.add_all(tweets)
+        await async_db.flush()
+        media = [
+            Media(
+                tweet_id=i_tweet.id,
+                file_name=f"budget-{i_tweet.id}.png",
+                host_path=f"/media/budget-{i_tweet.id}.png",
+            )
+            for i_tweet in tweets
+        ]
+        async_db.add_all(media)
+        await async_db.flush()
+        for i_tweet, i_media in zip(tweets, media):
+            i_tweet.attachments = [i_media.id]  # type: ignore
+        async_db.add_all(
+            [
+                FollowRelation(follower_id=i_user.id, following_id=author.id)
+                for i_user in followers
+            ]
+            + [
+                Like(follower_id=i_user.id, tweet_id=i_tweet.id)
+                for i_user in followers
+                for i_tweet in tweets
+            ]
+            + [
+                HomeTimeline(user_id=i_user.id, tweet_id=i_tweet.id, score=i_tweet.id)
+                for i_user in users
+                for i_tweet in tweets
+            ]
+        )
+        datasets[i_name] = {
+            "size": i_size,
+            "author_id": author.id,
+            "viewer": followers[0].api_key,
+        }
+    await async_db.flush()
+    await repair_counters(async_db)
+    await async_db.commit()
+
+    yield datasets
+
+    await async_db.execute(delete(User).filter(User.api_key.startswith("budget-")))
+    for i_table in (
+        "users",
+        "tweets",
+        "media_attachments",
+        "follow_relations",
+        "likes",
+    ):
+        await async_db.execute(
+            text(
+                f"SELECT setval(pg_get_serial_sequence('{i_table}', 'id'), "
+                f"(SELECT COALESCE(MAX(id), 0) + 1 FROM {i_table}), false)"
+            )
+        )
+    await async_db.commit()
+    async_db.expunge_all()
+
+
 # This gives extra warnings:
 @pytest_asyncio.fixture(scope="session")
 def event_loop() -> Generator:
@@ -229,6 +370,9 @@ async def async_db_dummy_fill(async_db: AsyncSession) -> None:
 
     logger_test.info("!!! Start creating fake data in test database..")
     async_db.add_all(users)
+    await async_db.flush()
+    await repair_counters(async_db)
+    await HomeTimeline.rebuild(async_db)
     await async_db.commit()
     logger_test.info("!!! Finish creating fake data in test database..")
     return None
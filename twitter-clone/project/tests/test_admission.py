@@ -0,0 +1,113 @@
+import pytest
+from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette import status
+
+from project.server.main.admission import (
+    ConcurrencyLimiter,
+    admission_rejected,
+    client_key,
+)
+from project.server.main.cache import CurrentUser, identity_cache
+from project.server.main.config import get_settings
+
+pytestmark = pytest.mark.asyncio
+
+settings = get_settings()
+
+
+@pytest.mark.admission
+async def test_api_rate_limit_negative(
+    async_client: AsyncClient,
+    async_db: AsyncSession,
+    async_db_dummy_fill: None,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """
+    Test for requests of a client address over its burst rejected with 429:
+    unknown api keys share the bucket of the address, other addresses and media
+    files are not affected
+    """
+    monkeypatch.setattr(settings, "admission_rate", 0.1)
+    monkeypatch.setattr(settings, "admission_burst", 2)
+    rejected = admission_rejected.get("read", "rate_limit")
+    address = {"x-real-ip": "203.0.113.1"}
+
+    statuses = []
+    for i_api_key in ("unknown1", "unknown2", "unknown3"):
+        response = await async_client.get(
+            "/api/users/me", headers={**address, "api-key": i_api_key}
+        )
+        statuses.append(response.status_code)
+
+    assert statuses == [status.HTTP_404_NOT_FOUND] * 2 + [
+        status.HTTP_429_TOO_MANY_REQUESTS
+    ]
+    assert int(response.headers["retry-after"]) >= 1
+    assert response.json()["result"] is False
+    assert admission_rejected.get("read", "rate_limit") == rejected + 1
+
+    response = await async_client.get(
+        f"{settings.media_dir_host}/missing.png", headers=address
+    )
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+    response = await async_client.get(
+        "/api/users/1", headers={"x-forwarded-for": "203.0.113.9, 203.0.113.2"}
+    )
+    assert response.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.admission
+async def test_api_pool_wait_shedding_negative(
+    async_client: AsyncClient,
+    async_db: AsyncSession,
+    async_db_dummy_fill: None,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """
+    Test for requests shed with 503 while the pool is waited for too long,
+    health checks are not affected
+    """
+    monkeypatch.setattr(settings, "admission_pool_wait_max", -1.0)
+
+    response = await async_client.get("/api/users/1")
+    health = await async_client.get("/health/live")
+
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert "retry-after" in response.headers
+    assert health.status_code == status.HTTP_200_OK
+
+
+@pytest.mark.admission
+async def test_concurrency_limiter_negative() -> None:
+    """
+    Test for requests over the concurrency limit rejected after queue timeout
+    """
+    limiter = ConcurrencyLimiter(limit=1, queue_timeout=0.01)
+
+    assert await limiter.acquire() is True
+    assert await limiter.acquire() is False
+    assert (limiter.in_flight, limiter.waiting) == (1, 0)
+    limiter.release()
+    assert await limiter.acquire() is True
+
+
+@pytest.mark.admission
+async def test_client_key_positive() -> None:
+    """
+    Test for buckets keyed by known users, by proxy address otherwise
+    """
+    identity_cache.set_user("known", CurrentUser(id=7, name="Known"))
+    scope = {
+        "headers": [(b"api-key", b"known"), (b"x-real-ip", b"203.0.113.5")],
+        "query_string": b"",
+        "client": None,
+    }
+
+    assert client_key(scope) == "user:7"
+    scope["headers"] = [(b"x-real-ip", b"203.0.113.5")]
+    scope["query_string"] = b"api_key=unknown"
+    assert client_key(scope) == "address:203.0.113.5"
+    scope["headers"] = []
+    assert client_key(scope) == "address:unknown"
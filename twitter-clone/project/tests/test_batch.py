@@ -0,0 +1,193 @@
+from typing import Any, Callable, ContextManager
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette import status
+
+from project.server.main.database import FollowRelation, HomeTimeline, Like, Tweet, User
+from project.server.main.schemas import TweetsResponseModel, UsersResponseModel
+
+pytestmark = pytest.mark.asyncio
+
+
+def statuses(response_data: dict[str, Any]) -> dict[int, str]:
+    return {i_item["id"]: i_item["status"] for i_item in response_data["items"]}
+
+
+@pytest.mark.batch
+async def test_api_batch_likes_positive(
+    async_client: AsyncClient,
+    async_db: AsyncSession,
+    async_db_dummy_fill: None,
+    query_counter: Callable[..., ContextManager[Any]],
+) -> None:
+    """
+    Test for like and unlike many tweets: result per tweet, counters in sync,
+    statements do not depend on the number of tweets
+    """
+    user = "test1"
+    with query_counter() as queries:
+        response = await async_client.post(
+            "/api/batch/likes",
+            headers={"api-key": user},
+            json={"ids": [7, 8, 1, 999, 4, 7]},
+        )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [i_item["id"] for i_item in response.json()["items"]] == [7, 8, 1, 999, 4]
+    assert statuses(response.json()) == {
+        7: "created",
+        8: "created",
+        1: "not_allowed",
+        999: "not_found",
+        4: "exists",
+    }
+    assert queries.count <= 4
+
+    likes_query = await async_db.execute(
+        select(Tweet.id, Tweet.like_count).filter(Tweet.id.in_([7, 8]))
+    )
+    for i_tweet_id, i_like_count in likes_query.all():
+        likes_total_query = await async_db.execute(
+            select(func.count(Like.id)).filter(Like.tweet_id == i_tweet_id)
+        )
+        assert i_like_count == likes_total_query.scalar() == 1
+
+    response = await async_client.request(
+        "DELETE",
+        "/api/batch/likes",
+        headers={"api-key": user},
+        json={"ids": [7, 8, 999]},
+    )
+    like_count_query = await async_db.execute(
+        select(func.sum(Tweet.like_count)).filter(Tweet.id.in_([7, 8]))
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert statuses(response.json()) == {7: "deleted", 8: "deleted", 999: "not_found"}
+    assert like_count_query.scalar() == 0
+
+
+@pytest.mark.batch
+async def test_api_batch_follows_positive(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for follow and unfollow many users: result per user, counters and
+    home timeline in sync
+    """
+    user = "test3"
+    response = await async_client.post(
+        "/api/batch/follows",
+        headers={"api-key": user},
+        json={"ids": [1, 2, 3, 999]},
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert statuses(response.json()) == {
+        1: "created",
+        2: "exists",
+        3: "not_allowed",
+        999: "not_found",
+    }
+
+    counters_query = await async_db.execute(
+        select(User.id, User.followers_count, User.following_count).filter(
+            User.id.in_([1, 3])
+        )
+    )
+    for i_user_id, i_followers_count, i_following_count in counters_query.all():
+        followers_query = await async_db.execute(
+            select(func.count(FollowRelation.id)).filter(
+                FollowRelation.following_id == i_user_id
+            )
+        )
+        following_query = await async_db.execute(
+            select(func.count(FollowRelation.id)).filter(
+                FollowRelation.follower_id == i_user_id
+            )
+        )
+        assert i_followers_count == followers_query.scalar()
+        assert i_following_count == following_query.scalar()
+
+    timeline_query = await async_db.execute(
+        select(func.count()).filter(
+            HomeTimeline.user_id == 3, HomeTimeline.tweet_id <= 3
+        )
+    )
+    assert timeline_query.scalar() == 3
+
+    response = await async_client.request(
+        "DELETE",
+        "/api/batch/follows",
+        headers={"api-key": user},
+        json={"ids": [1, 999]},
+    )
+    timeline_query = await async_db.execute(
+        select(func.count()).filter(
+            HomeTimeline.user_id == 3, HomeTimeline.tweet_id <= 3
+        )
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert statuses(response.json()) == {1: "deleted", 999: "not_found"}
+    assert timeline_query.scalar() == 0
+
+
+@pytest.mark.batch
+async def test_api_batch_size_negative(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for rejecting empty batches and batches over the limit
+    """
+    for i_ids in ([], list(range(1, 1000))):
+        response = await async_client.post(
+            "/api/batch/likes", headers={"api-key": "test1"}, json={"ids": i_ids}
+        )
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+@pytest.mark.batch
+async def test_api_batch_get_users_positive(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for getting many profiles: the same as single profiles in requested order
+    """
+    response = await async_client.get("/api/batch/users", params={"ids": [2, 999, 1]})
+
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert [i_user["id"] for i_user in data["users"]] == [2, 1]
+    assert data["not_found"] == [999]
+    assert UsersResponseModel.model_validate(data).model_dump() == data
+    for i_user in data["users"]:
+        single = await async_client.get(f"/api/users/{i_user['id']}")
+        single_user = single.json()["user"]
+        for i_key in ("followers", "following"):
+            i_user[i_key].sort(key=lambda i_follow: i_follow["id"])
+            single_user[i_key].sort(key=lambda i_follow: i_follow["id"])
+        assert i_user == single_user
+
+
+@pytest.mark.batch
+async def test_api_batch_get_tweets_positive(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for getting many tweets in the shape of feed in requested order
+    """
+    response = await async_client.get(
+        "/api/batch/tweets", headers={"api-key": "test1"}, params={"ids": [5, 999, 4]}
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert [i_tweet["id"] for i_tweet in data["tweets"]] == [5, 4]
+    assert data["not_found"] == [999]
+    assert TweetsResponseModel.model_validate(data).model_dump() == data
+    assert data["tweets"][0]["author"]["id"] == 2
+    assert [i_like["user_id"] for i_like in data["tweets"][0]["likes"]] == [1]
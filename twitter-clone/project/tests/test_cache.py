@@ -0,0 +1,125 @@
+from typing import Any
+
+import pytest
+from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette import status
+
+from project.server.main.cache import LRUCache, feed_cache, identity_cache
+from project.server.main.database import Tweet, User
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.mark.cache
+async def test_lru_cache_eviction_positive() -> None:
+    """
+    Test for LRU cache keeping the size cap by evicting least recently used entries
+    """
+    cache: LRUCache[str, int] = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    evicted = cache.set("c", 3)
+
+    assert evicted == ["b"]
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.stats() == {"hits": 2, "misses": 1, "evictions": 1, "size": 2}
+
+
+@pytest.mark.cache
+async def test_feed_cache_invalidation_positive(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for feed served from cache until a like changes a tweet of the feed
+    """
+    user, liker, liker_id = "test3", "test1", 1
+    hits = feed_cache.stats()["hits"]
+
+    response = await async_client.get("/api/tweets", headers={"api-key": user})
+    response_cached = await async_client.get("/api/tweets", headers={"api-key": user})
+
+    assert response_cached.json() == response.json()
+    assert feed_cache.stats()["hits"] == hits + 1
+
+    # the feed of user shows tweets of user 2, which are liked by other user
+    tweet = next(
+        i_tweet
+        for i_tweet in response.json()["tweets"]
+        if i_tweet["author"]["id"] == 2
+        and all(i_like["user_id"] != liker_id for i_like in i_tweet["likes"])
+    )
+    await async_client.post(
+        f"/api/tweets/{tweet['id']}/likes", headers={"api-key": liker}
+    )
+    response = await async_client.get("/api/tweets", headers={"api-key": user})
+    tweet_liked = next(
+        i_tweet for i_tweet in response.json()["tweets"] if i_tweet["id"] == tweet["id"]
+    )
+
+    await async_client.delete(
+        f"/api/tweets/{tweet['id']}/likes", headers={"api-key": liker}
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert feed_cache.stats()["hits"] == hits + 1
+    assert len(tweet_liked["likes"]) == len(tweet["likes"]) + 1
+
+
+@pytest.mark.cache
+async def test_feed_cache_invalidated_while_reading_negative(
+    async_client: AsyncClient,
+    async_db: AsyncSession,
+    async_db_dummy_fill: None,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """
+    Test for feed page not cached when the viewer is invalidated after the feed
+    is read from the database and before the page is stored
+    """
+    user, user_id = "test3", 3
+    hydrate_tweets = Tweet._hydrate_tweets
+
+    async def hydrate_tweets_invalidated(*args: Any, **kwargs: Any) -> None:
+        # a write changes the feed while the page is being built
+        await feed_cache.invalidate([user_id])
+        await hydrate_tweets(*args, **kwargs)
+
+    monkeypatch.setattr(Tweet, "_hydrate_tweets", hydrate_tweets_invalidated)
+    response = await async_client.get("/api/tweets", headers={"api-key": user})
+    monkeypatch.undo()
+    hits = feed_cache.stats()["hits"]
+
+    response_not_cached = await async_client.get(
+        "/api/tweets", headers={"api-key": user}
+    )
+    assert response_not_cached.json() == response.json()
+    assert feed_cache.stats()["hits"] == hits
+
+    await async_client.get("/api/tweets", headers={"api-key": user})
+    assert feed_cache.stats()["hits"] == hits + 1
+
+
+@pytest.mark.cache
+async def test_identity_cache_positive(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for user identity cached on authentication and dropped on invalidation
+    """
+    user_api = "test1"
+    # lookups are memoized per session, start with a clean one
+    async_db.info.pop("current_users", None)
+    assert identity_cache.get_user(user_api) is None
+
+    user = await User.get_current_user(async_db, user_api)
+
+    assert identity_cache.get_user(user_api) == user
+    assert identity_cache.get_names([user.id]) == ({user.id: user.name}, set())
+
+    identity_cache.invalidate_user(user.id)
+
+    assert identity_cache.get_user(user_api) is None
+    assert identity_cache.get_names([user.id]) == (dict(), {user.id})
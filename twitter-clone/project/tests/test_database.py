@@ -2,11 +2,21 @@ import datetime
 
 import pytest
 from httpx import AsyncClient
-from sqlalchemy import select
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import InvalidRequestError
 from sqlalchemy.ext.asyncio import AsyncSession
-
-from project.server.main.database import User
+from sqlalchemy.orm import selectinload
+
+from project.server.main.config import Settings
+from project.server.main.database import (
+    Like,
+    Tweet,
+    User,
+    async_session,
+    repair_counters,
+)
 from project.server.main.error_handler import ObjectNotFoundException
+from project.server.main.maintenance import parse_args, run_repair_counters
 
 pytestmark = pytest.mark.asyncio
 
@@ -83,3 +93,86 @@ async def test_get_user_by_id_negative(
     user_id = 10
     with pytest.raises(ObjectNotFoundException):
         await User.get_user_by_id(async_db, user_id)
+
+
+@pytest.mark.database
+async def test_repair_counters_positive(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for repair of denormalized counters after they drift
+    """
+    tweet_id = 2
+    await async_db.execute(
+        update(Tweet).values(like_count=100).where(Tweet.id == tweet_id)
+    )
+    await repair_counters(async_db)
+    await async_db.commit()
+
+    like_count_query = await async_db.execute(
+        select(Tweet.like_count).filter(Tweet.id == tweet_id)
+    )
+    likes_query = await async_db.execute(
+        select(func.count(Like.id)).filter(Like.tweet_id == tweet_id)
+    )
+
+    assert like_count_query.scalar() == likes_query.scalar()
+
+
+@pytest.mark.database
+async def test_maintenance_repair_counters_positive(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for repair job of a live database: drifted rows only, own transaction
+    """
+    tweet_id, user_id = 3, 2
+    await async_db.execute(
+        update(Tweet).values(like_count=100).where(Tweet.id == tweet_id)
+    )
+    await async_db.execute(
+        update(User).values(followers_count=100).where(User.id == user_id)
+    )
+    await async_db.commit()
+
+    assert await run_repair_counters() == {"users": 1, "tweets": 1}
+    assert await run_repair_counters() == {"users": 0, "tweets": 0}
+    assert parse_args(["repair-counters"]).job == "repair-counters"
+
+
+@pytest.mark.database
+async def test_relationships_lazy_load_negative(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for relationships not loaded implicitly: lazy loads raise in tests,
+    eager loading is opted in per query
+    """
+    async with async_session() as _session:
+        user = await _session.get(User, 1)
+        assert user is not None
+        with pytest.raises(InvalidRequestError):
+            user.tweets_of_user
+
+    async with async_session() as _session:
+        user_query = await _session.execute(
+            select(User).options(selectinload(User.tweets_of_user)).filter(User.id == 1)
+        )
+        user = user_query.scalar_one()
+        tweets_query = await _session.execute(
+            select(func.count(Tweet.id)).filter(Tweet.author == 1)
+        )
+        assert len(user.tweets_of_user) == tweets_query.scalar()
+
+
+@pytest.mark.database
+@pytest.mark.parametrize("testing, guard", [("True", True), ("False", False)])
+async def test_lazy_load_guard_testing_flag(
+    monkeypatch: pytest.MonkeyPatch, testing: str, guard: bool
+) -> None:
+    """
+    Test for the lazy load guard following the value of TESTING, not its presence
+    """
+    monkeypatch.setenv("TESTING", testing)
+    monkeypatch.delenv("DATABASE_LAZY_LOAD_GUARD", raising=False)
+    assert Settings().database_lazy_load_guard is guard
@@ -0,0 +1,141 @@
+import asyncio
+from typing import AsyncIterator
+
+import orjson
+import pytest
+from httpx import AsyncClient
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette import status
+
+from project.server.main.database import FollowRelation, Like, Tweet
+from project.server.main.events import (
+    KEEPALIVE_FRAME,
+    RESET_FRAME,
+    RETRY_FRAME,
+    Subscription,
+    event_bus,
+)
+
+pytestmark = pytest.mark.asyncio
+
+
+async def next_event(stream: AsyncIterator[bytes]) -> tuple[str, dict]:
+    """
+    Type and data of the next event of the stream
+    """
+    frame = await asyncio.wait_for(anext(stream), 1.0)
+    event_line, data_line = frame.decode().strip().split("\n")
+    return event_line.removeprefix("event: "), orjson.loads(
+        data_line.removeprefix("data: ")
+    )
+
+
+@pytest.mark.events
+async def test_events_likes_positive(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for like counters pushed to the author of the tweet, keep-alive while idle
+    """
+    author_id, liker = 1, "test3"
+    liked_query = await async_db.execute(
+        select(Like.tweet_id).filter(Like.follower_id == 3)
+    )
+    tweet_id_query = await async_db.execute(
+        select(Tweet.id)
+        .filter(Tweet.author == author_id, Tweet.id.not_in(liked_query.scalars().all()))
+        .limit(1)
+    )
+    tweet_id = tweet_id_query.scalar()
+    like_count_query = await async_db.execute(
+        select(Tweet.like_count).filter(Tweet.id == tweet_id)
+    )
+    like_count = like_count_query.scalar_one()
+
+    stream = event_bus.stream(author_id, keepalive=0.05)
+    try:
+        assert await anext(stream) == RETRY_FRAME
+        await async_client.post(
+            f"/api/tweets/{tweet_id}/likes", headers={"api-key": liker}
+        )
+        assert await next_event(stream) == (
+            "like",
+            {"tweets": [{"id": tweet_id, "like_count": like_count + 1}]},
+        )
+        await async_client.delete(
+            f"/api/tweets/{tweet_id}/likes", headers={"api-key": liker}
+        )
+        assert await next_event(stream) == (
+            "like",
+            {"tweets": [{"id": tweet_id, "like_count": like_count}]},
+        )
+        assert await anext(stream) == KEEPALIVE_FRAME
+    finally:
+        await stream.aclose()
+
+    assert event_bus.stats()["subscribers"] == 0
+
+
+@pytest.mark.events
+async def test_events_follows_positive(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for follow and unfollow pushed to both users
+    """
+    follower_id, following_id, follower = 3, 1, "test3"
+    follow_query = await async_db.execute(
+        select(FollowRelation.id).filter(
+            FollowRelation.follower_id == follower_id,
+            FollowRelation.following_id == following_id,
+        )
+    )
+    assert follow_query.scalar() is None
+
+    streams = [event_bus.stream(i_id, keepalive=1.0) for i_id in (3, 1)]
+    try:
+        for i_stream in streams:
+            assert await anext(i_stream) == RETRY_FRAME
+        await async_client.post(
+            f"/api/users/{following_id}/follow", headers={"api-key": follower}
+        )
+        await async_client.delete(
+            f"/api/users/{following_id}/follow", headers={"api-key": follower}
+        )
+        for i_stream in streams:
+            for i_type in ("follow", "unfollow"):
+                assert await next_event(i_stream) == (
+                    i_type,
+                    {"follower_id": follower_id, "following_ids": [following_id]},
+                )
+    finally:
+        for i_stream in streams:
+            await i_stream.aclose()
+
+
+@pytest.mark.events
+async def test_events_slow_client_negative() -> None:
+    """
+    Test for events of a client not keeping up replaced by reset
+    """
+    subscription = Subscription(viewer_id=1, maxsize=2)
+    for i_frame in (b"1", b"2", b"3"):
+        subscription.put(i_frame)
+
+    assert subscription.queue.get_nowait() == RESET_FRAME
+    assert subscription.queue.empty()
+    assert subscription.dropped == 2
+
+
+@pytest.mark.events
+async def test_api_events_negative(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for events stream of unregistered user
+    """
+    for i_params in ({}, {"api_key": "test100"}):
+        response = await async_client.get("/api/events", params=i_params)
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
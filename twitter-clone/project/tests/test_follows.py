@@ -4,7 +4,7 @@ from sqlalchemy import and_, delete, select
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
-from project.server.main.database import FollowRelation, User
+from project.server.main.database import FollowRelation, Tweet, User
 
 pytestmark = pytest.mark.asyncio
 
@@ -92,3 +92,30 @@ async def test_api_delete_follows_negative(
         "error_type": "N/A",
         "result": False,
     }
+
+
+@pytest.mark.follows
+async def test_api_follows_home_timeline_positive(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for tweets of followed user put to feed on follow and removed on unfollow
+    """
+    user = "test1"
+    following_id = 3
+    following_tweets_query = await async_db.execute(
+        select(Tweet.id).filter(Tweet.author == following_id)
+    )
+    following_tweets = set(following_tweets_query.scalars().all())
+
+    await async_client.post(
+        f"/api/users/{following_id}/follow", headers={"api-key": user}
+    )
+    feed = await Tweet.get_tweets(async_db, user)
+    assert following_tweets <= {i_tweet["id"] for i_tweet in feed["tweets"]}
+
+    await async_client.delete(
+        f"/api/users/{following_id}/follow", headers={"api-key": user}
+    )
+    feed = await Tweet.get_tweets(async_db, user)
+    assert not following_tweets & {i_tweet["id"] for i_tweet in feed["tweets"]}
@@ -0,0 +1,96 @@
+import pytest
+from httpx import AsyncClient
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette import status
+from starlette.types import Message, Receive, Scope, Send
+
+from project.server.main.metrics import (
+    MetricsMiddleware,
+    db_statements_per_request,
+    http_request_duration,
+    http_requests,
+    http_stream_duration,
+)
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.mark.health
+async def test_api_metrics_positive(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for request and SQL statistics per route template in metrics
+    """
+    user = "test1"
+    route = ("GET", "/api/users/{user_id}")
+    requests_before = http_requests.get(*route, "200")
+    statements_before = db_statements_per_request.get(*route)
+
+    await async_client.get("/api/users/2", headers={"api-key": user})
+    response = await async_client.get("/metrics")
+    statements_after = db_statements_per_request.get(*route)
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("text/plain")
+    assert http_requests.get(*route, "200") == requests_before + 1
+    assert statements_after[0] == statements_before[0] + 1
+    assert statements_after[1] > statements_before[1]
+    for i_line in (
+        'http_requests_total{method="GET",route="/api/users/{user_id}",status="200"}',
+        "# TYPE http_request_duration_seconds histogram",
+        'db_pool_checked_out{engine="primary"}',
+        'cache_hit_ratio{cache="feed"}',
+    ):
+        assert i_line in response.text
+
+
+@pytest.mark.health
+async def test_api_health_positive(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for liveness and readiness with pool health
+    """
+    response_live = await async_client.get("/health/live")
+    response_ready = await async_client.get("/health/ready")
+
+    assert response_live.status_code == status.HTTP_200_OK
+    assert response_live.json() == {"status": "ok"}
+    assert response_ready.status_code == status.HTTP_200_OK
+    assert response_ready.json()["database"] is True
+    assert response_ready.json()["pools"]["primary"]["waiting"] == 0
+
+
+@pytest.mark.health
+async def test_metrics_streams_apart_positive() -> None:
+    """
+    Test for durations of event streams kept apart from request latency
+    """
+
+    async def stream_app(scope: Scope, receive: Receive, send: Send) -> None:
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [(b"content-type", b"text/event-stream; charset=utf-8")],
+            }
+        )
+        await send({"type": "http.response.body", "body": b": keepalive\n\n"})
+
+    async def receive() -> Message:
+        return {"type": "http.disconnect"}
+
+    async def send(message: Message) -> None:
+        pass
+
+    labels = ("GET", "unmatched")
+    streams_before = http_stream_duration.get(*labels)
+    requests_before = http_request_duration.get(*labels)
+
+    await MetricsMiddleware(stream_app)(
+        {"type": "http", "method": "GET", "path": "/api/events"}, receive, send
+    )
+
+    assert http_stream_duration.get(*labels)[0] == streams_before[0] + 1
+    assert http_request_duration.get(*labels) == requests_before
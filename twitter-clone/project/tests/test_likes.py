@@ -1,8 +1,11 @@
 import pytest
 from httpx import AsyncClient
+from sqlalchemy import func, select
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
+from project.server.main.database import Like, Tweet
+
 pytestmark = pytest.mark.asyncio
 
 
@@ -25,6 +28,60 @@ async def test_api_create_like_positive(
     assert response.json() == response_expect
 
 
+@pytest.mark.likes
+async def test_api_create_like_twice_negative(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for create like for a tweet id liked by current user already
+    """
+    user = "test1"
+    tweet_id = 6
+    for _ in range(2):
+        response = await async_client.post(
+            f"/api/tweets/{tweet_id}/likes", headers={"api-key": user}
+        )
+
+    likes_query = await async_db.execute(
+        select(func.count(Like.id)).filter(
+            Like.tweet_id == tweet_id, Like.follower_id == 1
+        )
+    )
+    like_count_query = await async_db.execute(
+        select(Tweet.like_count).filter(Tweet.id == tweet_id)
+    )
+    likes_total_query = await async_db.execute(
+        select(func.count(Like.id)).filter(Like.tweet_id == tweet_id)
+    )
+
+    assert response.status_code == status.HTTP_201_CREATED
+    assert response.json() == {"result": False}
+    assert likes_query.scalar() == 1
+    assert like_count_query.scalar() == likes_total_query.scalar()
+
+
+@pytest.mark.likes
+async def test_api_create_like_not_found_negative(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for create like for a tweet id which does not exist
+    """
+    user = "test1"
+    tweet_id = 1000
+
+    response = await async_client.post(
+        f"/api/tweets/{tweet_id}/likes", headers={"api-key": user}
+    )
+
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+    assert response.json() == {
+        "error_message": "Tweet not found",
+        "error_type": "N/A",
+        "result": False,
+    }
+
+
 @pytest.mark.likes
 async def test_api_create_like_negative(
     async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
@@ -1,15 +1,34 @@
+import datetime
+import hashlib
+import io
+import os
 import pathlib
+import time
 
 import pytest
 from httpx import AsyncClient
-from sqlalchemy import func, select
+from PIL import ExifTags, Image
+from sqlalchemy import delete, func, select, update
 from sqlalchemy.ext.asyncio import AsyncSession
-from starlette.status import HTTP_201_CREATED, HTTP_400_BAD_REQUEST
+from starlette.status import (
+    HTTP_200_OK,
+    HTTP_201_CREATED,
+    HTTP_206_PARTIAL_CONTENT,
+    HTTP_304_NOT_MODIFIED,
+    HTTP_400_BAD_REQUEST,
+    HTTP_404_NOT_FOUND,
+)
 
-from project.server.main.database import Media
+from project.server.main.config import get_settings
+from project.server.main.database import Media, MediaBlob, collect_media_garbage
+from project.server.main.error_handler import SQLAlchemyException
+from project.server.main.images import derivative_pool, render_derivatives
+from project.server.main.media_gc import media_collector
 
 pytestmark = pytest.mark.asyncio
 
+settings = get_settings()
+
 
 @pytest.mark.likes
 async def test_api_create_media_file_check_positive(
@@ -78,3 +97,355 @@ async def test_api_create_media_file_check_type_negative(
 
     assert response.status_code == HTTP_400_BAD_REQUEST
     assert response.json() == {"detail": "Invalid file type"}
+
+
+@pytest.mark.media
+async def test_api_create_media_file_check_content_negative(
+    async_client: AsyncClient, async_db: AsyncSession
+) -> None:
+    """
+    Test for media file check (single file only): declared type does not match
+    the content, no temporary file is left
+    """
+    user = "test1"
+
+    file_other = pathlib.Path(__file__).parent / "media/image_other.txt"
+
+    with open(file_other, "r+b") as file:
+        files = {"file": ("image_other.jpg", file, "image/jpeg")}
+        response = await async_client.post(
+            "/api/medias", headers={"api-key": user}, files=files
+        )
+
+    assert response.status_code == HTTP_400_BAD_REQUEST
+    assert response.json() == {"detail": "Invalid file type"}
+    assert not list((settings.media_dir_local / "tmp").glob("*.part"))
+
+
+@pytest.mark.media
+async def test_api_create_media_deduplicated_positive(
+    async_client: AsyncClient, async_db: AsyncSession
+) -> None:
+    """
+    Test for the same content stored once and released with its last reference
+    """
+    user = "test1"
+
+    file_ok = pathlib.Path(__file__).parent / "media/image_ok.jpg"
+    sha256 = hashlib.sha256(file_ok.read_bytes()).hexdigest()
+
+    media_ids = []
+    for _ in range(2):
+        with open(file_ok, "r+b") as file:
+            response = await async_client.post(
+                "/api/medias", headers={"api-key": user}, files={"file": file}
+            )
+        assert response.status_code == HTTP_201_CREATED
+        media_ids.append(response.json()["media_id"])
+
+    media_query = await async_db.execute(
+        select(Media.local_path, Media.blob_sha256).filter(Media.id.in_(media_ids))
+    )
+    media = media_query.all()
+    references_query = await async_db.execute(
+        select(func.count()).select_from(Media).filter(Media.blob_sha256 == sha256)
+    )
+    references = references_query.scalar()
+    blob_query = await async_db.execute(
+        select(MediaBlob.file_name, MediaBlob.ref_count).filter(
+            MediaBlob.sha256 == sha256
+        )
+    )
+    blob = blob_query.one()
+
+    assert {i_media.blob_sha256 for i_media in media} == {sha256}
+    assert len({i_media.local_path for i_media in media}) == 1
+    assert blob.ref_count == references
+    assert (settings.media_dir_local / blob.file_name).exists()
+
+    # the blob is unused only when the last reference is released
+    await async_db.execute(delete(Media).filter(Media.blob_sha256 == sha256))
+    assert await MediaBlob.release(async_db, [sha256] * (references - 1)) == []
+    assert await MediaBlob.release(async_db, [sha256]) == [blob.file_name]
+    await async_db.rollback()
+
+
+@pytest.mark.media
+async def test_media_blob_uploaded_again_kept_negative(
+    async_client: AsyncClient, async_db: AsyncSession
+) -> None:
+    """
+    Test for files of a released blob kept when the same content is uploaded
+    again before their queued removal
+    """
+    user = "test1"
+    image = io.BytesIO()
+    Image.new("RGB", (64, 64), color=(4, 5, 6)).save(image, format="PNG")
+
+    response = await async_client.post(
+        "/api/medias",
+        headers={"api-key": user},
+        files={"file": ("again.png", image.getvalue(), "image/png")},
+    )
+    media_id = response.json()["media_id"]
+    await derivative_pool.join()
+    media = await async_db.get(Media, media_id)
+    assert media is not None
+    blob_path = pathlib.Path(str(media.local_path))
+
+    # the last reference is released: files of the blob are to be removed
+    await async_db.execute(delete(Media).filter(Media.id == media_id))
+    files_unused = await MediaBlob.release(async_db, [str(media.blob_sha256)])
+    await async_db.commit()
+    assert str(blob_path).endswith(files_unused[0])
+
+    response = await async_client.post(
+        "/api/medias",
+        headers={"api-key": user},
+        files={"file": ("again.png", image.getvalue(), "image/png")},
+    )
+    assert response.status_code == HTTP_201_CREATED
+    await derivative_pool.join()
+
+    removed, _ = await media_collector.remove(
+        str(settings.media_dir_local / i_file_name) for i_file_name in files_unused
+    )
+
+    assert removed == 0
+    assert blob_path.exists()
+    assert await async_db.get(MediaBlob, media.blob_sha256) is not None
+
+
+@pytest.mark.media
+async def test_media_derivatives_not_saved_negative(
+    async_client: AsyncClient, async_db: AsyncSession, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """
+    Test for a failed save of derivatives logged, not raised when jobs are joined
+    """
+
+    async def set_derivatives_failed(*args: object) -> None:
+        raise SQLAlchemyException(error_message="Derivatives are not saved")
+
+    monkeypatch.setattr(MediaBlob, "set_derivatives", set_derivatives_failed)
+    image = io.BytesIO()
+    Image.new("RGB", (64, 64), color=(7, 8, 9)).save(image, format="PNG")
+
+    response = await async_client.post(
+        "/api/medias",
+        headers={"api-key": "test1"},
+        files={"file": ("failed.png", image.getvalue(), "image/png")},
+    )
+    await derivative_pool.join()
+    media = await async_db.get(Media, response.json()["media_id"])
+    assert media is not None
+    blob = await async_db.get(MediaBlob, media.blob_sha256)
+
+    assert response.status_code == HTTP_201_CREATED
+    assert blob is not None
+    assert not blob.derivatives
+
+
+@pytest.mark.media
+async def test_render_derivatives_positive(tmp_path: pathlib.Path) -> None:
+    """
+    Test for derivatives: scaled down, oriented by EXIF which is stripped, re-encoded
+    """
+    image = Image.new("RGB", (800, 400))
+    exif = image.getexif()
+    exif[ExifTags.Base.Orientation] = 6  # rotated 90 degrees clockwise
+    (tmp_path / "ab/cd").mkdir(parents=True)
+    image.save(tmp_path / "ab/cd/abcd.jpg", exif=exif)
+
+    derivatives = render_derivatives(
+        str(tmp_path), "ab/cd/abcd.jpg", {"thumb": 100, "display": 1000}, "webp"
+    )
+
+    assert derivatives == {
+        "thumb": "ab/cd/abcd_thumb.webp",
+        "display": "ab/cd/abcd_display.webp",
+    }
+    for i_file_name, i_size in (
+        (derivatives["thumb"], (50, 100)),
+        (derivatives["display"], (400, 800)),
+    ):
+        with Image.open(tmp_path / i_file_name) as i_image:
+            assert i_image.format == "WEBP"
+            assert i_image.size == i_size
+            assert not i_image.getexif()
+
+
+@pytest.mark.media
+async def test_api_create_media_derivatives_positive(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for derivatives generated in background and shown in tweet feed
+    """
+    user = "test1"
+
+    file_ok = pathlib.Path(__file__).parent / "media/image_ok.jpg"
+
+    with open(file_ok, "r+b") as file:
+        response = await async_client.post(
+            "/api/medias", headers={"api-key": user}, files={"file": file}
+        )
+    response = await async_client.post(
+        "/api/tweets",
+        headers={"api-key": user},
+        json={
+            "tweet_data": "Picture",
+            "tweet_media_ids": [response.json()["media_id"]],
+        },
+    )
+    tweet_id = response.json()["tweet_id"]
+    await derivative_pool.join()
+
+    blob_query = await async_db.execute(
+        select(MediaBlob.derivatives).filter(
+            MediaBlob.sha256 == hashlib.sha256(file_ok.read_bytes()).hexdigest()
+        )
+    )
+    derivatives = blob_query.scalar_one()
+    response = await async_client.get("/api/tweets", headers={"api-key": user})
+    tweet = next(i for i in response.json()["tweets"] if i["id"] == tweet_id)
+
+    assert set(derivatives) == set(settings.media_derivative_sizes)
+    for i_file_name in derivatives.values():
+        assert (settings.media_dir_local / i_file_name).exists()
+    assert tweet["attachment_sizes"] == [
+        {
+            "original": tweet["attachments"][0],
+            **{
+                i_size_name: str(settings.media_dir_host / i_file_name)
+                for i_size_name, i_file_name in derivatives.items()
+            },
+        }
+    ]
+
+
+@pytest.mark.media
+async def test_api_get_media_validators_positive(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for media delivery: immutable caching, ETag of the blob, 304 and Range
+    """
+    user = "test1"
+
+    file_ok = pathlib.Path(__file__).parent / "media/image_ok.jpg"
+    content = file_ok.read_bytes()
+
+    with open(file_ok, "r+b") as file:
+        response = await async_client.post(
+            "/api/medias", headers={"api-key": user}, files={"file": file}
+        )
+    media = await async_db.get(Media, response.json()["media_id"])
+    assert media is not None
+    etag = f'"{media.blob_sha256}"'
+
+    response = await async_client.get(str(media.host_path))
+    assert response.status_code == HTTP_200_OK
+    assert response.content == content
+    assert response.headers["etag"] == etag
+    assert "immutable" in response.headers["cache-control"]
+
+    response = await async_client.get(
+        str(media.host_path), headers={"if-none-match": etag}
+    )
+    assert response.status_code == HTTP_304_NOT_MODIFIED
+    assert response.content == b""
+
+    response = await async_client.get(
+        str(media.host_path), headers={"range": "bytes=10-19"}
+    )
+    assert response.status_code == HTTP_206_PARTIAL_CONTENT
+    assert response.content == content[10:20]
+    assert response.headers["content-range"] == f"bytes 10-19/{len(content)}"
+
+
+@pytest.mark.media
+async def test_api_get_media_accel_redirect_positive(
+    async_client: AsyncClient,
+    async_db: AsyncSession,
+    async_db_dummy_fill: None,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """
+    Test for media delivery handed to nginx by internal redirect
+    """
+    file_ok = pathlib.Path(__file__).parent / "media/image_ok.jpg"
+    blob = await async_db.get(
+        MediaBlob, hashlib.sha256(file_ok.read_bytes()).hexdigest()
+    )
+    assert blob is not None
+    monkeypatch.setattr(settings, "media_accel_redirect", "/protected_media")
+
+    response = await async_client.get(f"{settings.media_dir_host}/{blob.file_name}")
+
+    assert response.status_code == HTTP_200_OK
+    assert response.content == b""
+    assert response.headers["x-accel-redirect"] == f"/protected_media/{blob.file_name}"
+    assert response.headers["content-type"] == "image/jpeg"
+
+
+@pytest.mark.media
+async def test_api_get_media_not_found_negative(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for media delivery of a file which is not stored media
+    """
+    response = await async_client.get(f"{settings.media_dir_host}/../config.py")
+
+    assert response.status_code == HTTP_404_NOT_FOUND
+
+
+@pytest.mark.media
+async def test_collect_media_garbage_positive(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for removal of stale unattached uploads and unknown files
+    """
+    user = "test1"
+    old = time.time() - settings.media_gc_grace - 60
+
+    image = io.BytesIO()
+    Image.new("RGB", (64, 64), color=(1, 2, 3)).save(image, format="PNG")
+    response = await async_client.post(
+        "/api/medias",
+        headers={"api-key": user},
+        files={"file": ("stale.png", image.getvalue(), "image/png")},
+    )
+    media_id = response.json()["media_id"]
+    await derivative_pool.join()
+    await async_db.execute(
+        update(Media)
+        .values(created_at=func.now() - datetime.timedelta(days=2))
+        .where(Media.id == media_id)
+    )
+    await async_db.commit()
+    media = await async_db.get(Media, media_id)
+    assert media is not None
+    blob_path = pathlib.Path(str(media.local_path))
+    blob_size = blob_path.stat().st_size
+
+    file_orphan = settings.media_dir_local / "orphan.bin"
+    file_orphan.write_bytes(b"0" * 100)
+    os.utime(file_orphan, (old, old))
+    file_fresh = settings.media_dir_local / "fresh.bin"
+    file_fresh.write_bytes(b"0" * 100)
+
+    report = await collect_media_garbage(async_db)
+    async_db.expire_all()
+
+    assert report["media_removed"] == 1
+    # the blob, its derivatives and the unknown file
+    assert report["files_removed"] >= 2 + len(settings.media_derivative_sizes)
+    assert report["bytes_reclaimed"] >= blob_size + 100
+    assert await async_db.get(Media, media_id) is None
+    assert not blob_path.exists()
+    assert not file_orphan.exists()
+    assert file_fresh.exists()
+    file_fresh.unlink()
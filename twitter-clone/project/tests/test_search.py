@@ -0,0 +1,113 @@
+from typing import AsyncIterator
+
+import pytest
+import pytest_asyncio
+from httpx import AsyncClient
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette import status
+
+from project.server.main.database import Tweet
+from project.server.main.schemas import SearchResponseModel
+
+pytestmark = pytest.mark.asyncio
+
+CONTENTS = {
+    7: "Searching tweets with the full text index",
+    8: "Search, search and search again: the index is searched",
+    9: "Nothing to look for here",
+}
+
+
+# tweets with known content: restored afterwards for other tests
+@pytest_asyncio.fixture
+async def searchable_tweets(
+    async_db: AsyncSession, async_db_dummy_fill: None
+) -> AsyncIterator[None]:
+    contents_query = await async_db.execute(
+        select(Tweet.id, Tweet.content).filter(Tweet.id.in_(CONTENTS))
+    )
+    contents = dict(contents_query.tuples().all())
+    for i_id, i_content in CONTENTS.items():
+        await async_db.execute(
+            update(Tweet).values(content=i_content).where(Tweet.id == i_id)
+        )
+    await async_db.commit()
+    yield
+    for i_id, i_content in contents.items():
+        await async_db.execute(
+            update(Tweet).values(content=i_content).where(Tweet.id == i_id)
+        )
+    await async_db.commit()
+
+
+@pytest.mark.search
+async def test_api_search_tweets_positive(
+    async_client: AsyncClient, searchable_tweets: None
+) -> None:
+    """
+    Test for search by stemmed words: the most relevant first, in the shape of feed
+    """
+    response = await async_client.get(
+        "/api/search/tweets", headers={"api-key": "test1"}, params={"q": "search"}
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert [i_tweet["id"] for i_tweet in data["tweets"]] == [8, 7]
+    assert data["next_cursor"] is None
+    assert data["tweets"][0]["author"]["id"] == 3
+    assert SearchResponseModel.model_validate(data).model_dump() == data
+
+    response = await async_client.get(
+        "/api/search/tweets",
+        headers={"api-key": "test1"},
+        params={"q": '"full text" -again'},
+    )
+    assert [i_tweet["id"] for i_tweet in response.json()["tweets"]] == [7]
+
+
+@pytest.mark.search
+async def test_api_search_tweets_pages_positive(
+    async_client: AsyncClient, searchable_tweets: None
+) -> None:
+    """
+    Test for search page by page with cursor
+    """
+    found_ids: list[int] = []
+    cursor = None
+    for _ in range(3):
+        params: dict[str, str | int] = {"q": "index", "limit": 1}
+        if cursor is not None:
+            params["cursor"] = cursor
+        response = await async_client.get(
+            "/api/search/tweets", headers={"api-key": "test1"}, params=params
+        )
+        assert response.status_code == status.HTTP_200_OK
+        found_ids.extend(i_tweet["id"] for i_tweet in response.json()["tweets"])
+        cursor = response.json()["next_cursor"]
+        if cursor is None:
+            break
+
+    assert found_ids == [8, 7]
+    assert cursor is None
+
+
+@pytest.mark.search
+async def test_api_search_tweets_negative(
+    async_client: AsyncClient, searchable_tweets: None
+) -> None:
+    """
+    Test for search without matches and with invalid parameters
+    """
+    response = await async_client.get(
+        "/api/search/tweets", headers={"api-key": "test1"}, params={"q": "elephant"}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == {"result": True, "tweets": [], "next_cursor": None}
+
+    for i_params in ({"q": ""}, {"q": "index", "cursor": "first"}):
+        response = await async_client.get(
+            "/api/search/tweets", headers={"api-key": "test1"}, params=i_params
+        )
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
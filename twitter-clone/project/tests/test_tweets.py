@@ -1,15 +1,41 @@
+from typing import Any, Callable, ContextManager
+
 import pytest
 from httpx import AsyncClient
-from sqlalchemy import func, select
+from sqlalchemy import func, or_, select
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
+from project.server.main.cache import feed_cache
 from project.server.main.config import logger
-from project.server.main.database import Tweet
+from project.server.main.database import FollowRelation, Like, Tweet, User
+from project.server.main.schemas import TweetResponseModel
 
 pytestmark = pytest.mark.asyncio
 
 
+async def feed_tweet_ids(async_db: AsyncSession, api_key: str) -> list[int]:
+    """
+    Ids of own tweets and tweets of followed users, the newest first
+    """
+    user = await User.get_current_user(async_db, api_key)
+    tweet_ids_query = await async_db.execute(
+        select(Tweet.id)
+        .filter(
+            or_(
+                Tweet.author == user.id,
+                Tweet.author.in_(
+                    select(FollowRelation.following_id).filter(
+                        FollowRelation.follower_id == user.id
+                    )
+                ),
+            )
+        )
+        .order_by(Tweet.id.desc())
+    )
+    return list(tweet_ids_query.scalars().all())
+
+
 @pytest.mark.tweets
 async def test_api_get_tweets_positive(
     async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
@@ -21,13 +47,182 @@ async def test_api_get_tweets_positive(
     for i_user in users:
         tweets = await Tweet.get_tweets(async_db, i_user)
         response = await async_client.get("/api/tweets", headers={"api-key": i_user})
-        # to match response schema:
-        for i_tweet in tweets["tweets"]:
-            i_tweet.pop("date_tweet")
         assert response.status_code == status.HTTP_200_OK
         assert response.json() == tweets
 
 
+@pytest.mark.tweets
+async def test_api_get_tweets_schema_positive(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for tweet feed matching response schema exactly (served without validation)
+    """
+    for i_user in ["test1", "test2", "test3"]:
+        response = await async_client.get("/api/tweets", headers={"api-key": i_user})
+        page = response.json()
+
+        assert response.status_code == status.HTTP_200_OK
+        assert TweetResponseModel.model_validate(page).model_dump() == page
+
+
+@pytest.mark.tweets
+async def test_api_get_tweets_likes_positive(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for likes compiled into tweet feed for tweets of the page
+    """
+    user = "test1"
+    response = await async_client.get("/api/tweets", headers={"api-key": user})
+
+    assert response.status_code == status.HTTP_200_OK
+    for i_tweet in response.json()["tweets"]:
+        likes_query = await async_db.execute(
+            select(Like.follower_id)
+            .filter(Like.tweet_id == i_tweet["id"])
+            .order_by(Like.id)
+        )
+        likes_expect = likes_query.scalars().all()
+        assert [i_like["user_id"] for i_like in i_tweet["likes"]] == likes_expect
+
+
+@pytest.mark.tweets
+async def test_api_get_tweets_cursor_positive(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for walking the tweet feed page by page with cursor
+    """
+    user = "test3"
+    tweet_ids_expect = await feed_tweet_ids(async_db, user)
+
+    tweet_ids: list[int] = []
+    params: dict = {"limit": 2}
+    while True:
+        response = await async_client.get(
+            "/api/tweets", headers={"api-key": user}, params=params
+        )
+        assert response.status_code == status.HTTP_200_OK
+        page = response.json()
+        assert len(page["tweets"]) <= 2
+        tweet_ids.extend(i_tweet["id"] for i_tweet in page["tweets"])
+        if page["next_cursor"] is None:
+            break
+        params["before"] = page["next_cursor"]
+
+    assert tweet_ids == tweet_ids_expect
+
+
+@pytest.mark.tweets
+async def test_api_get_tweets_newer_than_cursor_positive(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for polling only tweets newer than cursor
+    """
+    user = "test3"
+    tweet_ids_expect = await feed_tweet_ids(async_db, user)
+
+    response = await async_client.get(
+        "/api/tweets",
+        headers={"api-key": user},
+        params={"after": tweet_ids_expect[3], "limit": 2},
+    )
+    page = response.json()
+
+    assert response.status_code == status.HTTP_200_OK
+    # the closest newer tweets come first, the rest is behind next cursor
+    assert [i_tweet["id"] for i_tweet in page["tweets"]] == tweet_ids_expect[1:3]
+    assert page["next_cursor"] == tweet_ids_expect[1]
+
+
+@pytest.mark.tweets
+async def test_api_get_tweets_query_budget_positive(
+    async_client: AsyncClient,
+    budget_datasets: dict[str, dict[str, Any]],
+    query_counter: Callable[..., ContextManager[Any]],
+) -> None:
+    """
+    Test for number of queries of tweet feed not growing with the data: page,
+    media and likes of the page for feeds of 2 and 20 tweets with media, liked
+    by 2 and 20 users (identity cache is warm)
+    """
+    counts = []
+    for i_dataset in budget_datasets.values():
+        headers = {"api-key": i_dataset["viewer"]}
+        await async_client.get("/api/tweets", headers=headers)
+        await feed_cache.clear()
+        with query_counter() as queries:
+            response = await async_client.get(
+                "/api/tweets", headers=headers, params={"limit": 100}
+            )
+
+        assert response.status_code == status.HTTP_200_OK
+        tweets = response.json()["tweets"]
+        assert len(tweets) == i_dataset["size"]
+        assert all(len(i_tweet["likes"]) == i_dataset["size"] for i_tweet in tweets)
+        counts.append(queries.count)
+
+    assert counts[0] == counts[1] <= 3, counts
+
+
+@pytest.mark.tweets
+async def test_api_get_tweets_not_modified_positive(
+    async_client: AsyncClient,
+    async_db: AsyncSession,
+    async_db_dummy_fill: None,
+    query_counter: Callable[..., ContextManager[Any]],
+) -> None:
+    """
+    Test for conditional feed requests: 304 without queries until the feed is
+    changed (a like of a tweet in the feed), ETag per page parameters
+    """
+    user, liker = "test1", "test3"
+    response = await async_client.get("/api/tweets", headers={"api-key": user})
+    etag = response.headers["etag"]
+
+    with query_counter() as queries:
+        response = await async_client.get(
+            "/api/tweets", headers={"api-key": user, "if-none-match": etag}
+        )
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.headers["etag"] == etag
+    assert response.content == b""
+    assert queries.count == 0
+
+    response = await async_client.get(
+        "/api/tweets",
+        headers={"api-key": user, "if-none-match": etag},
+        params={"limit": 1},
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["etag"] != etag
+
+    liked_query = await async_db.execute(
+        select(Like.tweet_id).filter(Like.follower_id == 3)
+    )
+    liked = set(liked_query.scalars().all())
+    tweet_id = next(
+        i_tweet_id
+        for i_tweet_id in await feed_tweet_ids(async_db, user)
+        if i_tweet_id not in liked
+    )
+    response = await async_client.post(
+        f"/api/tweets/{tweet_id}/likes", headers={"api-key": liker}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    response = await async_client.get(
+        "/api/tweets", headers={"api-key": user, "if-none-match": etag}
+    )
+    await async_client.delete(
+        f"/api/tweets/{tweet_id}/likes", headers={"api-key": liker}
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["etag"] != etag
+
+
 @pytest.mark.tweets
 async def test_api_create_tweet_positive(
     async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
@@ -53,6 +248,42 @@ async def test_api_create_tweet_positive(
     assert response.json() == response_expect
 
 
+@pytest.mark.tweets
+async def test_api_create_tweet_fan_out_positive(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for a new tweet delivered to feeds of followers but not to other users
+    """
+    author_id, author, follower, other = 1, "test1", "test3", "test2"
+    data = {"tweet_data": "Hello, followers!", "tweet_media_ids": None}
+
+    # nobody follows the author in dummy data and the other user follows nobody
+    await async_client.post(
+        f"/api/users/{author_id}/follow", headers={"api-key": follower}
+    )
+    response = await async_client.post(
+        "/api/tweets", headers={"api-key": author}, json=data
+    )
+    tweet_id = response.json()["tweet_id"]
+
+    for i_user, i_delivered in ((author, True), (follower, True), (other, False)):
+        feed = await Tweet.get_tweets(async_db, i_user)
+        feed_ids = [i_tweet["id"] for i_tweet in feed["tweets"]]
+        assert (tweet_id in feed_ids) is i_delivered
+
+    response = await async_client.delete(
+        f"/api/tweets/{tweet_id}", headers={"api-key": author}
+    )
+    feed = await Tweet.get_tweets(async_db, follower)
+    await async_client.delete(
+        f"/api/users/{author_id}/follow", headers={"api-key": follower}
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert tweet_id not in [i_tweet["id"] for i_tweet in feed["tweets"]]
+
+
 @pytest.mark.tweets
 async def test_api_delete_tweet_positive(
     async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
@@ -1,12 +1,19 @@
+from typing import Any, Callable, ContextManager
+
 import pytest
 from httpx import AsyncClient
+from sqlalchemy import func, select
 from sqlalchemy.ext.asyncio import AsyncSession
 from starlette import status
 
-from project.server.main.database import User
+from project.server.main.config import get_settings
+from project.server.main.database import FollowRelation, Tweet, User
+from project.server.main.schemas import FollowsResponseModel, UserResponseModel
 
 pytestmark = pytest.mark.asyncio
 
+settings = get_settings()
+
 
 @pytest.mark.users
 async def test_api_users_me_positive(
@@ -75,3 +82,191 @@ async def test_api_users_by_id_negative(
     response = await async_client.get(f"/api/users/{unregistered_user_id}")
 
     assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.users
+async def test_api_users_counters_positive(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for profile counters matching followers, followings and tweets of user
+    """
+    user_id = 2
+    tweets_count_query = await async_db.execute(
+        select(func.count(Tweet.id)).filter(Tweet.author == user_id)
+    )
+    response = await async_client.get(f"/api/users/{user_id}")
+    user = response.json()["user"]
+
+    assert response.status_code == status.HTTP_200_OK
+    assert user["followers_count"] == len(user["followers"])
+    assert user["following_count"] == len(user["following"])
+    assert user["tweets_count"] == tweets_count_query.scalar()
+
+
+@pytest.mark.users
+async def test_api_users_by_id_query_budget_positive(
+    async_client: AsyncClient,
+    budget_datasets: dict[str, dict[str, Any]],
+    query_counter: Callable[..., ContextManager[Any]],
+) -> None:
+    """
+    Test for user profile assembled in one query: not growing with number of
+    tweets and follows (authors with 2 and 20 followers)
+    """
+    counts = []
+    for i_dataset in budget_datasets.values():
+        user_url = f"/api/users/{i_dataset['author_id']}"
+        with query_counter() as queries:
+            response = await async_client.get(user_url)
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["user"]["followers_count"] == i_dataset["size"]
+        counts.append(queries.count)
+
+    assert counts == [1, 1]
+
+
+@pytest.mark.users
+async def test_api_users_schema_positive(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for user profiles matching response schema exactly (served without
+    validation)
+    """
+    for i_path in ["/api/users/me", "/api/users/1", "/api/users/2"]:
+        response = await async_client.get(i_path, headers={"api-key": "test1"})
+        profile = response.json()
+
+        assert response.status_code == status.HTTP_200_OK
+        assert UserResponseModel.model_validate(profile).model_dump() == profile
+
+
+@pytest.mark.users
+async def test_api_users_profile_follows_size_positive(
+    async_client: AsyncClient,
+    async_db: AsyncSession,
+    async_db_dummy_fill: None,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """
+    Test for user profile with the latest followers only and total counters
+    """
+    user_query = await async_db.execute(
+        select(User.id).order_by(User.followers_count.desc(), User.id).limit(1)
+    )
+    user_id = user_query.scalar()
+    followers_query = await async_db.execute(
+        select(FollowRelation.follower_id)
+        .filter(FollowRelation.following_id == user_id)
+        .order_by(FollowRelation.id.desc())
+    )
+    followers = followers_query.scalars().all()
+    assert followers
+    monkeypatch.setattr(settings, "profile_follows_size", 1)
+
+    response = await async_client.get(f"/api/users/{user_id}")
+    user = response.json()["user"]
+
+    assert response.status_code == status.HTTP_200_OK
+    assert [i_follower["id"] for i_follower in user["followers"]] == followers[:1]
+    assert user["followers_count"] == len(followers)
+
+
+@pytest.mark.users
+async def test_api_users_follows_pages_positive(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for followers and followings of user page by page with cursor,
+    the newest follows first
+    """
+    user_id = 2
+    for i_side, i_own_id, i_other_id in (
+        ("followers", FollowRelation.following_id, FollowRelation.follower_id),
+        ("following", FollowRelation.follower_id, FollowRelation.following_id),
+    ):
+        follows_query = await async_db.execute(
+            select(i_other_id)
+            .filter(i_own_id == user_id)
+            .order_by(FollowRelation.id.desc())
+        )
+        follows = follows_query.scalars().all()
+
+        found_ids: list[int] = []
+        cursor = None
+        for _ in range(len(follows) + 1):
+            params = {"limit": 1}
+            if cursor is not None:
+                params["before"] = cursor
+            response = await async_client.get(
+                f"/api/users/{user_id}/{i_side}", params=params
+            )
+            data = response.json()
+            assert response.status_code == status.HTTP_200_OK
+            assert FollowsResponseModel.model_validate(data).model_dump() == data
+            found_ids.extend(i_user["id"] for i_user in data["users"])
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+
+        assert found_ids == follows
+        assert cursor is None
+
+
+@pytest.mark.users
+async def test_api_users_follows_pages_negative(
+    async_client: AsyncClient, async_db: AsyncSession, async_db_dummy_fill: None
+) -> None:
+    """
+    Test for followers and followings of unregistered user
+    """
+    unregistered_user_id = 10
+    for i_side in ("followers", "following"):
+        response = await async_client.get(f"/api/users/{unregistered_user_id}/{i_side}")
+
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.users
+async def test_api_users_not_modified_positive(
+    async_client: AsyncClient,
+    async_db: AsyncSession,
+    async_db_dummy_fill: None,
+    query_counter: Callable[..., ContextManager[Any]],
+) -> None:
+    """
+    Test for conditional profile requests: 304 without queries until a follow
+    changes the profile, the same ETag by id and by api key
+    """
+    user_id, follower = 1, "test3"
+    response = await async_client.get(f"/api/users/{user_id}")
+    etag = response.headers["etag"]
+
+    with query_counter() as queries:
+        response = await async_client.get(
+            f"/api/users/{user_id}", headers={"if-none-match": etag}
+        )
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.content == b""
+    assert queries.count == 0
+
+    response = await async_client.get(
+        "/api/users/me", headers={"api-key": "test1", "if-none-match": etag}
+    )
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    response = await async_client.post(
+        f"/api/users/{user_id}/follow", headers={"api-key": follower}
+    )
+    assert response.status_code == status.HTTP_201_CREATED
+    response = await async_client.get(
+        f"/api/users/{user_id}", headers={"if-none-match": etag}
+    )
+    await async_client.delete(
+        f"/api/users/{user_id}/follow", headers={"api-key": follower}
+    )
+
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["etag"] != etag